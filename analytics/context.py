@@ -0,0 +1,115 @@
+"""
+analytics/context.py
+--------------------
+Fact tables read once per pipeline run and shared by the analytics steps.
+
+An AnalyticsContext reads a fact table the first time a step needs all of
+its rows — only the columns the analytics use, typed by database.reader
+(dates as datetime64) — and hands the same frame to every later step:
+
+* store_sales_header  — loyalty when every transaction is (re)scored,
+                        segment history; RFM segmentation and the spend
+                        forecast aggregate it instead of querying when it is
+                        already loaded
+
+Steps whose SQL aggregate is cheaper than reading the rows (RFM_SQL and
+MONTHLY_SPEND_SQL are covering-index scans) only use a frame that is
+already loaded (``loaded()``); the pipeline decides that in its own node
+ahead of them (main.step_load_context), not by which step runs first.
+Line items are not cached: promotion sensitivity is their only reader,
+stock-out risk uses agg_store_product_daily_qty.
+
+The frames stay valid until a fact table is loaded into again. Each check
+first asks SQLite for ``PRAGMA data_version`` on the context's own
+connection, which only moves when another connection commits; only then are
+the load generations (migration 7, bumped by the ETL) compared, so the
+analytics' own writes to customer_details and friends do not force a reload.
+
+Frames are shared, not copied: callers must not modify them in place
+(pandas' copy-on-write keeps derived frames independent).
+"""
+
+import threading
+import time
+
+import pandas as pd
+
+from database.backends import get_backend
+from database.connection import DB_PATH, open_connection
+
+# Projection of each cached table; the header comes in idx_header_customer_date order
+CONTEXT_SQL = {
+    "store_sales_header": """
+        SELECT transaction_id, customer_id, transaction_date, total_amount
+        FROM store_sales_header
+        ORDER BY customer_id, transaction_date
+    """,
+}
+
+GENERATIONS_SQL = "SELECT table_name, generation FROM load_generations"
+
+
+class AnalyticsContext:
+    """Typed, projected fact tables for one analytics run over ``db_path``."""
+
+    def __init__(self, db_path: str = DB_PATH, backend: str = None):
+        self.db_path = db_path
+        self._backend = get_backend(backend, db_path=db_path)
+        self._conn = None  # own connection, opened on first use: data_version is per connection
+        self._lock = threading.Lock()
+        self._frames = {}
+        self._data_version = None
+        self._generations = None
+        self.loads = {}  # table → times read from the database
+
+    def _stale(self) -> bool:
+        """True if a fact table was loaded into since the frames were read."""
+        if self._conn is None:
+            self._conn = open_connection(self.db_path, readonly=True)
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return False
+        self._data_version = version
+        generations = dict(self._conn.execute(GENERATIONS_SQL).fetchall())
+        changed = self._generations is not None and generations != self._generations
+        self._generations = generations
+        return changed
+
+    def _current(self, name: str):
+        if self._stale():
+            self._frames.clear()
+        return self._frames.get(name)
+
+    def table(self, name: str) -> pd.DataFrame:
+        """The cached projection of fact table ``name`` (see CONTEXT_SQL), read if needed."""
+        if name not in CONTEXT_SQL:
+            raise ValueError(f"Unknown context table {name!r}; expected one of {list(CONTEXT_SQL)}")
+        with self._lock:
+            frame = self._current(name)
+            if frame is None:
+                start = time.perf_counter()
+                frame = self._frames[name] = self._backend.read(CONTEXT_SQL[name])
+                self.loads[name] = self.loads.get(name, 0) + 1
+                print(f"[CONTEXT] {name}: {len(frame)} rows loaded "
+                      f"in {time.perf_counter() - start:.2f}s.")
+            return frame
+
+    def loaded(self, name: str):
+        """The cached projection of ``name`` if it is loaded and current, else None."""
+        with self._lock:
+            return self._current(name)
+
+    @property
+    def header(self) -> pd.DataFrame:
+        return self.table("store_sales_header")
+
+    def invalidate(self) -> None:
+        """Drop every cached frame; the next use reads them again."""
+        with self._lock:
+            self._frames.clear()
+
+    def close(self) -> None:
+        self.invalidate()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
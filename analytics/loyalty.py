@@ -1,110 +1,327 @@
-import os
-import sqlite3
+import math
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+import numpy as np
 import pandas as pd
 
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "database", "retail.db")
+from database.backends import get_backend
+from database.connection import DB_PATH, connection
+from database.reader import DATE_FORMAT
+
+# Transactions not in the ledger yet, or changed since they were scored
+# (an upsert can move a transaction to another customer, amount or date).
+# Only candidates are looked at: ids above the ledger's last one, and the
+# ids the ETL upserted (queued in loyalty_pending by etl.aggregates).
+UNSCORED_SQL = """
+    WITH candidates (transaction_id) AS (
+        SELECT transaction_id FROM store_sales_header
+        WHERE transaction_id > (SELECT IFNULL(MAX(transaction_id), -9223372036854775808)
+                                FROM loyalty_ledger)
+        UNION
+        SELECT transaction_id FROM loyalty_pending
+    )
+    SELECT h.transaction_id, h.customer_id, h.transaction_date, h.total_amount,
+           l.customer_id AS ledger_customer_id, l.points_earned AS ledger_points
+    FROM candidates c
+    JOIN store_sales_header h ON h.transaction_id = c.transaction_id
+    LEFT JOIN loyalty_ledger l ON l.transaction_id = h.transaction_id
+    WHERE l.transaction_id IS NULL
+       OR l.customer_id IS DISTINCT FROM h.customer_id
+       OR l.transaction_date IS DISTINCT FROM h.transaction_date
+       OR l.total_amount IS DISTINCT FROM h.total_amount
+    ORDER BY h.transaction_id
+"""
+
+LEDGER_EMPTY_SQL = "SELECT NOT EXISTS (SELECT 1 FROM loyalty_ledger) AS empty"
+
+CLEAR_PENDING_SQL = "DELETE FROM loyalty_pending"
+
+RULES_SQL = """
+    SELECT rule_id, points_per_unit_spend, min_spend_threshold, bonus_points, start_date, end_date
+    FROM loyalty_rules
+    ORDER BY rule_id
+"""
 
+LEDGER_UPSERT_SQL = """
+    INSERT INTO loyalty_ledger
+        (transaction_id, customer_id, transaction_date, total_amount, rule_id, points_earned)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(transaction_id) DO UPDATE SET
+        customer_id = excluded.customer_id,
+        transaction_date = excluded.transaction_date,
+        total_amount = excluded.total_amount,
+        rule_id = excluded.rule_id,
+        points_earned = excluded.points_earned,
+        scored_at = CURRENT_TIMESTAMP
+"""
 
-def _get_connection(db_path: str = DB_PATH) -> sqlite3.Connection:
-    conn = sqlite3.connect(db_path)
-    conn.execute("PRAGMA foreign_keys = ON;")
-    return conn
+# Stored totals of the customers staged in temp._loyalty_customers; ``accrued``
+# is 0 for customers with nothing in the ledger yet, whose total is replaced
+CUSTOMER_TOTALS_SQL = """
+    SELECT c.customer_id, c.total_loyalty_points,
+           EXISTS (SELECT 1 FROM loyalty_ledger l WHERE l.customer_id = c.customer_id) AS accrued
+    FROM customer_details c
+    JOIN temp._loyalty_customers k ON k.customer_id = c.customer_id
+"""
 
+UPDATE_POINTS_SQL = """
+    UPDATE customer_details
+    SET total_loyalty_points = ?
+    WHERE customer_id = ?
+"""
 
-def calculate_loyalty(db_path: str = DB_PATH) -> pd.DataFrame:
+# loyalty_status by total_loyalty_points, highest tier first
+STATUS_TIERS = ((1000, "Gold"), (500, "Silver"))
+BASE_STATUS = "Bronze"
+
+LOYALTY_STATUS = (
+    "CASE "
+    + " ".join(f"WHEN total_loyalty_points >= {floor} THEN '{status}'" for floor, status in STATUS_TIERS)
+    + f" ELSE '{BASE_STATUS}' END"
+)
+
+# Only rows whose status no longer matches their points are rewritten
+UPDATE_STATUS_SQL = f"""
+    UPDATE customer_details SET loyalty_status = {LOYALTY_STATUS}
+    WHERE loyalty_status IS NOT {LOYALTY_STATUS}
+"""
+
+
+_EPOCH = datetime(1970, 1, 1)
+_ONE_US = timedelta(microseconds=1)
+
+
+def loyalty_status(points) -> str:
+    """Python twin of LOYALTY_STATUS for one total."""
+    for floor, status in STATUS_TIERS:
+        if points is not None and points >= floor:
+            return status
+    return BASE_STATUS
+
+
+def _scalar_ns(date):
+    """One datetime / Timestamp / ISO string → int nanoseconds, or None if missing/invalid."""
+    if date is None or date is pd.NaT:
+        return None
+    if isinstance(date, str):
+        try:
+            date = datetime.fromisoformat(date)
+        except ValueError:
+            return None
+    if isinstance(date, pd.Timestamp):
+        return date.value
+    return (date - _EPOCH) // _ONE_US * 1000
+
+
+def _to_ns(dates) -> tuple:
+    """datetime-like values → (int64 nanoseconds, NaT mask)."""
+    values = pd.to_datetime(pd.Series(dates), errors="coerce").to_numpy(dtype="datetime64[ns]")
+    return values.view("int64"), np.isnat(values)
+
+
+def _round2(values: np.ndarray) -> np.ndarray:
+    """Elementwise ``round(x, 2)`` with Python's (correctly rounded) result.
+
+    np.round scales by 100 before rounding, so a value sitting next to a
+    .xx5 tie can round the other way; those few are redone with round().
     """
-    Calculate loyalty points for every transaction and update customer records.
+    values = np.asarray(values, dtype=float)
+    out = np.round(values, 2)
+    scaled = np.abs(values * 100)
+    tie_gap = np.abs(scaled - np.floor(scaled) - 0.5)
+    for i in np.flatnonzero(tie_gap <= 1e-6 + scaled * 1e-12):
+        out[i] = round(float(values[i]), 2)
+    return out
 
-    Returns
-    -------
-    pd.DataFrame  — points earned per transaction (for auditing).
+
+class RuleIndex:
+    """loyalty_rules as sorted, non-overlapping date intervals.
+
+    Rule windows may overlap: the first rule (by rule_id) whose window
+    contains a date applies, and dates outside every window fall back to the
+    first rule. The windows are cut into elementary intervals at every
+    start/end boundary, each remembering its winning rule, so matching a
+    transaction is one binary search.
     """
-    conn = _get_connection(db_path)
 
-    # Read required tables
-    transactions = pd.read_sql("SELECT * FROM store_sales_header", conn)
-    rules = pd.read_sql("SELECT * FROM loyalty_rules", conn)
+    def __init__(self, rules: pd.DataFrame):
+        self.rule_id = rules["rule_id"].to_numpy()
+        self.rate = rules["points_per_unit_spend"].to_numpy(dtype=float)
+        self.threshold = rules["min_spend_threshold"].to_numpy(dtype=float)
+        self.bonus = rules["bonus_points"].to_numpy(dtype=float)
 
-    if transactions.empty or rules.empty:
-        print("[LOYALTY] No transactions or loyalty rules found — skipping.")
-        conn.close()
-        return pd.DataFrame()
+        start, start_nat = _to_ns(rules["start_date"])
+        end, end_nat = _to_ns(rules["end_date"])
+        usable = np.flatnonzero(~start_nat & ~end_nat & (start <= end))
+        start, end = start[usable], end[usable] + 1  # half-open [start, end + 1ns)
+        self._bounds = np.unique(np.concatenate([start, end]))
+        covers = (start <= self._bounds[:, None]) & (self._bounds[:, None] < end)
+        self._winner = np.where(covers.any(axis=1), usable[covers.argmax(axis=1)], 0)
+        # Plain-Python copies for lookup_one()/points_one(), which skip NumPy overhead
+        self._bounds_list = self._bounds.tolist()
+        self._winner_list = self._winner.tolist()
+        self._terms = list(zip(self.rate.tolist(), self.threshold.tolist(), self.bonus.tolist()))
 
-    # Convert dates
-    transactions["transaction_date"] = pd.to_datetime(
-        transactions["transaction_date"], errors="coerce"
-    )
-    rules["start_date"] = pd.to_datetime(rules["start_date"], errors="coerce")
-    rules["end_date"] = pd.to_datetime(rules["end_date"], errors="coerce")
+    def lookup(self, dates) -> np.ndarray:
+        """Row position (into the rules frame) of the rule for each date."""
+        ns, nat = _to_ns(dates)
+        segment = np.searchsorted(self._bounds, ns, side="right") - 1
+        matched = (segment >= 0) & ~nat
+        pos = np.zeros(len(ns), dtype=np.intp)  # fallback: first rule
+        pos[matched] = self._winner[segment[matched]]
+        return pos
 
-    results = []
+    def points(self, amounts, pos: np.ndarray) -> np.ndarray:
+        """amount × points_per_unit_spend, + bonus_points above the threshold."""
+        amounts = np.asarray(amounts, dtype=float)
+        points = amounts * self.rate[pos]
+        points = np.where(amounts > self.threshold[pos], points + self.bonus[pos], points)
+        return np.round(points, 2)
 
-    for _, txn in transactions.iterrows():
-        txn_date = txn["transaction_date"]
-        total_amt = txn["total_amount"]
-        cust_id = txn["customer_id"]
+    def lookup_one(self, date) -> int:
+        """lookup() for a single date."""
+        ns = _scalar_ns(date)
+        if ns is None:
+            return 0
+        segment = bisect_right(self._bounds_list, ns) - 1
+        return self._winner_list[segment] if segment >= 0 else 0
 
-        # Find applicable rule (transaction date within rule period)
-        applicable = rules[
-            (rules["start_date"] <= txn_date) & (rules["end_date"] >= txn_date)
-        ]
+    def points_one(self, amount, pos: int) -> float:
+        """points() for a single amount, bit-for-bit the same result."""
+        amount = float("nan") if amount is None else float(amount)
+        rate, threshold, bonus = self._terms[pos]
+        points = amount * rate
+        if amount > threshold:
+            points += bonus
+        # np.round(x, 2) is rint(x * 100) / 100; round() to an int is rint too
+        return round(points * 100) / 100 if math.isfinite(points) else points
 
-        if applicable.empty:
-            # Fall back to the first rule if none match date window
-            applicable = rules.head(1)
 
-        rule = applicable.iloc[0]
-        points = total_amt * rule["points_per_unit_spend"]
+def _score(transactions: pd.DataFrame, index: RuleIndex) -> tuple:
+    pos = index.lookup(transactions["transaction_date"])
+    points_df = pd.DataFrame({
+        "transaction_id": transactions["transaction_id"].to_numpy(),
+        "customer_id": transactions["customer_id"].to_numpy(),
+        "total_amount": transactions["total_amount"].to_numpy(dtype=float),
+        "points_earned": index.points(transactions["total_amount"], pos),
+    })
+    return points_df, index.rule_id[pos]
 
-        if total_amt > rule["min_spend_threshold"]:
-            points += rule["bonus_points"]
 
-        results.append(
-            {
-                "transaction_id": txn["transaction_id"],
-                "customer_id": cust_id,
-                "total_amount": total_amt,
-                "points_earned": round(points, 2),
-            }
-        )
+def score_transactions(transactions: pd.DataFrame, rules) -> pd.DataFrame:
+    """Points earned per transaction; ``rules`` is the rules frame or a RuleIndex."""
+    index = rules if isinstance(rules, RuleIndex) else RuleIndex(rules)
+    return _score(transactions, index)[0]
 
-    points_df = pd.DataFrame(results)
 
-    # Aggregate points per customer
-    customer_points = (
-        points_df.groupby("customer_id")["points_earned"].sum().reset_index()
-    )
-    customer_points.rename(
-        columns={"points_earned": "total_loyalty_points"}, inplace=True
+def _all_unscored(header: pd.DataFrame) -> pd.DataFrame:
+    """UNSCORED_SQL's result while the ledger is empty: every header row."""
+    fresh = header.sort_values("transaction_id", ignore_index=True)
+    return fresh.assign(ledger_customer_id=pd.Series(None, index=fresh.index, dtype="str"),
+                        ledger_points=np.nan)
+
+
+def _customer_deltas(points_df: pd.DataFrame, fresh: pd.DataFrame) -> pd.DataFrame:
+    """Points to add per customer: new points, minus what rescored rows had earned."""
+    earned = points_df[["customer_id", "points_earned"]]
+    rescored = fresh["ledger_points"].notna()
+    if rescored.any():
+        earlier = pd.DataFrame({
+            "customer_id": fresh.loc[rescored, "ledger_customer_id"].to_numpy(),
+            "points_earned": -fresh.loc[rescored, "ledger_points"].to_numpy(dtype=float),
+        })
+        earned = pd.concat([earned, earlier], ignore_index=True)
+    return earned.groupby("customer_id")["points_earned"].sum().reset_index()
+
+
+def _apply_deltas(conn, deltas: pd.DataFrame) -> None:
+    """Add ``deltas`` to the stored totals; call before the ledger rows are written."""
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS _loyalty_customers (customer_id TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM temp._loyalty_customers")
+    conn.executemany("INSERT INTO temp._loyalty_customers VALUES (?)",
+                     ((c,) for c in deltas["customer_id"].tolist()))
+    stored = pd.read_sql(CUSTOMER_TOTALS_SQL, conn)
+    conn.execute("DELETE FROM temp._loyalty_customers")
+
+    totals = stored.merge(deltas, on="customer_id")
+    accrued = totals["accrued"].astype(bool).to_numpy()
+    stored_total = totals["total_loyalty_points"].fillna(0).to_numpy(dtype=float)
+    new_total = np.where(accrued, stored_total + totals["points_earned"], totals["points_earned"])
+    conn.executemany(UPDATE_POINTS_SQL, zip(_round2(new_total).tolist(),
+                                            totals["customer_id"].tolist()))
+
+
+def _ledger_rows(points_df: pd.DataFrame, fresh: pd.DataFrame, rule_ids: np.ndarray):
+    dates = fresh["transaction_date"].dt.strftime(DATE_FORMAT).to_numpy(dtype=object)
+    dates[pd.isna(dates)] = None
+    customers = points_df["customer_id"].to_numpy(dtype=object)
+    customers[pd.isna(customers)] = None
+    return zip(
+        points_df["transaction_id"].tolist(), customers.tolist(), dates.tolist(),
+        [None if np.isnan(v) else v for v in points_df["total_amount"].tolist()],
+        rule_ids.tolist(),
+        [None if np.isnan(v) else v for v in points_df["points_earned"].tolist()],
     )
 
-    # Update customer_details in DB
-    cursor = conn.cursor()
-    for _, row in customer_points.iterrows():
-        cursor.execute(
-            """
-            UPDATE customer_details
-            SET total_loyalty_points = ?
-            WHERE customer_id = ?
-            """,
-            (round(row["total_loyalty_points"], 2), row["customer_id"]),
-        )
-
-    # Also update loyalty_status based on points thresholds
-    cursor.execute("""
-        UPDATE customer_details SET loyalty_status = 
-            CASE
-                WHEN total_loyalty_points >= 1000 THEN 'Gold'
-                WHEN total_loyalty_points >= 500  THEN 'Silver'
-                ELSE 'Bronze'
-            END
-    """)
-
-    conn.commit()
-    conn.close()
+
+def ledger_empty(db_path: str = DB_PATH) -> bool:
+    """True while loyalty_ledger is empty (first run, rescore): every transaction gets scored."""
+    return bool(get_backend(db_path=db_path).read(LEDGER_EMPTY_SQL)["empty"].iat[0])
+
+
+def calculate_loyalty(db_path: str = DB_PATH, rescore: bool = False, context=None) -> pd.DataFrame:
+    """
+    Score transactions not yet in loyalty_ledger and add their points to
+    customer records.
+
+    Transactions that changed since they were scored are scored again and
+    only the difference is applied. ``rescore`` clears the ledger and every
+    customer's total first and scores everything again (e.g. after
+    loyalty_rules change). While the ledger is empty (first run, rescore)
+    every transaction is scored, and with an AnalyticsContext they are taken
+    from its header; otherwise only the changed rows are queried: those
+    above the ledger's last transaction_id, and the upserted ones the ETL
+    queued in loyalty_pending.
+
+    Returns
+    -------
+    pd.DataFrame  — points earned per newly scored transaction (for auditing).
+    """
+    if rescore:
+        with connection(db_path) as conn, conn:
+            conn.execute("DELETE FROM loyalty_ledger")
+            conn.execute(CLEAR_PENDING_SQL)
+            conn.execute("UPDATE customer_details SET total_loyalty_points = 0")
+
+    # Read required tables (dates arrive as datetime64)
+    backend = get_backend(db_path=db_path)
+    if context is not None and ledger_empty(db_path):
+        fresh = _all_unscored(context.header)
+    else:
+        fresh = backend.read(UNSCORED_SQL)
+    rules = backend.read(RULES_SQL)
+
+    if fresh.empty or rules.empty:
+        if fresh.empty:
+            # The queued upserts left the scored fields as they were
+            with connection(db_path) as conn, conn:
+                conn.execute(CLEAR_PENDING_SQL)
+        print("[LOYALTY] No new transactions or loyalty rules found — skipping.")
+        return pd.DataFrame()
+
+    points_df, rule_ids = _score(fresh, RuleIndex(rules))
+    deltas = _customer_deltas(points_df, fresh)
+
+    # Customer totals, ledger and statuses change together
+    with connection(db_path) as conn, conn:
+        _apply_deltas(conn, deltas)
+        conn.executemany(LEDGER_UPSERT_SQL, _ledger_rows(points_df, fresh, rule_ids))
+        conn.execute(CLEAR_PENDING_SQL)
+        conn.execute(UPDATE_STATUS_SQL)
 
     print(f"[LOYALTY] Calculated points for {len(points_df)} transactions, "
-          f"updated {len(customer_points)} customers.")
+          f"updated {len(deltas)} customers.")
     return points_df
 
 
@@ -117,4 +334,11 @@ For each transaction:
   points = total_amount * points_per_unit_spend
   if total_amount > min_spend_threshold  →  add bonus_points
 Update total_loyalty_points in customer_details.
+
+Every scored transaction is recorded in loyalty_ledger with the rule applied
+and the points earned, so each run scores only transactions that are new
+(or changed) since the last one and adds the difference to the customer
+totals. Rules are matched to transactions through a RuleIndex (one binary search
+per transaction) and points are computed over whole arrays; ledger rows
+and customer totals are written back in executemany batches.
 """
@@ -0,0 +1,222 @@
+"""
+analytics/loyalty_service.py
+----------------------------
+Point-of-sale loyalty scoring, one transaction (or a small batch) at a time.
+
+LoyaltyService keeps loyalty_rules in a RuleIndex and every customer's
+points total in memory, so scoring is a binary search plus the formula from
+analytics.loyalty — no database access. record() also writes the ledger
+row and the customer's new total/status, in the same way calculate_loyalty()
+would, so the nightly batch treats those transactions as already scored.
+
+The service owns the totals of the customers it updates while it runs; call
+refresh() after calculate_loyalty() or a rules change.
+
+    python -m analytics.loyalty_service [port]
+
+serves a local JSON endpoint:
+
+    POST /score    {"transaction_date": ..., "total_amount": ...}   (or a list)
+    POST /record   {"transaction_id": ..., "customer_id": ..., "transaction_date": ...,
+                    "total_amount": ...}                             (or a list)
+    GET  /customers/<customer_id>
+"""
+
+import json
+import math
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+import pandas as pd
+
+from analytics.loyalty import (
+    BASE_STATUS, LEDGER_UPSERT_SQL, RULES_SQL, RuleIndex, loyalty_status,
+)
+from database.connection import DB_PATH, open_connection
+from database.reader import DATE_FORMAT, read_frame
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+CUSTOMERS_SQL = """
+    SELECT c.customer_id, c.total_loyalty_points,
+           EXISTS (SELECT 1 FROM loyalty_ledger l WHERE l.customer_id = c.customer_id) AS accrued
+    FROM customer_details c
+"""
+
+CUSTOMER_SQL = CUSTOMERS_SQL + "    WHERE c.customer_id = ?\n"
+
+LEDGER_ROW_SQL = "SELECT customer_id, points_earned FROM loyalty_ledger WHERE transaction_id = ?"
+
+UPDATE_CUSTOMER_SQL = """
+    UPDATE customer_details SET total_loyalty_points = ?, loyalty_status = ?
+    WHERE customer_id = ?
+"""
+
+
+def _ledger_date(date):
+    """The transaction date as DATE_FORMAT text, the way the ETL stores it."""
+    if date is None or date is pd.NaT:
+        return None
+    if isinstance(date, str):
+        try:
+            date = datetime.fromisoformat(date)
+        except ValueError:
+            return None
+    return date.strftime(DATE_FORMAT)
+
+
+class LoyaltyService:
+    """In-memory loyalty scorer writing through to loyalty_ledger/customer_details."""
+
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = open_connection(db_path)
+        # One small commit per sale: WAL + NORMAL syncs at checkpoints, not every commit
+        self._conn.execute("PRAGMA synchronous = NORMAL;")
+        self.refresh()
+
+    def refresh(self) -> None:
+        """Reload the rules and the customer totals from the database."""
+        with self._lock:
+            rules = read_frame(RULES_SQL, self._conn)
+            self.index = RuleIndex(rules) if not rules.empty else None
+            self._totals, self._accrued = {}, set()
+            for customer_id, total, accrued in self._conn.execute(CUSTOMERS_SQL):
+                self._totals[customer_id] = total
+                if accrued:
+                    self._accrued.add(customer_id)
+            self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def score(self, transaction_date, total_amount) -> tuple:
+        """(rule_id, points_earned) for one transaction, without recording it."""
+        if self.index is None:
+            raise LookupError("no loyalty rules loaded")
+        pos = self.index.lookup_one(transaction_date)
+        return int(self.index.rule_id[pos]), self.index.points_one(total_amount, pos)
+
+    def _load_customer(self, customer_id) -> None:
+        """Cache the stored total of a customer added since refresh() (e.g. by the ETL)."""
+        if customer_id is None or customer_id in self._totals:
+            return
+        row = self._conn.execute(CUSTOMER_SQL, (customer_id,)).fetchone()
+        self._totals[customer_id] = row[1] if row else None
+        if row and row[2]:
+            self._accrued.add(customer_id)
+
+    def customer(self, customer_id) -> dict:
+        total = self._totals.get(customer_id)
+        return {"customer_id": customer_id, "total_loyalty_points": total,
+                "loyalty_status": loyalty_status(total) if total is not None else BASE_STATUS}
+
+    def record(self, transaction_id, customer_id, transaction_date, total_amount) -> dict:
+        """Score one sale, add it to the ledger and its customer's total."""
+        return self.record_many([{
+            "transaction_id": transaction_id, "customer_id": customer_id,
+            "transaction_date": transaction_date, "total_amount": total_amount,
+        }])[0]
+
+    def record_many(self, sales: list) -> list:
+        """record() for a micro-batch of sale dicts, committed together."""
+        with self._lock, self._conn:
+            results, deltas = [], {}
+            for sale in sales:
+                rule_id, points = self.score(sale["transaction_date"], sale["total_amount"])
+                # Re-recording a sale replaces what it earned before
+                earlier = self._conn.execute(LEDGER_ROW_SQL, (sale["transaction_id"],)).fetchone()
+                # Before the ledger write below, which would make the customer look accrued
+                self._load_customer(sale["customer_id"])
+                if earlier:
+                    self._load_customer(earlier[0])
+                if earlier and earlier[0] is not None and earlier[1] is not None:
+                    deltas[earlier[0]] = deltas.get(earlier[0], 0.0) - earlier[1]
+                if sale["customer_id"] is not None and not math.isnan(points):
+                    deltas[sale["customer_id"]] = deltas.get(sale["customer_id"], 0.0) + points
+                amount = None if sale["total_amount"] is None else float(sale["total_amount"])
+                self._conn.execute(LEDGER_UPSERT_SQL, (
+                    sale["transaction_id"], sale["customer_id"], _ledger_date(sale["transaction_date"]),
+                    amount, rule_id, None if math.isnan(points) else points,
+                ))
+                results.append({"transaction_id": sale["transaction_id"],
+                                "customer_id": sale["customer_id"],
+                                "rule_id": rule_id, "points_earned": points})
+
+            # Same arithmetic as calculate_loyalty(): add to an accrued total, else replace it
+            for customer_id, delta in deltas.items():
+                stored = self._totals.get(customer_id)
+                total = (stored or 0.0) + delta if customer_id in self._accrued else delta
+                total = round(total, 2)
+                self._conn.execute(UPDATE_CUSTOMER_SQL, (total, loyalty_status(total), customer_id))
+                self._totals[customer_id] = total
+                self._accrued.add(customer_id)
+
+        for result in results:
+            result.update(self.customer(result["customer_id"]))
+        return results
+
+
+def _handler(service: LoyaltyService):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, so a client reuses its connection
+        disable_nagle_algorithm = True  # headers and body go out as separate writes
+
+        def _reply(self, status: int, payload) -> None:
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                sales = payload if isinstance(payload, list) else [payload]
+                if self.path == "/score":
+                    result = [dict(zip(("rule_id", "points_earned"),
+                                       service.score(s.get("transaction_date"), s.get("total_amount"))))
+                              for s in sales]
+                elif self.path == "/record":
+                    result = service.record_many(sales)
+                else:
+                    return self._reply(404, {"error": f"unknown path {self.path}"})
+            except (KeyError, TypeError, ValueError, LookupError) as e:
+                return self._reply(400, {"error": str(e)})
+            self._reply(200, result if isinstance(payload, list) else result[0])
+
+        def do_GET(self):
+            prefix = "/customers/"
+            if not self.path.startswith(prefix):
+                return self._reply(404, {"error": f"unknown path {self.path}"})
+            self._reply(200, service.customer(unquote(self.path[len(prefix):])))
+
+        def log_message(self, *args):
+            pass  # one line per sale would dominate the latency
+
+    return Handler
+
+
+def serve(service: LoyaltyService, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    """Bind the JSON endpoint for ``service``; the caller runs serve_forever()."""
+    return ThreadingHTTPServer((host, port), _handler(service))
+
+
+if __name__ == "__main__":
+    import sys
+
+    service = LoyaltyService()
+    server = serve(service, port=int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PORT)
+    print(f"[LOYALTY] Scoring service on http://{server.server_address[0]}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
@@ -1,44 +1,126 @@
 
 
-import os
-import sqlite3
 from datetime import datetime
 
 import numpy as np
 import pandas as pd
 
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "database", "retail.db")
-
-
-def _get_connection(db_path: str = DB_PATH) -> sqlite3.Connection:
-    conn = sqlite3.connect(db_path)
-    conn.execute("PRAGMA foreign_keys = ON;")
-    return conn
-
-
+from database.backends import get_backend
+from database.connection import DB_PATH, connection
+
+# Read queries, run by the configured backend (see database/backends.py)
+MONTHLY_SPEND_SQL = """
+    SELECT customer_id,
+           substr(transaction_date, 1, 7) AS year_month,
+           ROUND(SUM(total_amount), 2) AS total_amount
+    FROM store_sales_header
+    WHERE transaction_date IS NOT NULL AND customer_id IS NOT NULL
+    GROUP BY customer_id, substr(transaction_date, 1, 7)
+    ORDER BY customer_id, year_month
+"""
+
+# Rolling demand windows in days; a store's weekly demand for a product is the
+# higher of its short- and long-window daily rates, times 7
+SHORT_WINDOW, LONG_WINDOW = 7, 28
+
+# Store/product/day quantities are kept up to date by the ETL (etl/aggregates.py)
+LAST_DAY_SQL = "SELECT MAX(transaction_day) AS last_day FROM agg_store_product_daily_qty"
+
+# Quantities per store and product in the windows ending on day ? (one range
+# of the aggregate's primary key); params: (last_day,) * 3
+STORE_DEMAND_SQL = f"""
+    SELECT store_id, product_id, qty_{SHORT_WINDOW}d, qty_{LONG_WINDOW}d,
+           ROUND(7.0 * CASE WHEN qty_{SHORT_WINDOW}d * {LONG_WINDOW} > qty_{LONG_WINDOW}d * {SHORT_WINDOW}
+                            THEN qty_{SHORT_WINDOW}d / {SHORT_WINDOW}.0
+                            ELSE qty_{LONG_WINDOW}d / {LONG_WINDOW}.0 END, 2) AS weekly_demand
+    FROM (
+        SELECT store_id, product_id,
+               CAST(SUM(CASE WHEN transaction_day > ? - {SHORT_WINDOW} THEN total_qty ELSE 0 END)
+                    AS BIGINT) AS qty_{SHORT_WINDOW}d,
+               CAST(SUM(total_qty) AS BIGINT) AS qty_{LONG_WINDOW}d
+        FROM agg_store_product_daily_qty
+        WHERE transaction_day > ? - {LONG_WINDOW} AND transaction_day <= ?
+        GROUP BY product_id, store_id
+    ) AS w
+"""
+
+# Per product: the stores' weekly demands added up, against the chain-wide
+# stock (grouped before the join, so the sort keys stay narrow)
+PRODUCT_DEMAND_SQL = f"""
+    SELECT p.product_id, p.product_name, p.current_stock_level,
+           d.stores, d.qty_{SHORT_WINDOW}d, d.qty_{LONG_WINDOW}d, d.weekly_demand
+    FROM (
+        SELECT product_id, COUNT(*) AS stores,
+               CAST(SUM(qty_{SHORT_WINDOW}d) AS BIGINT) AS qty_{SHORT_WINDOW}d,
+               CAST(SUM(qty_{LONG_WINDOW}d) AS BIGINT) AS qty_{LONG_WINDOW}d,
+               ROUND(SUM(weekly_demand), 2) AS weekly_demand
+        FROM ({STORE_DEMAND_SQL}) AS s
+        GROUP BY product_id
+    ) AS d
+    JOIN products p ON p.product_id = d.product_id
+    ORDER BY p.product_id
+"""
+
+# Every product's flag follows the current windows: set if staged in
+# temp._restock, cleared otherwise; unchanged rows are not rewritten
+RESTOCK_UPDATE_SQL = """
+    UPDATE products
+    SET restock_flag = (product_id IN (SELECT product_id FROM temp._restock))
+    WHERE restock_flag IS NOT (product_id IN (SELECT product_id FROM temp._restock))
+"""
+
+# Line items and promoted line items per customer and promotion category, in
+# one pass; category is NULL for unpromoted lines (and unknown promotions)
+PROMO_PURCHASES_SQL = """
+    SELECT h.customer_id, pd.applicable_category AS category,
+           COUNT(li.line_item_id) AS total_purchases,
+           CAST(SUM(CASE WHEN li.promotion_id IS NOT NULL AND li.promotion_id <> 0
+                         THEN 1 ELSE 0 END) AS BIGINT) AS promo_purchases
+    FROM store_sales_line_items li
+    JOIN store_sales_header h ON h.transaction_id = li.transaction_id
+    LEFT JOIN promotion_details pd ON pd.promotion_id = li.promotion_id
+    WHERE h.customer_id IS NOT NULL
+    GROUP BY h.customer_id, pd.applicable_category
+    ORDER BY h.customer_id, category
+"""
+
+# Response rate (%) above which a customer is HIGH, at or above which MEDIUM
+SENSITIVITY_THRESHOLDS = {"HIGH": 50, "MEDIUM": 20}
+
+SENSITIVITY_UPDATE_SQL = """
+    UPDATE customer_details SET promotion_sensitivity = ?
+    WHERE customer_id = ? AND promotion_sensitivity IS NOT ?
+"""
+
+
+def _monthly_spend(header: pd.DataFrame) -> pd.DataFrame:
+    """MONTHLY_SPEND_SQL over an AnalyticsContext's header."""
+    header = header.loc[header["customer_id"].notna() & header["transaction_date"].notna()]
+    monthly = (
+        header.groupby(["customer_id", header["transaction_date"].dt.to_period("M").rename("year_month")])
+        ["total_amount"].sum(min_count=1)  # all-NULL months stay NULL, as SUM() does
+        .round(2)
+        .reset_index()
+    )
+    monthly["year_month"] = monthly["year_month"].astype(str)
+    return monthly
 
 
-def predict_future_spend(db_path: str = DB_PATH) -> pd.DataFrame:
+def predict_future_spend(db_path: str = DB_PATH, context=None) -> pd.DataFrame:
     
-    conn = _get_connection(db_path)
-    txn = pd.read_sql("SELECT * FROM store_sales_header", conn)
-    conn.close()
-
-    if txn.empty:
+    # Spend per customer and month ("YYYY-MM"), sorted by customer then month;
+    # from the context's header only if it is loaded (the pipeline's context node decides)
+    header = context.loaded("store_sales_header") if context is not None else None
+    if header is not None:
+        monthly = _monthly_spend(header)
+    else:
+        monthly = get_backend(db_path=db_path).read(MONTHLY_SPEND_SQL)
+
+    if monthly.empty:
         print("[PREDICT] No transactions — cannot predict spend.")
         return pd.DataFrame()
 
-    txn["transaction_date"] = pd.to_datetime(txn["transaction_date"], errors="coerce")
-    txn["year_month"] = txn["transaction_date"].dt.to_period("M")
-
-    monthly = (
-        txn.groupby(["customer_id", "year_month"])["total_amount"]
-        .sum()
-        .reset_index()
-    )
-
     # Last 3 months per customer
-    monthly = monthly.sort_values(["customer_id", "year_month"])
     last3 = monthly.groupby("customer_id").tail(3)
 
     future = (
@@ -53,117 +135,121 @@ def predict_future_spend(db_path: str = DB_PATH) -> pd.DataFrame:
     return future
 
 
-def stock_out_risk(db_path: str = DB_PATH) -> pd.DataFrame:
-    
-    conn = _get_connection(db_path)
-    line_items = pd.read_sql("SELECT * FROM store_sales_line_items", conn)
-    products = pd.read_sql("SELECT * FROM products", conn)
-    txn = pd.read_sql("SELECT transaction_id, transaction_date FROM store_sales_header", conn)
+def _last_day(backend, as_of=None):
+    """Epoch day the windows end on: ``as_of``, else the latest day with sales."""
+    if as_of is not None:
+        return int((pd.Timestamp(as_of).normalize() - pd.Timestamp(0)).days)
+    last = backend.read(LAST_DAY_SQL)["last_day"].iat[0]
+    return None if pd.isna(last) else int(last)
 
-    if line_items.empty or products.empty:
-        print("[PREDICT] Insufficient data for stock-out risk.")
-        conn.close()
-        return pd.DataFrame()
 
-    # Merge to get transaction dates
-    merged = line_items.merge(txn, on="transaction_id", how="left")
-    merged["transaction_date"] = pd.to_datetime(merged["transaction_date"], errors="coerce")
+def store_product_demand(db_path: str = DB_PATH, store_id: int = None, as_of=None) -> pd.DataFrame:
+    """Rolling-window quantities and weekly demand per store and product.
 
-    # Calculate date range for avg daily sales
-    date_range = (merged["transaction_date"].max() - merged["transaction_date"].min()).days
-    if date_range <= 0:
-        date_range = 1
-
-    daily_sales = (
-        merged.groupby("product_id")["quantity"]
-        .sum()
-        .reset_index()
-        .rename(columns={"quantity": "total_qty_sold"})
-    )
-    daily_sales["avg_daily_sales"] = (daily_sales["total_qty_sold"] / date_range).round(2)
+    Aggregated in SQL over the days in the long window only; ``store_id``
+    limits it to one store.
+    """
+    backend = get_backend(db_path=db_path)
+    last_day = _last_day(backend, as_of)
+    if last_day is None:
+        return pd.DataFrame()
+    sql, params = STORE_DEMAND_SQL, (last_day,) * 3
+    if store_id is not None:
+        sql = f"SELECT * FROM ({sql}) AS s WHERE store_id = ? ORDER BY product_id"
+        params += (store_id,)
+    else:
+        sql += " ORDER BY store_id, product_id"
+    return backend.read(sql, params)
+
+
+def stock_out_risk(db_path: str = DB_PATH, as_of=None) -> pd.DataFrame:
+    """Flag products whose weekly demand, summed over stores, exceeds stock.
+
+    Each store's demand comes from its own 7- and 28-day windows
+    (STORE_DEMAND_SQL), so a spike at one store is not averaged away by the
+    rest of the chain or by older history.
+    """
+    backend = get_backend(db_path=db_path)
+    last_day = _last_day(backend, as_of)
+    if last_day is None:
+        print("[PREDICT] Insufficient data for stock-out risk.")
+        return pd.DataFrame()
+    # No sales in the windows means no product is at risk: flags are cleared
+    risk = backend.read(PRODUCT_DEMAND_SQL, (last_day,) * 3)
 
-    risk = daily_sales.merge(
-        products[["product_id", "product_name", "current_stock_level"]],
-        on="product_id",
-        how="left",
-    )
-    risk["weekly_demand"] = (risk["avg_daily_sales"] * 7).round(2)
     risk["stock_out_risk"] = risk["weekly_demand"] > risk["current_stock_level"]
 
-    # Update restock_flag in products table
+    # Recompute restock_flag for all products: stage the flagged ids, one UPDATE
     at_risk_ids = risk.loc[risk["stock_out_risk"], "product_id"].tolist()
-    if at_risk_ids:
-        placeholders = ",".join("?" * len(at_risk_ids))
-        cursor = conn.cursor()
-        cursor.execute(
-            f"UPDATE products SET restock_flag = 1 WHERE product_id IN ({placeholders})",
-            at_risk_ids,
-        )
-        conn.commit()
-
-    conn.close()
-    print(f"[PREDICT] Stock-out risk: {risk['stock_out_risk'].sum()} products flagged.")
+    with connection(db_path) as conn, conn:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS _restock (product_id TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM temp._restock")
+        conn.executemany("INSERT INTO temp._restock VALUES (?)", ((p,) for p in at_risk_ids))
+        conn.execute(RESTOCK_UPDATE_SQL)
+        conn.execute("DELETE FROM temp._restock")
+
+    print(f"[PREDICT] Stock-out risk: {risk['stock_out_risk'].sum()} products flagged "
+          f"({SHORT_WINDOW}/{LONG_WINDOW}-day windows to day {last_day}).")
     return risk
 
 
-def promotion_sensitivity(db_path: str = DB_PATH) -> pd.DataFrame:
-    
-    conn = _get_connection(db_path)
-    line_items = pd.read_sql("SELECT * FROM store_sales_line_items", conn)
-    txn = pd.read_sql("SELECT transaction_id, customer_id FROM store_sales_header", conn)
+def classify_sensitivity(response_rate) -> np.ndarray:
+    """HIGH / MEDIUM / LOW for an array of response rates (see SENSITIVITY_THRESHOLDS)."""
+    rate = np.asarray(response_rate, dtype=float)
+    return np.select(
+        [rate > SENSITIVITY_THRESHOLDS["HIGH"], rate >= SENSITIVITY_THRESHOLDS["MEDIUM"]],
+        ["HIGH", "MEDIUM"],
+        "LOW",
+    )
 
-    if line_items.empty:
-        print("[PREDICT] No line items — cannot compute promo sensitivity.")
-        conn.close()
-        return pd.DataFrame()
 
-    merged = line_items.merge(txn, on="transaction_id", how="left")
+def promotion_sensitivity(db_path: str = DB_PATH) -> pd.DataFrame:
+    """Classify every customer's promotion response and store it in customer_details.
 
-    total_per_cust = merged.groupby("customer_id")["line_item_id"].count().reset_index()
-    total_per_cust.rename(columns={"line_item_id": "total_purchases"}, inplace=True)
+    Besides the overall response_rate, each promotion category gets a
+    ``rate_<category>`` column: the share (%) of the customer's line items
+    bought under a promotion of that category — the customers × categories
+    matrix, from the same read.
+    """
+    # Line items and promoted line items per customer and category, counted by the backend
+    counts = get_backend(db_path=db_path).read(PROMO_PURCHASES_SQL)
 
-    promo_mask = merged["promotion_id"].notna() & (merged["promotion_id"] != 0)
-    promo_per_cust = (
-        merged.loc[promo_mask]
-        .groupby("customer_id")["line_item_id"]
-        .count()
-        .reset_index()
-    )
-    promo_per_cust.rename(columns={"line_item_id": "promo_purchases"}, inplace=True)
+    if counts.empty:
+        print("[PREDICT] No line items — cannot compute promo sensitivity.")
+        return pd.DataFrame()
 
-    result = total_per_cust.merge(promo_per_cust, on="customer_id", how="left")
-    result["promo_purchases"] = result["promo_purchases"].fillna(0).astype(int)
+    result = counts.groupby("customer_id", sort=True, as_index=False)[
+        ["total_purchases", "promo_purchases"]].sum()
     result["response_rate"] = (
         result["promo_purchases"] / result["total_purchases"] * 100
     ).round(2)
+    result["promotion_sensitivity"] = classify_sensitivity(result["response_rate"])
+
+    by_category = (
+        counts.dropna(subset=["category"])
+        .pivot(index="customer_id", columns="category", values="promo_purchases")
+        .reindex(result["customer_id"])
+        .fillna(0)
+    )
+    rates = by_category.div(result["total_purchases"].to_numpy(), axis=0).mul(100).round(2)
+    rates.columns = [f"rate_{category}" for category in rates.columns]
+    result = pd.concat([result, rates.reset_index(drop=True)], axis=1)
+
+    # Update customer_details in one batch, skipping unchanged rows
+    labels = result["promotion_sensitivity"].tolist()
+    with connection(db_path) as conn, conn:
+        conn.executemany(SENSITIVITY_UPDATE_SQL, zip(labels, result["customer_id"].tolist(), labels))
 
-    def _classify(rate):
-        if rate > 50:
-            return "HIGH"
-        elif rate >= 20:
-            return "MEDIUM"
-        return "LOW"
-
-    result["promotion_sensitivity"] = result["response_rate"].apply(_classify)
-
-    # Update customer_details
-    cursor = conn.cursor()
-    for _, row in result.iterrows():
-        cursor.execute(
-            "UPDATE customer_details SET promotion_sensitivity = ? WHERE customer_id = ?",
-            (row["promotion_sensitivity"], row["customer_id"]),
-        )
-    conn.commit()
-    conn.close()
-
-    print(f"[PREDICT] Promotion sensitivity calculated for {len(result)} customers.")
+    print(f"[PREDICT] Promotion sensitivity calculated for {len(result)} customers "
+          f"across {len(rates.columns)} promotion categories.")
     print(result["promotion_sensitivity"].value_counts().to_string())
     return result
 
 
-def run_predictive(db_path: str = DB_PATH) -> dict:
+def run_predictive(db_path: str = DB_PATH, context=None) -> dict:
     
-    spend = predict_future_spend(db_path)
+    # Only the spend forecast reads the header; the others aggregate line items
+    spend = predict_future_spend(db_path, context)
     stock = stock_out_risk(db_path)
     promo = promotion_sensitivity(db_path)
     return {"future_spend": spend, "stock_out_risk": stock, "promo_sensitivity": promo}
@@ -1,92 +1,398 @@
-import os
-import sqlite3
+"""
+analytics/segmentation.py
+-------------------------
+RFM segmentation.
+
+The exact mode (default) reads every customer's recency, frequency and
+monetary and scores them with pd.qcut. The sketch mode keeps them in
+rfm_state, refreshed only for the customers the ETL queued in rfm_pending,
+and takes the quintile cut points from quantile sketches in rfm_sketch that
+are updated with each refresh (analytics/sketches.py). Scores and segments
+are then assigned in one SQL UPDATE, so neither transactions nor customers
+are held in memory.
+
+Error bound of the sketch mode against the exact mode:
+
+* frequency — exact histogram; identical cut points and F scores
+* recency   — exact histogram of the last purchase day; recency is counted
+              in calendar days (today's day − last day) rather than whole
+              24-hour periods, so a customer's recency can be 1 higher than
+              the exact mode's, which can move them across an R cut point
+* monetary  — log buckets with 0.5% relative accuracy; every cut point is
+              within 0.5% of the exact qcut edge, so only customers whose
+              monetary lies within 0.5% of an edge can get the adjacent M
+              score, never one further away
+
+benchmarks/check_rfm_sketch.py measures both on a database copy and on
+synthetic data.
+"""
+
+import numpy as np
 import pandas as pd
 from datetime import datetime
 
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "database", "retail.db")
+from analytics.sketches import HistogramSketch
+from database.backends import get_backend
+from database.connection import DB_PATH, connection
+from database.reader import DATE_FORMAT
+
+RFM_SQL = """
+    SELECT customer_id,
+           MAX(transaction_date) AS transaction_date,
+           COUNT(transaction_id) AS frequency,
+           ROUND(COALESCE(SUM(total_amount), 0), 2) AS monetary
+    FROM store_sales_header
+    WHERE transaction_date IS NOT NULL AND customer_id IS NOT NULL
+    GROUP BY customer_id
+    ORDER BY customer_id
+"""
+
+
+SEGMENT_UPDATE_SQL = "UPDATE customer_details SET segment_id = ? WHERE customer_id = ?"
+
+# exact: pd.qcut over every customer (default); sketch: running rfm_state + quantile sketches
+RFM_MODES = ("exact", "sketch")
+
+# rfm_sketch metrics → relative accuracy (None: exact integer histogram)
+SKETCH_METRICS = {"last_day": None, "frequency": None, "monetary": 0.005}
+
+# Pending customers folded into rfm_state per transaction
+FOLD_BATCH_SIZE = 50_000
+
+# RFM_SQL for the customers staged in temp._rfm_batch, via idx_header_customer_date.
+# CROSS JOIN keeps the batch as the outer loop: without statistics SQLite
+# prefers scanning the whole index to skip the GROUP BY sort
+BATCH_RFM_SQL = """
+    SELECT b.customer_id,
+           MAX(h.transaction_date) AS last_transaction_date,
+           CAST(julianday(date(MAX(h.transaction_date))) - 2440587.5 AS INTEGER) AS last_day,
+           COUNT(h.transaction_id) AS frequency,
+           ROUND(COALESCE(SUM(h.total_amount), 0), 2) AS monetary
+    FROM temp._rfm_batch b
+    CROSS JOIN store_sales_header h ON h.customer_id = b.customer_id
+    WHERE h.transaction_date IS NOT NULL
+    GROUP BY b.customer_id
+"""
+
+BATCH_STATE_SQL = """
+    SELECT s.customer_id, s.last_day, s.frequency, s.monetary
+    FROM temp._rfm_batch b JOIN rfm_state s ON s.customer_id = b.customer_id
+"""
+
+SKETCH_UPSERT_SQL = """
+    INSERT INTO rfm_sketch (metric, bucket, customers) VALUES (?, ?, ?)
+    ON CONFLICT(metric, bucket) DO UPDATE SET customers = customers + excluded.customers
+"""
+
+
+def _score_case(expr: str, name: str, labels: list) -> str:
+    """SQL twin of the quintile scoring: ``expr`` against cut points :<name>1..4."""
+    whens = " ".join(f"WHEN {expr} <= :{name}{i} THEN {label}" for i, label in enumerate(labels[:4], 1))
+    return f"CASE {whens} ELSE {labels[4]} END"
+
+
+SKETCH_SEGMENT_SQL = f"""
+    UPDATE customer_details SET segment_id = s.segment
+    FROM (
+        SELECT st.customer_id, seg.segment
+        FROM rfm_state st
+        JOIN temp._rfm_segments seg
+          ON seg.r = {_score_case("(:now - st.last_day)", "r", [5, 4, 3, 2, 1])}
+         AND seg.f = {_score_case("st.frequency", "f", [1, 2, 3, 4, 5])}
+         AND seg.m = {_score_case("st.monetary", "m", [1, 2, 3, 4, 5])}
+    ) AS s
+    WHERE customer_details.customer_id = s.customer_id
+      AND customer_details.segment_id IS NOT s.segment
+"""
+
+# Transactions up to the last cutoff, in idx_header_customer_date order (no sort)
+HISTORY_TXNS_SQL = """
+    SELECT customer_id, transaction_date, total_amount
+    FROM store_sales_header
+    WHERE transaction_date IS NOT NULL AND customer_id IS NOT NULL AND transaction_date <= ?
+    ORDER BY customer_id, transaction_date
+"""
 
+HISTORY_COLUMNS = ["as_of", "customer_id", "recency", "frequency", "monetary", "RFM_score", "segment"]
 
-def _get_connection(db_path: str = DB_PATH) -> sqlite3.Connection:
-    conn = sqlite3.connect(db_path)
-    conn.execute("PRAGMA foreign_keys = ON;")
-    return conn
+SEGMENT_COUNTS_SQL = """
+    SELECT c.segment_id AS segment, COUNT(*) AS customers
+    FROM rfm_state s JOIN customer_details c ON c.customer_id = s.customer_id
+    GROUP BY c.segment_id
+    ORDER BY customers DESC, segment
+"""
 
 
-def perform_segmentation(db_path: str = DB_PATH) -> pd.DataFrame:
+def _segment_rule(r: int, f: int, m: int) -> str:
+    if r >= 4 and f >= 4 and m >= 4:
+        return "Champions"
+    elif r >= 3 and f >= 3 and m >= 3:
+        return "Loyal Customers"
+    elif r >= 3 and f >= 1 and m >= 1:
+        return "Potential Loyalists"
+    elif r >= 2 and f >= 2 and m >= 2:
+        return "At Risk"
+    elif r >= 1 and f >= 1 and m >= 1:
+        return "Lost"
+    else:
+        return "New Customers"
+
+
+# Segment of every (R, F, M) score combination, indexed [R-1, F-1, M-1]
+SEGMENT_LOOKUP = np.array(
+    [[[_segment_rule(r, f, m) for m in range(1, 6)] for f in range(1, 6)] for r in range(1, 6)],
+    dtype=object,
+)
+
+
+def _quintiles(values: pd.Series, labels: list) -> pd.Series:
+    """1-5 scores by quintile, or by equal-width bins when quintile edges repeat."""
+    try:
+        return pd.qcut(values, 5, labels=labels, duplicates="drop")
+    except ValueError:
+        return pd.cut(values, 5, labels=labels)
+
+
+def score_rfm(rfm: pd.DataFrame) -> pd.DataFrame:
+    """Add R/F/M scores, RFM_score and segment to a recency/frequency/monetary frame."""
+    # Score each component (1-5 scale, 5 being best)
+    rfm["R_score"] = _quintiles(rfm["recency"], [5, 4, 3, 2, 1])
+    rfm["F_score"] = _quintiles(rfm["frequency"], [1, 2, 3, 4, 5])
+    rfm["M_score"] = _quintiles(rfm["monetary"], [1, 2, 3, 4, 5])
+
+    r, f, m = (rfm[c].to_numpy(dtype=np.int64) for c in ("R_score", "F_score", "M_score"))
+    rfm["RFM_score"] = pd.Series(r * 100 + f * 10 + m, index=rfm.index).astype(str)
+    rfm["segment"] = pd.Series(SEGMENT_LOOKUP[r - 1, f - 1, m - 1], index=rfm.index, dtype="str")
+    return rfm
+
+
+def fold_rfm_state(conn) -> int:
+    """Recompute rfm_state for the customers in rfm_pending; return how many.
+
+    Each customer's old values leave the sketches and the new ones enter,
+    so rfm_sketch always describes rfm_state exactly.
+    """
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS _rfm_batch (customer_id TEXT PRIMARY KEY)")
+    folded = 0
+    while True:
+        with conn:
+            batch = conn.execute("SELECT customer_id FROM rfm_pending LIMIT ?",
+                                 (FOLD_BATCH_SIZE,)).fetchall()
+            if not batch:
+                break
+            conn.execute("DELETE FROM temp._rfm_batch")
+            conn.executemany("INSERT INTO temp._rfm_batch (customer_id) VALUES (?)", batch)
+            old = pd.read_sql(BATCH_STATE_SQL, conn)
+            new = pd.read_sql(BATCH_RFM_SQL, conn)
+            for metric, accuracy in SKETCH_METRICS.items():
+                delta = HistogramSketch(accuracy).add(new[metric]).add(old[metric], weight=-1)
+                conn.executemany(SKETCH_UPSERT_SQL, ((metric, b, c) for b, c in delta.counts.items()))
+            conn.execute("DELETE FROM rfm_sketch WHERE customers <= 0")
+            conn.execute("DELETE FROM rfm_state WHERE customer_id IN (SELECT customer_id FROM temp._rfm_batch)")
+            conn.executemany(
+                "INSERT INTO rfm_state (customer_id, last_transaction_date, last_day, frequency, monetary) "
+                "VALUES (?, ?, ?, ?, ?)",
+                new.to_numpy(dtype=object).tolist(),  # plain Python values for sqlite3
+            )
+            conn.execute("DELETE FROM rfm_pending WHERE customer_id IN (SELECT customer_id FROM temp._rfm_batch)")
+            conn.execute("DELETE FROM temp._rfm_batch")
+        folded += len(batch)
+    return folded
+
+
+def load_sketches(conn) -> dict:
+    """{metric: HistogramSketch} from rfm_sketch."""
+    sketches = {metric: HistogramSketch(accuracy) for metric, accuracy in SKETCH_METRICS.items()}
+    for metric, bucket, customers in conn.execute("SELECT metric, bucket, customers FROM rfm_sketch"):
+        sketches[metric].counts[bucket] = customers
+    return sketches
+
+
+def _cut_points(sketch: HistogramSketch) -> list:
+    """The four inner quintile edges score_rfm() would use: qcut's, or cut's equal
+    widths when quintile edges repeat."""
+    edges = sketch.quantiles([0, 0.2, 0.4, 0.6, 0.8, 1])
+    if len(np.unique(edges)) < len(edges):
+        lo, hi = edges[0], edges[-1]
+        if lo == hi:
+            lo, hi = lo - (0.001 * abs(lo) if lo else 0.001), hi + (0.001 * abs(hi) if hi else 0.001)
+        edges = np.linspace(lo, hi, 6)
+    return edges[1:5].tolist()
+
+
+def rfm_cut_points(sketches: dict) -> dict:
+    """SKETCH_SEGMENT_SQL parameters: today's epoch day and the R/F/M cut points."""
+    last_day = sketches["last_day"]
+    now = max(last_day.counts)
+    recency = HistogramSketch(counts={now - day: n for day, n in last_day.counts.items()})
+    params = {"now": now}
+    for name, sketch in (("r", recency), ("f", sketches["frequency"]), ("m", sketches["monetary"])):
+        params.update({f"{name}{i}": edge for i, edge in enumerate(_cut_points(sketch), 1)})
+    return params
+
+
+def _sketch_segmentation(db_path: str) -> pd.DataFrame:
+    with connection(db_path) as conn:
+        folded = fold_rfm_state(conn)
+        sketches = load_sketches(conn)
+        if not sketches["frequency"].count:
+            print("[SEGMENTATION] No transactions found — skipping RFM.")
+            return pd.DataFrame()
+        with conn:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS _rfm_segments "
+                         "(r INTEGER, f INTEGER, m INTEGER, segment TEXT, PRIMARY KEY (r, f, m))")
+            conn.execute("DELETE FROM temp._rfm_segments")
+            conn.executemany("INSERT INTO temp._rfm_segments VALUES (?, ?, ?, ?)",
+                             ((r + 1, f + 1, m + 1, SEGMENT_LOOKUP[r, f, m])
+                              for r, f, m in np.ndindex(SEGMENT_LOOKUP.shape)))
+            changed = conn.execute(SKETCH_SEGMENT_SQL, rfm_cut_points(sketches)).rowcount
+        summary = pd.read_sql(SEGMENT_COUNTS_SQL, conn)
+
+    print(f"[SEGMENTATION] RFM sketch: {folded} customers refreshed, "
+          f"{changed} segments changed, {summary['customers'].sum()} customers scored.")
+    return summary
+
+
+def month_end_cutoffs(months: int = 24, end=None) -> list:
+    """The last second of each of the ``months`` months up to ``end`` (default: today)."""
+    last = pd.Timestamp(end if end is not None else datetime.now()).to_period("M")
+    return [(period + 1).to_timestamp() - pd.Timedelta(seconds=1)
+            for period in pd.period_range(end=last, periods=months, freq="M")]
+
+
+def rfm_as_of(transactions: pd.DataFrame, cutoffs) -> dict:
+    """{cutoff: recency/frequency/monetary frame} from one pass over ``transactions``.
+
+    ``transactions`` (customer_id, transaction_date, total_amount) must be
+    sorted by customer and date, as HISTORY_TXNS_SQL returns them. Running
+    counts and sums within each customer are taken once; a customer's state
+    at a cutoff is then their last row at or before it. Each frame matches
+    what RFM_SQL + perform_segmentation would compute on the transactions up
+    to the cutoff, "now" being the latest of them.
+    """
+    cutoffs = sorted(pd.Timestamp(c) for c in cutoffs)
+    codes, customers = pd.factorize(transactions["customer_id"])
+    dates = transactions["transaction_date"].to_numpy(dtype="datetime64[ns]")
+    amounts = transactions["total_amount"].to_numpy(dtype=float)
+    frequency = pd.Series(np.ones(len(codes), dtype=np.int64)).groupby(codes).cumsum().to_numpy()
+    spend = pd.Series(np.nan_to_num(amounts)).groupby(codes).cumsum().to_numpy()
+
+    # First cutoff each row counts towards; within a customer this never decreases,
+    # so the last row of each (customer, cutoff) run is the customer's state there
+    bucket = np.searchsorted(np.array(cutoffs, dtype="datetime64[ns]"), dates, side="left")
+    run_end = np.r_[(codes[1:] != codes[:-1]) | (bucket[1:] != bucket[:-1]), True]
+    snapshots = np.flatnonzero(run_end & (bucket < len(cutoffs)))
+    snapshots = snapshots[np.argsort(bucket[snapshots], kind="stable")]
+    bounds = np.searchsorted(bucket[snapshots], np.arange(len(cutoffs) + 1))
+
+    state = np.full(len(customers), -1, dtype=np.int64)  # customer → latest snapshot row
+    result = {}
+    for j, cutoff in enumerate(cutoffs):
+        rows = snapshots[bounds[j]:bounds[j + 1]]
+        state[codes[rows]] = rows
+        active = np.flatnonzero(state >= 0)
+        if not len(active):
+            result[cutoff] = pd.DataFrame(columns=["customer_id", "recency", "frequency", "monetary"])
+            continue
+        last_row = state[active]
+        last = dates[last_row]
+        result[cutoff] = pd.DataFrame({
+            "customer_id": customers[active],
+            "recency": (last.max() - last) // np.timedelta64(1, "D"),
+            "frequency": frequency[last_row],
+            "monetary": np.round(spend[last_row], 2),
+        })
+    return result
+
+
+def _customer_transactions(header: pd.DataFrame, until=None) -> pd.DataFrame:
+    """HISTORY_TXNS_SQL's rows from an AnalyticsContext's header (no cutoff: all)."""
+    keep = header["customer_id"].notna() & header["transaction_date"].notna()
+    if until is not None:
+        keep &= header["transaction_date"] <= until
+    return header.loc[keep, ["customer_id", "transaction_date", "total_amount"]]
+
+
+def segment_history(cutoffs, db_path: str = DB_PATH, context=None) -> pd.DataFrame:
+    """RFM scores and segment of every customer as of each cutoff → segment_history.
+
+    A transaction counts towards a cutoff when its transaction_date is at
+    or before it (see month_end_cutoffs). All cutoffs come from a single
+    ordered read of store_sales_header (or an AnalyticsContext's header);
+    rows for a cutoff already in segment_history are replaced.
+    """
+    cutoffs = sorted(pd.Timestamp(c) for c in cutoffs)
+    if not cutoffs:
+        return pd.DataFrame(columns=HISTORY_COLUMNS)
+    if context is not None:
+        transactions = _customer_transactions(context.header, cutoffs[-1])
+    else:
+        transactions = get_backend(db_path=db_path).read(
+            HISTORY_TXNS_SQL, (cutoffs[-1].strftime(DATE_FORMAT),))
+
+    frames = []
+    for cutoff, rfm in rfm_as_of(transactions, cutoffs).items():
+        if rfm.empty:
+            continue
+        rfm = score_rfm(rfm)
+        rfm.insert(0, "as_of", cutoff.strftime(DATE_FORMAT))
+        frames.append(rfm[HISTORY_COLUMNS])
+    history = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=HISTORY_COLUMNS)
+
+    with connection(db_path) as conn, conn:
+        conn.executemany("DELETE FROM segment_history WHERE as_of = ?",
+                         ((c.strftime(DATE_FORMAT),) for c in cutoffs))
+        conn.executemany(
+            "INSERT INTO segment_history (as_of, customer_id, recency, frequency, monetary, rfm_score, segment) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            history.to_numpy(dtype=object).tolist(),  # plain Python values for sqlite3
+        )
+
+    print(f"[SEGMENTATION] Segment history: {len(cutoffs)} cutoffs, {len(history)} customer rows.")
+    return history
+
+
+def perform_segmentation(db_path: str = DB_PATH, mode: str = "exact", context=None) -> pd.DataFrame:
     """
     Perform RFM (Recency, Frequency, Monetary) segmentation on customers.
 
+    ``mode="sketch"`` scores from rfm_state/rfm_sketch instead, refreshing
+    only customers whose transactions changed; see the module docstring.
+    In exact mode an AnalyticsContext's header, if already loaded, is
+    aggregated instead of running RFM_SQL (same result, via rfm_as_of); in
+    the pipeline the context node loads it beforehand or not at all.
+
     Returns
     -------
-    pd.DataFrame  — RFM scores and segments per customer.
+    pd.DataFrame  — RFM scores and segments per customer (sketch mode:
+    customers per segment).
     """
-    conn = _get_connection(db_path)
+    if mode == "sketch":
+        return _sketch_segmentation(db_path)
 
-    # Read transactions
-    txn = pd.read_sql("SELECT * FROM store_sales_header", conn)
-    if txn.empty:
+    # Recency / frequency / monetary per customer: from the context's header,
+    # or aggregated by the query backend
+    header = context.loaded("store_sales_header") if context is not None else None
+    if header is not None:
+        transactions = _customer_transactions(header)
+        rfm = (rfm_as_of(transactions, [transactions["transaction_date"].max()]).popitem()[1]
+               if len(transactions) else pd.DataFrame())
+    else:
+        rfm = get_backend(db_path=db_path).read(RFM_SQL)
+        if not rfm.empty:
+            now = rfm["transaction_date"].max()
+            rfm.insert(1, "recency", (now - rfm.pop("transaction_date")).dt.days)
+    if rfm.empty:
         print("[SEGMENTATION] No transactions found — skipping RFM.")
-        conn.close()
         return pd.DataFrame()
 
-    txn["transaction_date"] = pd.to_datetime(txn["transaction_date"], errors="coerce")
-    txn = txn.dropna(subset=["transaction_date"])
-
-    # Calculate RFM
-    now = txn["transaction_date"].max()
-
-    rfm = txn.groupby("customer_id").agg(
-        recency=("transaction_date", lambda x: (now - x.max()).days),
-        frequency=("transaction_id", "count"),
-        monetary=("total_amount", "sum"),
-    ).reset_index()
-
-    # Score each component (1-5 scale, 5 being best)
-    try:
-        rfm["R_score"] = pd.qcut(rfm["recency"], 5, labels=[5, 4, 3, 2, 1], duplicates="drop")
-    except ValueError:
-        rfm["R_score"] = pd.cut(rfm["recency"], 5, labels=[5, 4, 3, 2, 1])
-    try:
-        rfm["F_score"] = pd.qcut(rfm["frequency"], 5, labels=[1, 2, 3, 4, 5], duplicates="drop")
-    except ValueError:
-        rfm["F_score"] = pd.cut(rfm["frequency"], 5, labels=[1, 2, 3, 4, 5])
-    try:
-        rfm["M_score"] = pd.qcut(rfm["monetary"], 5, labels=[1, 2, 3, 4, 5], duplicates="drop")
-    except ValueError:
-        rfm["M_score"] = pd.cut(rfm["monetary"], 5, labels=[1, 2, 3, 4, 5])
-
-    # Combine scores
-    rfm["RFM_score"] = rfm["R_score"].astype(str) + rfm["F_score"].astype(str) + rfm["M_score"].astype(str)
-
-    # Segment based on RFM score
-    def _segment(score):
-        r, f, m = int(score[0]), int(score[1]), int(score[2])
-        if r >= 4 and f >= 4 and m >= 4:
-            return "Champions"
-        elif r >= 3 and f >= 3 and m >= 3:
-            return "Loyal Customers"
-        elif r >= 3 and f >= 1 and m >= 1:
-            return "Potential Loyalists"
-        elif r >= 2 and f >= 2 and m >= 2:
-            return "At Risk"
-        elif r >= 1 and f >= 1 and m >= 1:
-            return "Lost"
-        else:
-            return "New Customers"
-
-    rfm["segment"] = rfm["RFM_score"].apply(_segment)
+    rfm = score_rfm(rfm)
 
     # Update customer_details
-    cursor = conn.cursor()
-    for _, row in rfm.iterrows():
-        cursor.execute(
-            "UPDATE customer_details SET segment_id = ? WHERE customer_id = ?",
-            (row["segment"], row["customer_id"]),
-        )
-
-    conn.commit()
-    conn.close()
+    with connection(db_path) as conn:
+        conn.executemany(SEGMENT_UPDATE_SQL, zip(rfm["segment"].tolist(), rfm["customer_id"].tolist()))
+        conn.commit()
 
     print(f"[SEGMENTATION] RFM calculated for {len(rfm)} customers.")
     print(rfm["segment"].value_counts().to_string())
-    return rfm
\ No newline at end of file
+    return rfm
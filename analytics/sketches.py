@@ -0,0 +1,94 @@
+"""
+analytics/sketches.py
+---------------------
+Mergeable quantile sketches for the incremental RFM mode.
+
+A HistogramSketch is a count per bucket. Counts only ever add up, so two
+sketches (e.g. of two shards, or of the state before and after a batch)
+merge by adding their counts, and removing a value is adding it with
+weight -1 — which is how a customer's old recency/frequency/monetary is
+swapped for the new one.
+
+* exact sketches     — the bucket is the integer value itself; quantiles
+                       equal pandas' for the same values
+* relative sketches  — values > 0 go to logarithmic buckets (DDSketch), so
+                       every quantile is within ``relative_accuracy`` of the
+                       exact one however many values are added; values
+                       <= 0 share ZERO_BUCKET, represented by 0
+"""
+
+import math
+
+import numpy as np
+
+
+class HistogramSketch:
+    """Quantile sketch over a count per bucket."""
+
+    ZERO_BUCKET = -(2 ** 62)
+
+    def __init__(self, relative_accuracy: float = None, counts: dict = None):
+        self.relative_accuracy = relative_accuracy
+        self.counts = dict(counts or {})
+        if relative_accuracy:
+            self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+            self._log_gamma = math.log(self._gamma)
+
+    def buckets(self, values) -> np.ndarray:
+        values = np.asarray(values, dtype=float)
+        if not self.relative_accuracy:
+            return values.astype(np.int64)
+        out = np.full(len(values), self.ZERO_BUCKET, dtype=np.int64)
+        positive = values > 0
+        out[positive] = np.ceil(np.log(values[positive]) / self._log_gamma)
+        return out
+
+    def values(self, buckets) -> np.ndarray:
+        """Representative value of each bucket."""
+        buckets = np.asarray(buckets, dtype=np.int64)
+        if not self.relative_accuracy:
+            return buckets.astype(float)
+        out = np.zeros(len(buckets))
+        positive = buckets != self.ZERO_BUCKET
+        out[positive] = 2 * self._gamma ** buckets[positive].astype(float) / (self._gamma + 1)
+        return out
+
+    def add(self, values, weight: int = 1) -> "HistogramSketch":
+        """Count ``values`` ``weight`` times each (-1 removes them); returns self."""
+        buckets, counts = np.unique(self.buckets(values), return_counts=True)
+        for bucket, count in zip(buckets.tolist(), (counts * weight).tolist()):
+            total = self.counts.get(bucket, 0) + count
+            if total:
+                self.counts[bucket] = total
+            else:
+                self.counts.pop(bucket, None)
+        return self
+
+    def merge(self, other: "HistogramSketch") -> "HistogramSketch":
+        """Add ``other``'s counts to this sketch; returns self."""
+        for bucket, count in other.counts.items():
+            total = self.counts.get(bucket, 0) + count
+            if total:
+                self.counts[bucket] = total
+            else:
+                self.counts.pop(bucket, None)
+        return self
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts.values())
+
+    def quantiles(self, probs) -> np.ndarray:
+        """Quantiles with linear interpolation between order statistics
+        (the default of Series.quantile / pd.qcut)."""
+        buckets = np.array(sorted(b for b, c in self.counts.items() if c > 0), dtype=np.int64)
+        if not len(buckets):
+            return np.full(len(probs), np.nan)
+        ends = np.cumsum([self.counts[b] for b in buckets.tolist()])
+        rank = (ends[-1] - 1) * np.asarray(probs, dtype=float)
+        lo = np.floor(rank).astype(np.int64)
+        hi = np.minimum(lo + 1, ends[-1] - 1)
+        value = self.values(buckets)
+        v_lo = value[np.searchsorted(ends, lo, side="right")]
+        v_hi = value[np.searchsorted(ends, hi, side="right")]
+        return v_lo + (rank - lo) * (v_hi - v_lo)
@@ -0,0 +1,76 @@
+"""
+benchmarks/bench_backends.py
+----------------------------
+Time the analytics/dashboard read queries on each query backend and check
+that every backend returns the same frames as SQLite.
+
+Backends whose package is not installed (duckdb) are skipped.
+
+    python benchmarks/bench_backends.py [db_path] [repeats]
+"""
+
+import os
+import sys
+import time
+
+import pandas as pd
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from analytics import loyalty, predictive, segmentation
+from dashboard import dashboard
+from database.backends import BACKENDS, get_backend
+from database.connection import DB_PATH
+
+# name → (sql, params)
+QUERIES = {
+    "rfm": (segmentation.RFM_SQL, None),
+    "monthly_spend": (predictive.MONTHLY_SPEND_SQL, None),
+    "promo_purchases": (predictive.PROMO_PURCHASES_SQL, None),
+    "loyalty_unscored": (loyalty.UNSCORED_SQL, None),
+    **{name: (sql, (101,)) for name, sql in dashboard.HOT_QUERIES.items()},
+}
+
+
+def _time(backend, sql, params, repeats: int):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        df = backend.read(sql, params)
+    return df, (time.perf_counter() - start) / repeats
+
+
+def main(db_path: str, repeats: int) -> int:
+    backends = []
+    for name in BACKENDS:
+        try:
+            backends.append(get_backend(name, db_path))
+        except ImportError as e:
+            print(f"[BENCH] {name}: skipped ({e})")
+
+    # The demand windows end on the latest day with sales
+    queries = dict(QUERIES)
+    last_day = backends[0].read(predictive.LAST_DAY_SQL)["last_day"].iat[0]
+    if not pd.isna(last_day):
+        queries["product_demand"] = (predictive.PRODUCT_DEMAND_SQL, (int(last_day),) * 3)
+
+    print(f"{'query':<22}" + "".join(f"{b.name + ' ms':>14}" for b in backends) + "   same")
+    mismatches = 0
+    for name, (sql, params) in queries.items():
+        results = [_time(b, sql, params, repeats) for b in backends]
+        reference = results[0][0]
+        same = True
+        for df, _ in results[1:]:
+            try:
+                pd.testing.assert_frame_equal(reference, df, check_exact=False, rtol=1e-12)
+            except AssertionError:
+                same = False
+        mismatches += not same
+        print(f"{name:<22}" + "".join(f"{t * 1000:>14.2f}" for _, t in results) + f"   {same}")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1] if len(sys.argv) > 1 else DB_PATH,
+                  int(sys.argv[2]) if len(sys.argv) > 2 else 5))
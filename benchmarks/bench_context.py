@@ -0,0 +1,122 @@
+"""
+benchmarks/bench_context.py
+---------------------------
+Loyalty + segmentation + predictive steps with and without a shared
+analytics.context.AnalyticsContext.
+
+The database is copied to a scratch directory and its fact tables are
+replicated ``copies`` times (new transaction/line item ids, dates shifted
+back a day per copy). Each mode then runs on its own copy, twice: a full
+run (loyalty rescores everything) and an incremental one (nothing changed
+since). The returned frames and the customer_details / loyalty_ledger
+tables must be identical. Also reports how often the context read the
+header.
+
+    python benchmarks/bench_context.py [db_path] [copies]
+"""
+
+import contextlib
+import io
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from analytics.context import AnalyticsContext
+from analytics.loyalty import calculate_loyalty
+from analytics.predictive import run_predictive
+from analytics.segmentation import perform_segmentation
+from database.connection import DB_PATH, get_manager
+
+# Tables the analytics write, compared between the two runs (scored_at aside)
+COMPARED_TABLES = {
+    "customer_details": "SELECT * FROM customer_details ORDER BY customer_id",
+    "loyalty_ledger": "SELECT transaction_id, customer_id, transaction_date, total_amount, rule_id, "
+                      "points_earned FROM loyalty_ledger ORDER BY transaction_id",
+}
+
+
+def replicate(db_path: str, copies: int) -> None:
+    conn = sqlite3.connect(db_path)
+    with conn:
+        step_h = conn.execute("SELECT COALESCE(MAX(transaction_id), 0) FROM store_sales_header").fetchone()[0]
+        step_l = conn.execute("SELECT COALESCE(MAX(line_item_id), 0) FROM store_sales_line_items").fetchone()[0]
+        for k in range(1, copies):
+            conn.execute(
+                "INSERT INTO store_sales_header (transaction_id, customer_id, store_id, transaction_date, total_amount) "
+                "SELECT transaction_id + ?, customer_id, store_id, datetime(transaction_date, ?), total_amount "
+                "FROM store_sales_header WHERE transaction_id <= ?",
+                (k * step_h, f"-{k} days", step_h))
+            conn.execute(
+                "INSERT INTO store_sales_line_items "
+                "SELECT line_item_id + ?, transaction_id + ?, product_id, promotion_id, quantity, line_item_amount "
+                "FROM store_sales_line_items WHERE line_item_id <= ?",
+                (k * step_l, k * step_h, step_l))
+    conn.close()
+
+
+def run_steps(db_path: str, rescore: bool, context=None) -> dict:
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = {
+            "loyalty": calculate_loyalty(db_path, rescore=rescore, context=context),
+            "segmentation": perform_segmentation(db_path, context=context),
+        }
+        results.update(run_predictive(db_path, context=context))
+    return results
+
+
+def _snapshot(db_path: str) -> dict:
+    get_manager(db_path).close_all()
+    with sqlite3.connect(db_path) as conn:
+        return {name: pd.read_sql(sql, conn) for name, sql in COMPARED_TABLES.items()}
+
+
+def main(db_path: str, copies: int) -> None:
+    scratch = tempfile.mkdtemp()
+    try:
+        base = os.path.join(scratch, "base.db")
+        with sqlite3.connect(db_path) as src, sqlite3.connect(base) as dst:
+            src.backup(dst)
+        replicate(base, copies)
+        paths = {mode: os.path.join(scratch, f"{mode}.db") for mode in ("queries", "context")}
+        for path in paths.values():
+            shutil.copy(base, path)
+
+        for run, rescore in (("full", True), ("incremental", False)):
+            start = time.perf_counter()
+            old = run_steps(paths["queries"], rescore)
+            t_old = time.perf_counter() - start
+
+            start = time.perf_counter()
+            context = AnalyticsContext(paths["context"])
+            new = run_steps(paths["context"], rescore, context)
+            t_new = time.perf_counter() - start
+            loads = context.loads.get("store_sales_header", 0)
+            context.close()
+
+            for name in old:
+                pd.testing.assert_frame_equal(old[name], new[name], check_dtype=False)
+            tables_old, tables_new = _snapshot(paths["queries"]), _snapshot(paths["context"])
+            for name in tables_old:
+                pd.testing.assert_frame_equal(tables_old[name], tables_new[name])
+
+            rows = len(tables_old["loyalty_ledger"])
+            print(f"{run:<12}{rows:>10,} txns  per-step queries {t_old:>7.2f}s   shared context {t_new:>7.2f}s   "
+                  f"({t_old / t_new:.1f}x, header read {loads}x, outputs equal)")
+    finally:
+        for path in os.listdir(scratch):
+            get_manager(os.path.join(scratch, path)).close_all()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else DB_PATH,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 100)
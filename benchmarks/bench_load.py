@@ -0,0 +1,118 @@
+"""
+benchmarks/bench_load.py
+------------------------
+Rows/second of the SQLite load paths on synthetic line items.
+
+Two scenarios, each loading into fresh database files:
+
+* single shot  — the whole frame in one call, table carrying the secondary
+                 indexes from database/migrations.py
+* chunked      — the same rows in 10k-row chunks, as the streaming ETL does
+
+and three loaders:
+
+* to_sql       — the previous load_table(): new connection + to_sql per call
+* bulk_load    — one shared connection, one transaction per call, executemany
+* bulk_load + FAST_LOAD_PRAGMAS (+ index rebuild in the single-shot case)
+
+    python benchmarks/bench_load.py [rows]
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from database.setup import get_connection, setup_database
+from etl.load import FAST_LOAD_PRAGMAS, bulk_load
+
+
+def make_line_items(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    promo = rng.integers(1, 6, n).astype(float)
+    promo[rng.random(n) < 0.6] = np.nan
+    return pd.DataFrame({
+        "line_item_id": np.arange(1, n + 1),
+        "transaction_id": rng.integers(1, n // 3 + 2, n).astype(float),
+        "product_id": pd.Series(rng.integers(1, 81, n)).map("P{}".format),
+        "promotion_id": promo,
+        "quantity": rng.integers(1, 10, n),
+        "line_item_amount": np.round(rng.uniform(10, 5000, n), 2),
+    })
+
+
+CHUNK = 10_000
+TABLE = "store_sales_line_items"
+
+
+def _fresh_db(tmp: str, name: str) -> str:
+    path = os.path.join(tmp, f"{name}.db")
+    with contextlib.redirect_stdout(io.StringIO()):
+        setup_database(path)
+    return path
+
+
+def _index_count() -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = get_connection(_fresh_db(tmp, "count"))
+        n = conn.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+            (TABLE,),
+        ).fetchone()[0]
+        conn.close()
+    return n
+
+
+def _chunks(df: pd.DataFrame, chunked: bool):
+    if not chunked:
+        return [df]
+    return [df.iloc[i:i + CHUNK] for i in range(0, len(df), CHUNK)]
+
+
+def legacy_load(df: pd.DataFrame, path: str, chunked: bool) -> None:
+    for part in _chunks(df, chunked):
+        conn = get_connection(path)
+        conn.execute("PRAGMA foreign_keys = OFF;")
+        part.to_sql(TABLE, conn, if_exists="append", index=False)
+        conn.close()
+
+
+def bulk(df: pd.DataFrame, path: str, chunked: bool, pragmas=None, rebuild=False) -> None:
+    conn = get_connection(path)
+    for part in _chunks(df, chunked):
+        bulk_load(part, TABLE, conn, pragmas=pragmas, rebuild_indexes=rebuild)
+    conn.close()
+
+
+def _rate(fn, n: int) -> float:
+    start = time.perf_counter()
+    fn()
+    return n / (time.perf_counter() - start)
+
+
+def main(n: int) -> None:
+    df = make_line_items(n)
+    print(f"{n:,} line items, {_index_count()} secondary indexes")
+    print(f"{'':<12}{'to_sql':>14}{'bulk_load':>14}{'bulk+fast':>14}   speed-up")
+    with tempfile.TemporaryDirectory() as tmp:
+        for chunked in (False, True):
+            label = f"{CHUNK // 1000}k chunks" if chunked else "single shot"
+            tag = "c" if chunked else "s"
+            old = _rate(lambda: legacy_load(df, _fresh_db(tmp, f"old{tag}"), chunked), n)
+            new = _rate(lambda: bulk(df, _fresh_db(tmp, f"new{tag}"), chunked), n)
+            fast = _rate(lambda: bulk(df, _fresh_db(tmp, f"fast{tag}"), chunked,
+                                      FAST_LOAD_PRAGMAS, rebuild=not chunked), n)
+            print(f"{label:<12}{old:>14,.0f}{new:>14,.0f}{fast:>14,.0f}   {fast / old:.2f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
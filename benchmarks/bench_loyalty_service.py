@@ -0,0 +1,111 @@
+"""
+benchmarks/bench_loyalty_service.py
+-----------------------------------
+Latency of the point-of-sale loyalty service (analytics.loyalty_service).
+
+First checks that the single-transaction path (RuleIndex.lookup_one /
+points_one) scores synthetic transactions exactly like the batch engine.
+Then, on a scratch copy of the database, reports per-call latency of:
+
+* score()            — rule match + points, in memory
+* record()           — one sale committed to loyalty_ledger/customer_details
+* record_many(100)   — per sale, in micro-batches of 100
+* HTTP /score, /record over a keep-alive local connection
+
+    python benchmarks/bench_loyalty_service.py [db_path] [calls]
+"""
+
+import http.client
+import json
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from analytics.loyalty import RuleIndex, score_transactions
+from analytics.loyalty_service import LoyaltyService, serve
+from benchmarks.bench_loyalty import make_rules, make_transactions
+from database.connection import DB_PATH
+
+
+def check_scalar_path(n: int = 200_000) -> None:
+    rules, transactions = make_rules(), make_transactions(n, seed=1)
+    index = RuleIndex(rules)
+    expected = score_transactions(transactions, index)["points_earned"].tolist()
+    dates, amounts = transactions["transaction_date"].tolist(), transactions["total_amount"].tolist()
+    got = [index.points_one(a, index.lookup_one(d)) for d, a in zip(dates, amounts)]
+    mismatches = sum(not (x == y or (x != x and y != y)) for x, y in zip(expected, got))
+    print(f"[BENCH] scalar vs batch scoring on {n:,} txns: {mismatches} mismatches")
+    if mismatches:
+        sys.exit(1)
+
+
+def _latencies(fn, calls: int) -> str:
+    times = []
+    for i in range(calls):
+        start = time.perf_counter()
+        fn(i)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    us = [t * 1e6 for t in (statistics.median(times), times[int(len(times) * 0.99)])]
+    return f"p50 {us[0]:>9.1f} µs   p99 {us[1]:>9.1f} µs"
+
+
+def main(db_path: str, calls: int) -> None:
+    check_scalar_path()
+
+    scratch = tempfile.mkdtemp()
+    try:
+        copy = os.path.join(scratch, "retail.db")
+        with sqlite3.connect(db_path) as src, sqlite3.connect(copy) as dst:
+            src.backup(dst)
+        service = LoyaltyService(copy)
+        customers = list(service._totals) or ["C1"]
+        base = sqlite3.connect(copy).execute(
+            "SELECT COALESCE(MAX(transaction_id), 0) FROM store_sales_header").fetchone()[0] + 1_000_000
+
+        def sale(i):
+            return {"transaction_id": base + i, "customer_id": customers[i % len(customers)],
+                    "transaction_date": "2024-06-01 12:00:00", "total_amount": 1000.0 + i % 997}
+
+        print(f"{'score()':<22}" + _latencies(lambda i: service.score("2024-06-01 12:00:00", 1500.0 + i), calls))
+        print(f"{'record()':<22}" + _latencies(lambda i: service.record(**sale(i)), calls))
+        base += calls
+        batch = 100
+        t = _latencies(lambda i: service.record_many([sale(i * batch + j) for j in range(batch)]),
+                       max(calls // batch, 10))
+        print(f"{'record_many(100)':<22}" + t + "   (per batch)")
+        base += calls + batch * 10
+
+        server = serve(service, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        client = http.client.HTTPConnection(*server.server_address)
+
+        def post(path, payload):
+            client.request("POST", path, json.dumps(payload), {"Content-Type": "application/json"})
+            response = client.getresponse()
+            response.read()
+            assert response.status == 200, response.status
+
+        print(f"{'HTTP /score':<22}" + _latencies(
+            lambda i: post("/score", {"transaction_date": "2024-06-01 12:00:00", "total_amount": 1500.0}), calls))
+        print(f"{'HTTP /record':<22}" + _latencies(lambda i: post("/record", sale(i)), calls))
+        client.close()
+        server.shutdown()
+        server.server_close()
+        service.close()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else DB_PATH,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 2000)
@@ -0,0 +1,94 @@
+"""
+benchmarks/bench_pipeline.py
+----------------------------
+The analytics stage of main.py's pipeline graph (loyalty, segmentation,
+spend forecast, stock risk, promotion sensitivity) run through
+main.run_pipeline with 1 job and with more.
+
+Runs on scratch copies of the database with the fact tables replicated
+(benchmarks/bench_context.py), one copy per jobs setting, and checks the
+tables the nodes write come out identical.
+
+    python benchmarks/bench_pipeline.py [db_path] [copies] [jobs ...]
+"""
+
+import contextlib
+import io
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from analytics.context import AnalyticsContext
+from analytics.loyalty import calculate_loyalty
+from analytics.predictive import predict_future_spend, promotion_sensitivity, stock_out_risk
+from analytics.segmentation import perform_segmentation
+from benchmarks.bench_context import COMPARED_TABLES, replicate
+from database.connection import DB_PATH, get_manager
+from main import run_pipeline
+
+# products.restock_flag is written by the stock risk node
+WRITTEN_TABLES = {**COMPARED_TABLES, "products": "SELECT * FROM products ORDER BY product_id"}
+
+
+def analytics_graph(db_path: str, context: AnalyticsContext) -> dict:
+    return {
+        "loyalty": ((), lambda: calculate_loyalty(db_path, rescore=True, context=context)),
+        "segmentation": ((), lambda: perform_segmentation(db_path, context=context)),
+        "spend_forecast": ((), lambda: predict_future_spend(db_path, context=context)),
+        "stock_risk": ((), lambda: stock_out_risk(db_path)),
+        "promo_sensitivity": ((), lambda: promotion_sensitivity(db_path)),
+    }
+
+
+def run(db_path: str, jobs: int) -> tuple:
+    context = AnalyticsContext(db_path)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        timings = run_pipeline(analytics_graph(db_path, context), jobs=jobs)
+    elapsed = time.perf_counter() - start
+    context.close()
+    get_manager(db_path).close_all()
+    with sqlite3.connect(db_path) as conn:
+        tables = {name: pd.read_sql(sql, conn) for name, sql in WRITTEN_TABLES.items()}
+    return elapsed, timings, tables
+
+
+def main(db_path: str, copies: int, jobs: list) -> None:
+    scratch = tempfile.mkdtemp()
+    try:
+        base = os.path.join(scratch, "base.db")
+        with sqlite3.connect(db_path) as src, sqlite3.connect(base) as dst:
+            src.backup(dst)
+        replicate(base, copies)
+
+        reference = None
+        for n in [1] + [j for j in jobs if j != 1]:
+            path = os.path.join(scratch, f"jobs{n}.db")
+            shutil.copy(base, path)
+            elapsed, timings, tables = run(path, n)
+            if reference is None:
+                reference, t_sequential = tables, elapsed
+            for name in tables:
+                pd.testing.assert_frame_equal(reference[name], tables[name])
+            nodes = "  ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items())
+            print(f"jobs={n:<3} {elapsed:>7.2f}s  ({t_sequential / elapsed:.1f}x, tables equal)   {nodes}")
+        print(f"[BENCH] {os.cpu_count()} CPU(s) available")
+    finally:
+        for path in os.listdir(scratch):
+            get_manager(os.path.join(scratch, path)).close_all()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else DB_PATH,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 100,
+         [int(a) for a in sys.argv[3:]] or [4])
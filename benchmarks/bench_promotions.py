@@ -0,0 +1,133 @@
+"""
+benchmarks/bench_promotions.py
+------------------------------
+analytics.predictive.promotion_sensitivity (np.select classification, one
+executemany, per-category rates from the same read) against the old
+implementation (``.apply`` classification, one UPDATE per customer via
+iterrows).
+
+Runs on scratch copies of the database with the fact tables replicated
+(benchmarks/bench_context.py); the customer_details written and the
+per-customer columns returned must be identical, and each customer's
+category rates must add up to its response rate (to rounding) when every
+promoted line has a known promotion.
+
+    python benchmarks/bench_promotions.py [db_path] [copies] [customers]
+"""
+
+import contextlib
+import io
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from analytics.predictive import promotion_sensitivity
+from benchmarks.bench_context import replicate
+from database.backends import get_backend
+from database.connection import DB_PATH, connection, get_manager
+
+OLD_PROMO_PURCHASES_SQL = """
+    SELECT h.customer_id,
+           COUNT(li.line_item_id) AS total_purchases,
+           CAST(SUM(CASE WHEN li.promotion_id IS NOT NULL AND li.promotion_id <> 0
+                         THEN 1 ELSE 0 END) AS BIGINT) AS promo_purchases
+    FROM store_sales_line_items li
+    JOIN store_sales_header h ON h.transaction_id = li.transaction_id
+    WHERE h.customer_id IS NOT NULL
+    GROUP BY h.customer_id
+    ORDER BY h.customer_id
+"""
+
+CUSTOMERS_SQL = "SELECT customer_id, promotion_sensitivity FROM customer_details ORDER BY customer_id"
+
+
+def old_promotion_sensitivity(db_path: str) -> pd.DataFrame:
+    """promotion_sensitivity before vectorisation."""
+    result = get_backend(db_path=db_path).read(OLD_PROMO_PURCHASES_SQL)
+    result["response_rate"] = (result["promo_purchases"] / result["total_purchases"] * 100).round(2)
+
+    def _classify(rate):
+        if rate > 50:
+            return "HIGH"
+        elif rate >= 20:
+            return "MEDIUM"
+        return "LOW"
+
+    result["promotion_sensitivity"] = result["response_rate"].apply(_classify)
+    with connection(db_path) as conn:
+        cursor = conn.cursor()
+        for _, row in result.iterrows():
+            cursor.execute(
+                "UPDATE customer_details SET promotion_sensitivity = ? WHERE customer_id = ?",
+                (row["promotion_sensitivity"], row["customer_id"]),
+            )
+        conn.commit()
+    return result
+
+
+def spread_customers(db_path: str, customers: int, seed: int = 0) -> None:
+    """Reassign transactions over ``customers`` customers so the per-customer work scales too."""
+    rng = np.random.default_rng(seed)
+    ids = [f"BC{i:07d}" for i in range(customers)]
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany("INSERT OR IGNORE INTO customer_details (customer_id, promotion_sensitivity) "
+                         "VALUES (?, 'LOW')", ((c,) for c in ids))
+        txns = [t for (t,) in conn.execute("SELECT transaction_id FROM store_sales_header")]
+        owners = rng.integers(0, customers, len(txns))
+        conn.executemany("UPDATE store_sales_header SET customer_id = ? WHERE transaction_id = ?",
+                         zip((ids[i] for i in owners.tolist()), txns))
+
+
+def _run(fn, db_path: str):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = fn(db_path)
+    elapsed = time.perf_counter() - start
+    get_manager(db_path).close_all()
+    with sqlite3.connect(db_path) as conn:
+        written = pd.read_sql(CUSTOMERS_SQL, conn)
+    return result, elapsed, written
+
+
+def main(db_path: str, copies: int, customers: int) -> None:
+    scratch = tempfile.mkdtemp()
+    try:
+        base = os.path.join(scratch, "base.db")
+        with sqlite3.connect(db_path) as src, sqlite3.connect(base) as dst:
+            src.backup(dst)
+        replicate(base, copies)
+        spread_customers(base, customers)
+        paths = {mode: os.path.join(scratch, f"{mode}.db") for mode in ("old", "new")}
+        for path in paths.values():
+            shutil.copy(base, path)
+
+        old, t_old, written_old = _run(old_promotion_sensitivity, paths["old"])
+        new, t_new, written_new = _run(promotion_sensitivity, paths["new"])
+
+        pd.testing.assert_frame_equal(old, new[old.columns], check_dtype=False)
+        pd.testing.assert_frame_equal(written_old, written_new)
+        rates = new.filter(regex=r"^rate_")
+        gap = (rates.sum(axis=1) - new["response_rate"]).abs().max()
+        print(f"{len(new):>10,} customers  apply + iterrows {t_old:>7.2f}s   vectorised {t_new:>7.2f}s   "
+              f"({t_old / t_new:.1f}x, outputs equal)  {rates.shape[1]} category rates, "
+              f"max gap to response_rate {gap:.2f}")
+    finally:
+        for path in os.listdir(scratch):
+            get_manager(os.path.join(scratch, path)).close_all()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else DB_PATH,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 100,
+         int(sys.argv[3]) if len(sys.argv) > 3 else 200_000)
@@ -0,0 +1,121 @@
+"""
+benchmarks/bench_segment_history.py
+-----------------------------------
+Multi-date RFM: analytics.segmentation.rfm_as_of (one ordered read, one
+pass) against rerunning RFM_SQL with a date filter for every cutoff, which
+is what calling perform_segmentation once per date amounts to. Both run on
+an in-memory SQLite copy of the synthetic transactions.
+
+Checks both give identical recency/frequency/monetary for every cutoff,
+then times them on synthetic transactions with 24 month-end cutoffs.
+With a database path, also checks that the latest cutoff reproduces
+perform_segmentation's scores on that database.
+
+    python benchmarks/bench_segment_history.py [rows] [db_path]
+"""
+
+import contextlib
+import io
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from analytics.segmentation import (
+    HISTORY_TXNS_SQL, RFM_SQL, month_end_cutoffs, perform_segmentation, rfm_as_of, segment_history,
+)
+from database.reader import DATE_FORMAT, read_frame
+
+
+def make_transactions(n: int, seed: int = 0) -> pd.DataFrame:
+    """Two and a half years of transactions, ~1% without an amount."""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2022-07-01")
+    df = pd.DataFrame({
+        "customer_id": pd.Series(rng.integers(1, max(n // 15, 2), n)).map("C{}".format).astype("str"),
+        "transaction_date": start + pd.to_timedelta(rng.integers(0, 910 * 86400, n), unit="s"),
+        "total_amount": np.round(rng.lognormal(7, 1.0, n), 2),
+    })
+    df.loc[rng.random(n) < 0.01, "total_amount"] = np.nan
+    return df
+
+
+def load_sqlite(transactions: pd.DataFrame) -> sqlite3.Connection:
+    """An in-memory store_sales_header with the customer/date covering index."""
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE store_sales_header (transaction_id INTEGER PRIMARY KEY, "
+                 "customer_id TEXT, transaction_date TEXT, total_amount REAL)")
+    conn.executemany(
+        "INSERT INTO store_sales_header (customer_id, transaction_date, total_amount) VALUES (?, ?, ?)",
+        zip(transactions["customer_id"].tolist(),
+            transactions["transaction_date"].dt.strftime(DATE_FORMAT).tolist(),
+            [None if a != a else a for a in transactions["total_amount"].tolist()]),
+    )
+    conn.execute("CREATE INDEX idx_header_customer_date "
+                 "ON store_sales_header (customer_id, transaction_date, total_amount)")
+    return conn
+
+
+def rescan_rfm(conn, cutoff) -> pd.DataFrame:
+    """RFM_SQL + perform_segmentation's recency, rerun for one cutoff."""
+    sql = RFM_SQL.replace("WHERE", "WHERE transaction_date <= ? AND", 1)
+    rfm = read_frame(sql, conn, params=(cutoff.strftime(DATE_FORMAT),))
+    now = rfm["transaction_date"].max()
+    rfm.insert(1, "recency", (now - rfm.pop("transaction_date")).dt.days)
+    return rfm
+
+
+def check_database(db_path: str) -> None:
+    scratch = tempfile.mkdtemp()
+    try:
+        copy = os.path.join(scratch, "retail.db")
+        with sqlite3.connect(db_path) as src, sqlite3.connect(copy) as dst:
+            src.backup(dst)
+        with contextlib.redirect_stdout(io.StringIO()):
+            exact = perform_segmentation(copy)
+            history = segment_history([pd.Timestamp("2100-01-01")], copy)
+        latest = history.drop(columns="as_of").reset_index(drop=True)
+        expected = exact[latest.columns].astype({"RFM_score": "str", "segment": "str"})
+        pd.testing.assert_frame_equal(expected, latest, check_dtype=False)
+        print(f"[BENCH] database: latest cutoff matches perform_segmentation for {len(latest)} customers")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def main(n: int, db_path: str = None) -> None:
+    transactions = make_transactions(n)
+    cutoffs = month_end_cutoffs(24, transactions["transaction_date"].max())
+
+    conn = load_sqlite(transactions)
+
+    start = time.perf_counter()
+    rescans = {c: rescan_rfm(conn, c) for c in cutoffs}
+    t_rescan = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ordered = read_frame(HISTORY_TXNS_SQL, conn, params=(cutoffs[-1].strftime(DATE_FORMAT),))
+    single = rfm_as_of(ordered, cutoffs)
+    t_single = time.perf_counter() - start
+    conn.close()
+
+    for cutoff in cutoffs:
+        pd.testing.assert_frame_equal(rescans[cutoff], single[cutoff], check_dtype=False)
+    print(f"{n:>12,} txns × {len(cutoffs)} cutoffs  rescan {t_rescan:>7.2f}s   "
+          f"single pass {t_single:>7.2f}s   ({t_rescan / t_single:.1f}x, outputs equal)")
+
+    if db_path:
+        check_database(db_path)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000,
+         sys.argv[2] if len(sys.argv) > 2 else None)
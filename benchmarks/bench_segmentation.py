@@ -0,0 +1,89 @@
+"""
+benchmarks/bench_segmentation.py
+--------------------------------
+Throughput of analytics.segmentation.score_rfm on synthetic per-customer
+recency/frequency/monetary frames.
+
+Compares against the previous implementation (RFM_score by string
+concatenation, segments via Series.apply parsing the score back into ints)
+and checks both return identical frames, then times the lookup-table
+version alone on larger frames.
+
+    python benchmarks/bench_segmentation.py [customers ...]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from analytics.segmentation import score_rfm
+
+
+def make_rfm(n: int, seed: int = 0) -> pd.DataFrame:
+    """Skewed frequencies (many repeated values, so quintile edges collide)."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "customer_id": pd.Series(np.arange(n)).map("C{}".format).astype("str"),
+        "recency": rng.integers(0, 365, n),
+        "frequency": rng.geometric(0.25, n),
+        "monetary": np.round(rng.lognormal(9, 1.2, n), 2),
+    })
+
+
+def legacy_score_rfm(rfm: pd.DataFrame) -> pd.DataFrame:
+    """The pre-lookup-table scoring, kept as the comparison baseline."""
+    for col, labels in (("recency", [5, 4, 3, 2, 1]), ("frequency", [1, 2, 3, 4, 5]),
+                        ("monetary", [1, 2, 3, 4, 5])):
+        score = col[0].upper() + "_score"
+        try:
+            rfm[score] = pd.qcut(rfm[col], 5, labels=labels, duplicates="drop")
+        except ValueError:
+            rfm[score] = pd.cut(rfm[col], 5, labels=labels)
+    rfm["RFM_score"] = rfm["R_score"].astype(str) + rfm["F_score"].astype(str) + rfm["M_score"].astype(str)
+
+    def _segment(score):
+        r, f, m = int(score[0]), int(score[1]), int(score[2])
+        if r >= 4 and f >= 4 and m >= 4:
+            return "Champions"
+        elif r >= 3 and f >= 3 and m >= 3:
+            return "Loyal Customers"
+        elif r >= 3 and f >= 1 and m >= 1:
+            return "Potential Loyalists"
+        elif r >= 2 and f >= 2 and m >= 2:
+            return "At Risk"
+        elif r >= 1 and f >= 1 and m >= 1:
+            return "Lost"
+        else:
+            return "New Customers"
+
+    rfm["segment"] = rfm["RFM_score"].apply(_segment)
+    return rfm
+
+
+def _time(fn, df):
+    start = time.perf_counter()
+    result = fn(df.copy())
+    return result, time.perf_counter() - start
+
+
+def main(sizes):
+    sample = make_rfm(500_000)
+    old, t_old = _time(legacy_score_rfm, sample)
+    new, t_new = _time(score_rfm, sample)
+    pd.testing.assert_frame_equal(old, new)
+    print(f"{len(sample):>12,} customers  legacy {len(sample) / t_old:>14,.0f}/s   "
+          f"lookup {len(sample) / t_new:>14,.0f}/s   ({t_old / t_new:.1f}x, outputs equal)")
+    for n in sizes:
+        _, t = _time(score_rfm, make_rfm(n))
+        print(f"{n:>12,} customers  lookup {n / t:>14,.0f}/s   ({t:.2f}s)")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [5_000_000])
@@ -0,0 +1,114 @@
+"""
+benchmarks/bench_stock_risk.py
+------------------------------
+analytics.predictive.stock_out_risk (7/28-day windows per store and
+product, aggregated in SQL) at chain scale.
+
+Builds a scratch database with synthetic products and
+agg_store_product_daily_qty rows (``stores`` × ``skus``, each pair selling
+on a fraction ``density`` of ``days`` days), then times stock_out_risk and
+its Python memory peak against the same estimate done in pandas after
+reading every window row, and checks both agree.
+
+    python benchmarks/bench_stock_risk.py [stores] [skus] [days] [density]
+"""
+
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from analytics.predictive import LONG_WINDOW, SHORT_WINDOW, stock_out_risk
+from database.connection import connection, get_manager
+from database.setup import setup_database
+
+FIRST_DAY = 19_500
+
+
+def build(db_path: str, stores: int, skus: int, days: int, density: float, seed: int = 0) -> int:
+    rng = np.random.default_rng(seed)
+    with contextlib.redirect_stdout(io.StringIO()):
+        setup_database(db_path)
+    products = [f"P{i:06d}" for i in range(skus)]
+    cells = int(stores * skus * days * density)
+    # Unique (day, store, product) cells, in primary-key order
+    flat = np.unique(rng.integers(0, days * stores * skus, cells))
+    day, rest = np.divmod(flat, stores * skus)
+    store, product = np.divmod(rest, skus)
+    qty = rng.geometric(0.3, len(flat))
+    with connection(db_path) as conn, conn:
+        conn.executemany(
+            "INSERT INTO products (product_id, product_name, current_stock_level) VALUES (?, ?, ?)",
+            zip(products, products, rng.integers(0, 60, skus).tolist()))
+        conn.executemany(
+            "INSERT INTO agg_store_product_daily_qty "
+            "(transaction_day, store_id, product_id, total_qty, line_count) VALUES (?, ?, ?, ?, ?)",
+            zip((day + FIRST_DAY).tolist(), (store + 1).tolist(),
+                [products[p] for p in product.tolist()], qty.tolist(), qty.tolist()))
+    return len(flat)
+
+
+def pandas_estimate(db_path: str) -> pd.DataFrame:
+    """The same estimate with every window row read into pandas."""
+    with connection(db_path, readonly=True) as conn:
+        last = conn.execute("SELECT MAX(transaction_day) FROM agg_store_product_daily_qty").fetchone()[0]
+        rows = pd.read_sql("SELECT * FROM agg_store_product_daily_qty WHERE transaction_day > ?",
+                           conn, params=(last - LONG_WINDOW,))
+        stock = pd.read_sql("SELECT product_id, current_stock_level FROM products", conn)
+    rows["short"] = rows["total_qty"].where(rows["transaction_day"] > last - SHORT_WINDOW, 0)
+    pairs = rows.groupby(["store_id", "product_id"])[["short", "total_qty"]].sum()
+    pairs["weekly"] = 7 * np.maximum(pairs["short"] / SHORT_WINDOW, pairs["total_qty"] / LONG_WINDOW)
+    demand = pairs.groupby("product_id")["weekly"].sum().reset_index()
+    demand = demand.merge(stock, on="product_id")
+    demand["stock_out_risk"] = demand["weekly"] > demand["current_stock_level"]
+    return demand.sort_values("product_id", ignore_index=True)
+
+
+def _measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = fn()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak / 2 ** 20
+
+
+def main(stores: int, skus: int, days: int, density: float) -> None:
+    scratch = tempfile.mkdtemp()
+    db_path = os.path.join(scratch, "retail.db")
+    try:
+        start = time.perf_counter()
+        cells = build(db_path, stores, skus, days, density)
+        print(f"[BENCH] {stores} stores × {skus:,} SKUs × {days} days: {cells:,} aggregate rows "
+              f"built in {time.perf_counter() - start:.1f}s")
+
+        reference, t_pandas, mb_pandas = _measure(lambda: pandas_estimate(db_path))
+        risk, t_sql, mb_sql = _measure(lambda: stock_out_risk(db_path))
+        np.testing.assert_allclose(risk["weekly_demand"], reference["weekly"], atol=0.01 * stores)
+        differ = (risk["stock_out_risk"] != reference["stock_out_risk"]).sum()
+        print(f"  pandas over window rows {t_pandas:>7.2f}s  peak {mb_pandas:>8.1f} MB")
+        print(f"  stock_out_risk (SQL)    {t_sql:>7.2f}s  peak {mb_sql:>8.1f} MB   "
+              f"{risk['stock_out_risk'].sum():,} flagged, {differ} differ (cent rounding)")
+    finally:
+        get_manager(db_path).close_all()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 300,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 100_000,
+         int(sys.argv[3]) if len(sys.argv) > 3 else 60,
+         float(sys.argv[4]) if len(sys.argv) > 4 else 0.002)
@@ -0,0 +1,116 @@
+"""
+benchmarks/bench_validate.py
+----------------------------
+Throughput of etl.validate.validate on synthetic line-item frames.
+
+Compares against the previous per-cell implementation (regex via
+Series.apply + per-row reason concatenation) on a smaller sample, checks
+both produce the same output, then times the vectorized engine alone on
+multi-million-row frames.
+
+    python benchmarks/bench_validate.py [rows ...]
+"""
+
+import contextlib
+import io
+import os
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from etl.validate import AMOUNT_COLUMNS, NULLABLE_COLUMNS, NUMERIC_COLUMNS, validate
+
+
+def make_line_items(n: int, seed: int = 0) -> pd.DataFrame:
+    """Line items shaped like the raw export: price × qty amounts written as
+    currency strings, ~5% nulls, ~3% negatives."""
+    rng = np.random.default_rng(seed)
+    prices = np.round(rng.uniform(10, 5000, 80), 2)
+    product = rng.integers(0, 80, n)
+    qty = rng.integers(1, 10, n)
+    qty[rng.random(n) < 0.03] = -1
+    amount = pd.Series(np.round(prices[product] * qty, 2))
+    amount_str = ("₹" + amount.map("{:,.2f}".format)).astype(object)
+    amount_str[rng.random(n) < 0.02] = None
+    txn = rng.integers(1, n // 3 + 2, n).astype(float)
+    txn[rng.random(n) < 0.02] = np.nan
+    promo = rng.integers(1, 6, n).astype(float)
+    promo[rng.random(n) < 0.6] = np.nan
+    return pd.DataFrame({
+        "line_item_id": np.arange(1, n + 1),
+        "transaction_id": txn,
+        "product_id": pd.Series(product + 1).map("P{}".format),
+        "promotion_id": promo,
+        "quantity": qty,
+        "line_item_amount": amount_str,
+    })
+
+
+def _legacy_clean_amount(value):
+    if pd.isna(value):
+        return np.nan
+    s = re.sub(r"[^\d.\-]", "", str(value).strip())
+    try:
+        return float(s) if s else np.nan
+    except ValueError:
+        return np.nan
+
+
+def legacy_validate(df: pd.DataFrame) -> tuple:
+    """The pre-vectorization validate(), kept here as the comparison baseline."""
+    working = df.copy()
+    working["_reject_reason"] = ""
+    for col in [c for c in working.columns if c in AMOUNT_COLUMNS]:
+        working[col] = working[col].apply(_legacy_clean_amount)
+    numeric = [c for c in working.columns if c in NUMERIC_COLUMNS]
+    for col in numeric:
+        working[col] = pd.to_numeric(working[col], errors="coerce")
+    orig_cols = [c for c in working.columns if c != "_reject_reason"]
+    all_null = working[orig_cols].isna().all(axis=1)
+    working.loc[all_null, "_reject_reason"] = "all_null"
+    required = [c for c in orig_cols if c not in NULLABLE_COLUMNS]
+    null_any = working[required].isna().any(axis=1) & ~all_null
+    working.loc[null_any, "_reject_reason"] = working.loc[null_any, "_reject_reason"].apply(
+        lambda r: r + ";has_null" if r else "has_null")
+    for col in numeric:
+        neg = working[col] < 0
+        working.loc[neg, "_reject_reason"] = working.loc[neg, "_reject_reason"].apply(
+            lambda r, c=col: r + f";negative_{c}" if r else f"negative_{c}")
+    rejected = working["_reject_reason"].astype(bool)
+    rejected_df = working.loc[rejected].rename(columns={"_reject_reason": "reject_reason"})
+    cleaned_df = working.loc[~rejected].drop(columns=["_reject_reason"]).drop_duplicates()
+    return cleaned_df, rejected_df
+
+
+def _time(fn, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+    return result, elapsed
+
+
+def main(sizes):
+    sample = make_line_items(200_000)
+    (old_clean, old_rej), t_old = _time(legacy_validate, sample)
+    (new_clean, new_rej), t_new = _time(validate, sample, "store_sales_line_items")
+    pd.testing.assert_frame_equal(old_clean, new_clean)
+    pd.testing.assert_frame_equal(old_rej, new_rej, check_dtype=False)
+    print(f"{len(sample):>10,} rows  legacy {len(sample) / t_old:>12,.0f} rows/s   "
+          f"vectorized {len(sample) / t_new:>12,.0f} rows/s   ({t_old / t_new:.1f}x, outputs equal)")
+
+    for n in sizes:
+        df = make_line_items(n)
+        _, t = _time(validate, df, "store_sales_line_items")
+        print(f"{n:>10,} rows  vectorized {n / t:>12,.0f} rows/s   ({t:.2f}s)")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [1_000_000, 2_000_000, 5_000_000])
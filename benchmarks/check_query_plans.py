@@ -0,0 +1,133 @@
+"""
+benchmarks/check_query_plans.py
+-------------------------------
+Fail if a hot query stops using the indexes from database/migrations.py.
+
+* per-store dashboard queries (dashboard.HOT_QUERIES) must be index
+  searches only — no SCAN step at all
+* date-range reads (incl. the stock-out demand windows) must search a
+  transaction_day index
+* whole-table rollups (RFM, segment history, monthly spend, promotion
+  sensitivity) and the AnalyticsContext reads may scan, but only a
+  covering index, and must group or sort without a temporary B-tree unless
+  ACCEPTED_SORTS says why one is needed
+* reads driven by a small set of keys (loyalty's unscored transactions,
+  sketch-mode RFM batches) must search the fact tables, never scan them
+
+The queries are the ones the analytics run, imported from their modules.
+
+Runs against a freshly created schema, or an existing database file.
+
+    python benchmarks/check_query_plans.py [db_path]
+"""
+
+import contextlib
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from analytics.context import CONTEXT_SQL
+from analytics.loyalty import UNSCORED_SQL
+from analytics.predictive import MONTHLY_SPEND_SQL, PRODUCT_DEMAND_SQL, PROMO_PURCHASES_SQL
+from analytics.segmentation import BATCH_RFM_SQL, HISTORY_TXNS_SQL, RFM_SQL
+from dashboard.dashboard import HOT_QUERIES
+from database.migrations import full_scans, query_plan
+from database.setup import get_connection, setup_database
+
+# Date-range predicates go through the integer transaction_day column
+RANGE_QUERIES = {
+    "sales_between_days": ("""
+        SELECT store_id, SUM(total_amount) FROM store_sales_header
+        WHERE transaction_day BETWEEN ? AND ? GROUP BY store_id
+    """, (19_000, 19_100)),
+    "stock_demand_windows": (PRODUCT_DEMAND_SQL, (19_100,) * 3),
+}
+
+# The whole-table per-customer reads behind analytics/
+ROLLUP_QUERIES = {
+    "rfm": (RFM_SQL, ()),
+    "segment_history": (HISTORY_TXNS_SQL, ("2024-01-01",)),
+    "monthly_spend": (MONTHLY_SPEND_SQL, ()),
+    "promo_purchases": (PROMO_PURCHASES_SQL, ()),
+    **{f"context_{name}": (sql, ()) for name, sql in CONTEXT_SQL.items()},
+}
+
+# Rollup sorts that no index can remove
+ACCEPTED_SORTS = {
+    # The month is substr(transaction_date, 1, 7). Rows arrive in
+    # idx_header_customer_date order, but SQLite cannot tell that the month
+    # follows the date. An expression index would be one more index to
+    # write on every header load, for one read per run
+    "monthly_spend": ["USE TEMP B-TREE FOR GROUP BY"],
+    # The category comes from the joined promotion, not from an index of the
+    # line items; the sort also serves the ORDER BY
+    "promo_purchases": ["USE TEMP B-TREE FOR GROUP BY"],
+}
+
+# Queries driven by a small key set → the tables/aliases holding those keys,
+# the only ones they may scan (temp B-trees over the keys are fine too)
+KEYED_QUERIES = {
+    # Ids queued in loyalty_pending, unioned into the materialized candidates
+    "loyalty_unscored": (UNSCORED_SQL, ["loyalty_pending", "c"]),
+    # Customers staged in temp._rfm_batch
+    "rfm_batch": (BATCH_RFM_SQL, ["b"]),
+}
+
+# Temp tables the keyed queries read, as analytics/ creates them
+TEMP_TABLES = ["CREATE TEMP TABLE IF NOT EXISTS _rfm_batch (customer_id TEXT PRIMARY KEY)"]
+
+
+def _regressions(conn, name: str, sql: str, params=(), rollup: bool = False, drivers=None) -> list:
+    try:
+        steps = full_scans(conn, sql, params, allow_covering=rollup)
+        if drivers is not None:
+            steps = [s for s in steps if s.split(" ")[1] not in drivers]
+        if rollup:
+            accepted = ACCEPTED_SORTS.get(name, [])
+            steps += [s for s in query_plan(conn, sql, params)
+                      if s.startswith("USE TEMP B-TREE") and s not in accepted]
+    except sqlite3.OperationalError as e:  # e.g. a database older than the migrations
+        steps = [str(e)]
+    return steps
+
+
+def check(db_path: str) -> list:
+    """Return one message per query whose plan regressed."""
+    queries = (
+        [(name, sql, (1,), False, None) for name, sql in HOT_QUERIES.items()]
+        + [(name, sql, params, False, None) for name, (sql, params) in RANGE_QUERIES.items()]
+        + [(name, sql, params, True, None) for name, (sql, params) in ROLLUP_QUERIES.items()]
+        + [(name, sql, (), False, drivers) for name, (sql, drivers) in KEYED_QUERIES.items()]
+    )
+    conn = get_connection(db_path)
+    try:
+        for ddl in TEMP_TABLES:
+            conn.execute(ddl)
+        return [f"{name}: {step}" for name, sql, params, rollup, drivers in queries
+                for step in _regressions(conn, name, sql, params, rollup, drivers)]
+    finally:
+        conn.close()
+
+
+def main(db_path: str = None) -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        if db_path is None:
+            db_path = os.path.join(tmp, "plans.db")
+            with contextlib.redirect_stdout(io.StringIO()):
+                setup_database(db_path)
+        problems = check(db_path)
+    for message in problems:
+        print(f"[PLAN] {message}")
+    total = len(HOT_QUERIES) + len(RANGE_QUERIES) + len(ROLLUP_QUERIES) + len(KEYED_QUERIES)
+    print(f"[PLAN] {total - len({m.split(':')[0] for m in problems})}/{total} queries use their indexes")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1] if len(sys.argv) > 1 else None))
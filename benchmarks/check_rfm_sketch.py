@@ -0,0 +1,119 @@
+"""
+benchmarks/check_rfm_sketch.py
+------------------------------
+How far the sketch RFM mode is from the exact one.
+
+1. On a scratch copy of the database: runs the exact segmentation, then
+   the sketch mode, and reports cut-point errors and how many customers get
+   a different R/F/M score or segment.
+2. On synthetic customers: cut-point error of the sketches against pd.qcut,
+   and their update throughput, at larger sizes.
+
+Exits non-zero if a frequency cut point differs or a monetary cut point
+is off by more than the sketch's relative accuracy.
+
+    python benchmarks/check_rfm_sketch.py [db_path] [customers ...]
+"""
+
+import contextlib
+import io
+import os
+import sqlite3
+import shutil
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from analytics.segmentation import (
+    SKETCH_METRICS, _cut_points, load_sketches, perform_segmentation, rfm_cut_points,
+)
+from analytics.sketches import HistogramSketch
+from benchmarks.bench_segmentation import make_rfm
+from database.connection import DB_PATH, connection
+
+ACCURACY = SKETCH_METRICS["monetary"]
+
+
+def _exact_edges(values: pd.Series) -> list:
+    try:
+        edges = pd.qcut(values, 5, retbins=True, duplicates="drop")[1]
+        if len(edges) == 6:
+            return edges[1:5].tolist()
+    except ValueError:
+        pass
+    return pd.cut(values, 5, retbins=True)[1][1:5].tolist()
+
+
+def _rel_error(approx: list, exact: list) -> float:
+    return max(abs(a - e) / abs(e) if e else abs(a) for a, e in zip(approx, exact))
+
+
+def check_database(db_path: str) -> bool:
+    scratch = tempfile.mkdtemp()
+    try:
+        copy = os.path.join(scratch, "retail.db")
+        with sqlite3.connect(db_path) as src, sqlite3.connect(copy) as dst:
+            src.backup(dst)
+        with contextlib.redirect_stdout(io.StringIO()):
+            exact = perform_segmentation(copy)
+            perform_segmentation(copy, mode="sketch")
+        if exact.empty:
+            print("[CHECK] database has no transactions — skipped.")
+            return True
+        with connection(copy, readonly=True) as conn:
+            params = rfm_cut_points(load_sketches(conn))
+            sketch = pd.read_sql("SELECT customer_id, segment_id FROM customer_details", conn)
+        merged = exact.merge(sketch, on="customer_id")
+        cuts = {name: [params[f"{name}{i}"] for i in range(1, 5)] for name in "rfm"}
+        errors = {
+            "recency": _rel_error(cuts["r"], _exact_edges(exact["recency"])),
+            "frequency": _rel_error(cuts["f"], _exact_edges(exact["frequency"])),
+            "monetary": _rel_error(cuts["m"], _exact_edges(exact["monetary"])),
+        }
+        differ = (merged["segment"] != merged["segment_id"]).sum()
+        print(f"[CHECK] database: {len(merged)} customers, {differ} segments differ from exact mode")
+        for metric, err in errors.items():
+            print(f"        {metric:<10} max cut-point relative error {err:.5f}")
+        return errors["frequency"] == 0 and errors["monetary"] <= ACCURACY
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def check_synthetic(n: int) -> bool:
+    rfm = make_rfm(n, seed=3)
+    start = time.perf_counter()
+    sketches = {
+        "frequency": HistogramSketch().add(rfm["frequency"]),
+        "monetary": HistogramSketch(ACCURACY).add(rfm["monetary"]),
+    }
+    # Replace 10% of the customers, as a refresh of changed customers would
+    changed = make_rfm(n // 10, seed=4)
+    sketches["frequency"].add(rfm["frequency"][: n // 10], weight=-1).add(changed["frequency"])
+    sketches["monetary"].add(rfm["monetary"][: n // 10], weight=-1).add(changed["monetary"])
+    elapsed = time.perf_counter() - start
+    current = pd.concat([changed, rfm.iloc[n // 10:]], ignore_index=True)
+
+    f_err = _rel_error(_cut_points(sketches["frequency"]), _exact_edges(current["frequency"]))
+    m_err = _rel_error(_cut_points(sketches["monetary"]), _exact_edges(current["monetary"]))
+    print(f"[CHECK] {n:>12,} customers  frequency error {f_err:.5f}  monetary error {m_err:.5f} "
+          f"(bound {ACCURACY})  sketch updates {1.2 * n / elapsed:>12,.0f} values/s  "
+          f"{len(sketches['monetary'].counts)} monetary buckets")
+    return f_err == 0 and m_err <= ACCURACY
+
+
+def main(db_path: str, sizes: list) -> int:
+    ok = check_database(db_path)
+    for n in sizes:
+        ok = check_synthetic(n) and ok
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1] if len(sys.argv) > 1 else DB_PATH,
+                  [int(a) for a in sys.argv[2:]] or [1_000_000, 5_000_000]))
@@ -1,92 +1,87 @@
 
 
 import os
-import sqlite3
+import sys
 
 import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import pandas as pd
 
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "database", "retail.db")
-OUTPUT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:  # `streamlit run dashboard/dashboard.py`
+    sys.path.insert(0, PROJECT_ROOT)
 
-# Database helpers
+from database.backends import get_backend
+from database.connection import DB_PATH
+from database.reader import days_to_dates
 
+OUTPUT_DIR = os.path.dirname(os.path.abspath(__file__))
 
-def _get_connection(db_path: str = DB_PATH) -> sqlite3.Connection:
-    conn = sqlite3.connect(db_path)
-    conn.execute("PRAGMA foreign_keys = ON;")
-    return conn
+# Database helpers (read-only, through the configured query backend)
+
+STORES_SQL = "SELECT store_id, store_name, store_city FROM stores ORDER BY store_id"
+
+# Sales and top products come from the aggregate tables the ETL maintains
+SALES_SQL = """
+    SELECT a.transaction_day, a.txn_count, a.total_amount
+    FROM agg_store_daily_sales a
+    WHERE a.store_id = ?
+    ORDER BY a.transaction_day
+"""
+
+TOP_PRODUCTS_SQL = """
+    SELECT p.product_name, CAST(SUM(a.total_qty) AS BIGINT) AS total_qty
+    FROM agg_store_product_qty a
+    JOIN products p ON a.product_id = p.product_id
+    WHERE a.store_id = ?
+    GROUP BY p.product_name
+    ORDER BY total_qty DESC, p.product_name
+    LIMIT 10
+"""
+
+LOYALTY_SQL = """
+    SELECT c.total_loyalty_points
+    FROM customer_details c
+    JOIN store_sales_header h ON c.customer_id = h.customer_id
+    WHERE h.store_id = ?
+    GROUP BY c.customer_id, c.total_loyalty_points
+    ORDER BY c.customer_id
+"""
+
+STORE_NAME_SQL = "SELECT store_name FROM stores WHERE store_id = ?"
+
+# Per-store queries that must stay index lookups (benchmarks/check_query_plans.py)
+HOT_QUERIES = {
+    "fetch_sales": SALES_SQL,
+    "fetch_top_products": TOP_PRODUCTS_SQL,
+    "fetch_loyalty": LOYALTY_SQL,
+    "fetch_store_name": STORE_NAME_SQL,
+}
 
 
 def list_stores(db_path: str = DB_PATH) -> pd.DataFrame:
     
-    conn = _get_connection(db_path)
-    stores = pd.read_sql("SELECT store_id, store_name, store_city FROM stores", conn)
-    conn.close()
-    return stores
+    return get_backend(db_path=db_path).read(STORES_SQL)
 
 
 def fetch_sales(store_id: int, db_path: str = DB_PATH) -> pd.DataFrame:
-    conn = _get_connection(db_path)
-    df = pd.read_sql(
-        """
-        SELECT h.transaction_date, h.total_amount
-        FROM store_sales_header h
-        WHERE h.store_id = ?
-        ORDER BY h.transaction_date
-        """,
-        conn,
-        params=(store_id,),
-    )
-    conn.close()
+    """Daily sales of one store: transaction_date, txn_count, total_amount."""
+    df = get_backend(db_path=db_path).read(SALES_SQL, (store_id,))
+    df.insert(0, "transaction_date", days_to_dates(df.pop("transaction_day")))
     return df
 
 
 def fetch_top_products(store_id: int, db_path: str = DB_PATH) -> pd.DataFrame:
-    conn = _get_connection(db_path)
-    df = pd.read_sql(
-        """
-        SELECT p.product_name, SUM(li.quantity) AS total_qty
-        FROM store_sales_line_items li
-        JOIN store_sales_header h ON li.transaction_id = h.transaction_id
-        JOIN products p            ON li.product_id    = p.product_id
-        WHERE h.store_id = ?
-        GROUP BY p.product_name
-        ORDER BY total_qty DESC
-        LIMIT 10
-        """,
-        conn,
-        params=(store_id,),
-    )
-    conn.close()
-    return df
+    return get_backend(db_path=db_path).read(TOP_PRODUCTS_SQL, (store_id,))
 
 
 def fetch_loyalty(store_id: int, db_path: str = DB_PATH) -> pd.DataFrame:
-    conn = _get_connection(db_path)
-    df = pd.read_sql(
-        """
-        SELECT c.total_loyalty_points
-        FROM customer_details c
-        JOIN store_sales_header h ON c.customer_id = h.customer_id
-        WHERE h.store_id = ?
-        GROUP BY c.customer_id
-        """,
-        conn,
-        params=(store_id,),
-    )
-    conn.close()
-    return df
+    return get_backend(db_path=db_path).read(LOYALTY_SQL, (store_id,))
 
 
 def fetch_store_name(store_id: int, db_path: str = DB_PATH) -> str:
-    conn = _get_connection(db_path)
-    row = pd.read_sql(
-        "SELECT store_name FROM stores WHERE store_id = ?", conn, params=(store_id,)
-    )
-    conn.close()
+    row = get_backend(db_path=db_path).read(STORE_NAME_SQL, (store_id,))
     return row.iloc[0]["store_name"] if not row.empty else f"Store {store_id}"
 
 
@@ -97,8 +92,6 @@ def fetch_store_name(store_id: int, db_path: str = DB_PATH) -> str:
 def chart_sales_trend(sales: pd.DataFrame, store_label: str):
     fig, ax = plt.subplots(figsize=(7, 4.5))
     if not sales.empty:
-        sales = sales.copy()
-        sales["transaction_date"] = pd.to_datetime(sales["transaction_date"], errors="coerce")
         trend = sales.groupby("transaction_date")["total_amount"].sum().sort_index()
         ax.plot(trend.index, trend.values, marker="o", linewidth=1.5, color="#1f77b4")
         ax.fill_between(trend.index, trend.values, alpha=0.15, color="#1f77b4")
@@ -154,9 +147,7 @@ def generate_dashboard(store_id: int, db_path: str = DB_PATH, output_dir: str =
     # 1. Sales Trend
     ax1 = axes[0]
     if not sales.empty:
-        s = sales.copy()
-        s["transaction_date"] = pd.to_datetime(s["transaction_date"], errors="coerce")
-        trend = s.groupby("transaction_date")["total_amount"].sum().sort_index()
+        trend = sales.groupby("transaction_date")["total_amount"].sum().sort_index()
         ax1.plot(trend.index, trend.values, marker="o", linewidth=1.5, color="#1f77b4")
         ax1.tick_params(axis="x", rotation=45)
     ax1.set_title("Sales Trend")
@@ -253,7 +244,7 @@ def _run_streamlit_app():
     # KPI row
     k1, k2, k3 = st.columns(3)
     total_sales = sales["total_amount"].sum() if not sales.empty else 0
-    num_txn = len(sales) if not sales.empty else 0
+    num_txn = int(sales["txn_count"].sum()) if not sales.empty else 0
     avg_loyalty = loyalty["total_loyalty_points"].mean() if not loyalty.empty else 0
     k1.metric("Total Sales (\u20b9)", f"\u20b9{total_sales:,.2f}")
     k2.metric("Transactions", f"{num_txn:,}")
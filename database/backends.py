@@ -0,0 +1,101 @@
+"""
+database/backends.py
+--------------------
+Pluggable read engines for the analytics and dashboard queries.
+
+* sqlite  (default) — pooled read-only connections to retail.db
+* duckdb  (optional, ``pip install duckdb``) — DuckDB's columnar engine
+          reading the same retail.db through its sqlite extension
+
+Group-bys and joins are pushed into the query, so only aggregated rows
+reach pandas. The queries stick to SQL both engines run identically (no
+julianday/strftime, integer sums cast to BIGINT, money sums rounded to
+cents, explicit ORDER BY), so switching backend does not change results.
+Writes always go through database.connection.
+
+    python main.py --query-backend duckdb      (or RETAIL_QUERY_BACKEND=duckdb)
+"""
+
+import os
+import threading
+
+import pandas as pd
+
+from database.connection import DB_PATH, connection
+from database.reader import read_frame, type_columns
+
+BACKENDS = ("sqlite", "duckdb")
+
+_default_backend = os.environ.get("RETAIL_QUERY_BACKEND", "sqlite")
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+class SQLiteBackend:
+    """Reads through the shared read-only SQLite connection pool."""
+
+    name = "sqlite"
+
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+
+    def read(self, sql: str, params=None) -> pd.DataFrame:
+        with connection(self.db_path, readonly=True) as conn:
+            return read_frame(sql, conn, params=params)
+
+
+class DuckDBBackend:
+    """Reads retail.db through an in-process DuckDB attached read-only."""
+
+    name = "duckdb"
+
+    def __init__(self, db_path: str = DB_PATH):
+        import duckdb  # optional dependency
+
+        self.db_path = db_path
+        self._con = duckdb.connect()
+        self._con.execute("INSTALL sqlite")
+        self._con.execute("LOAD sqlite")
+        path = os.path.abspath(db_path).replace("'", "''")
+        self._con.execute(f"ATTACH '{path}' AS retail (TYPE SQLITE, READ_ONLY)")
+        self._local = threading.local()
+
+    def _cursor(self):
+        # DuckDB cursors are per-thread handles on the same database instance
+        cur = getattr(self._local, "cursor", None)
+        if cur is None:
+            cur = self._local.cursor = self._con.cursor()
+            cur.execute("USE retail")
+        return cur
+
+    def read(self, sql: str, params=None) -> pd.DataFrame:
+        df = self._cursor().execute(sql, list(params or ())).df()
+        # Match read_sql's dtypes: text as pandas strings, not object
+        text = [c for c in df.columns if df[c].dtype == object]
+        if text:
+            df = df.astype({c: "str" for c in text})
+        return type_columns(df)
+
+
+_CLASSES = {"sqlite": SQLiteBackend, "duckdb": DuckDBBackend}
+
+
+def set_default_backend(name: str) -> None:
+    """Choose the backend get_backend() returns when none is named."""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown query backend {name!r}; expected one of {BACKENDS}")
+    global _default_backend
+    _default_backend = name
+
+
+def get_backend(name: str = None, db_path: str = DB_PATH):
+    """Return the (shared) query backend ``name`` for ``db_path``."""
+    name = name or _default_backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown query backend {name!r}; expected one of {BACKENDS}")
+    key = (name, os.path.abspath(db_path))
+    with _backends_lock:
+        backend = _backends.get(key)
+        if backend is None:
+            backend = _backends[key] = _CLASSES[name](db_path)
+    return backend
@@ -0,0 +1,152 @@
+"""
+database/connection.py
+----------------------
+Shared SQLite connections for the ETL, analytics and dashboard code.
+
+Connections are opened once with tuned pragmas and then reused from a small
+per-thread pool, so code that runs many short queries (one dashboard per
+store, four queries each) does not pay for a new connection every time.
+
+* read-write connections — foreign keys on; transactions start with
+                           BEGIN IMMEDIATE, so concurrent writers (parallel
+                           pipeline nodes) queue on the busy timeout instead
+                           of failing when a read turns into a write
+* read-only connections  — opened with ``mode=ro`` and ``query_only``, safe
+                           for analytics/dashboard threads to use alongside
+                           a writer because the database runs in WAL mode
+
+Each thread only ever sees its own connections; use the manager from any
+thread and it hands back one that belongs to the caller.
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from urllib.parse import quote
+
+DB_PATH = os.path.join(os.path.dirname(__file__), "retail.db")
+
+# Seconds to wait on a locked database before raising "database is locked"
+BUSY_TIMEOUT = 30
+
+# Applied to every connection when it is opened
+TUNED_PRAGMAS = {
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64_000,  # 64 MB
+    "temp_store": "MEMORY",
+}
+
+# Idle connections kept per thread and per kind (read-only / read-write)
+DEFAULT_POOL_SIZE = 2
+
+
+def open_connection(db_path: str = DB_PATH, readonly: bool = False) -> sqlite3.Connection:
+    """Open a new connection with TUNED_PRAGMAS applied.
+
+    Read-only connections fail if the database file does not exist instead
+    of silently creating an empty one.
+    """
+    if readonly:
+        uri = f"file:{quote(os.path.abspath(db_path))}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        conn.execute("PRAGMA query_only = ON;")
+    else:
+        conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, check_same_thread=False,
+                               isolation_level="IMMEDIATE")
+        conn.execute("PRAGMA foreign_keys = ON;")
+    for name, value in TUNED_PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+class ConnectionManager:
+    """Per-thread pool of tuned connections to one database file."""
+
+    def __init__(self, db_path: str = DB_PATH, pool_size: int = DEFAULT_POOL_SIZE):
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._open = []  # every connection handed out, for close_all()
+        self._wal_checked = False
+
+    def _idle(self, readonly: bool) -> list:
+        pools = getattr(self._local, "pools", None)
+        if pools is None:
+            pools = self._local.pools = {True: [], False: []}
+        return pools[readonly]
+
+    def _ensure_wal(self) -> None:
+        """Switch the file to WAL once so readers never block the writer."""
+        if self._wal_checked:
+            return
+        with self._lock:
+            if self._wal_checked:
+                return
+            if os.path.exists(self.db_path):
+                conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT)
+                try:
+                    conn.execute("PRAGMA journal_mode = WAL;")
+                finally:
+                    conn.close()
+            self._wal_checked = True
+
+    def acquire(self, readonly: bool = False) -> sqlite3.Connection:
+        """Take an idle connection of this thread, or open a new one."""
+        idle = self._idle(readonly)
+        if idle:
+            return idle.pop()
+        self._ensure_wal()
+        conn = open_connection(self.db_path, readonly=readonly)
+        with self._lock:
+            self._open.append(conn)
+        return conn
+
+    def release(self, conn: sqlite3.Connection, readonly: bool = False) -> None:
+        """Hand ``conn`` back; uncommitted work is rolled back."""
+        if conn.in_transaction:
+            conn.rollback()
+        idle = self._idle(readonly)
+        if len(idle) < self.pool_size:
+            idle.append(conn)
+            return
+        with self._lock:
+            self._open.remove(conn)
+        conn.close()
+
+    @contextmanager
+    def connection(self, readonly: bool = False):
+        """``with manager.connection() as conn:`` — a pooled connection for the block."""
+        conn = self.acquire(readonly)
+        try:
+            yield conn
+        finally:
+            self.release(conn, readonly)
+
+    def close_all(self) -> None:
+        """Close every connection this manager opened, in any thread."""
+        with self._lock:
+            conns, self._open = self._open, []
+            self._local = threading.local()
+        for conn in conns:
+            conn.close()
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_manager(db_path: str = DB_PATH) -> ConnectionManager:
+    """Return the process-wide ConnectionManager for ``db_path``."""
+    key = os.path.abspath(db_path)
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = _managers[key] = ConnectionManager(db_path)
+    return manager
+
+
+def connection(db_path: str = DB_PATH, readonly: bool = False):
+    """Shortcut for ``get_manager(db_path).connection(readonly)``."""
+    return get_manager(db_path).connection(readonly)
@@ -0,0 +1,246 @@
+"""
+database/migrations.py
+----------------------
+Versioned, additive schema changes applied on top of SCHEMA_SQL.
+
+The schema version lives in SQLite's ``PRAGMA user_version``. migrate()
+applies every migration newer than that, each in its own transaction, and
+never drops data — unlike setup_database(), it is safe on a loaded database.
+Add new steps to the end of MIGRATIONS; never edit one that has shipped.
+
+    python -m database.migrations    # migrate database/retail.db in place
+
+benchmarks/check_query_plans.py uses full_scans() to catch hot queries
+regressing to full table scans.
+"""
+
+import sqlite3
+
+# Recompute the aggregate tables from the fact tables. The ETL keeps them
+# current with deltas (etl/aggregates.py); this is the from-scratch version.
+AGGREGATE_BACKFILL = [
+    "DELETE FROM agg_store_daily_sales",
+    """INSERT INTO agg_store_daily_sales (store_id, transaction_day, txn_count, total_amount)
+       SELECT store_id, transaction_day, COUNT(*), TOTAL(total_amount)
+       FROM store_sales_header
+       WHERE store_id IS NOT NULL AND transaction_day IS NOT NULL
+       GROUP BY store_id, transaction_day""",
+    "DELETE FROM agg_store_product_qty",
+    """INSERT INTO agg_store_product_qty (store_id, product_id, total_qty, line_count)
+       SELECT h.store_id, li.product_id, COALESCE(SUM(li.quantity), 0), COUNT(*)
+       FROM store_sales_line_items li
+       JOIN store_sales_header h ON h.transaction_id = li.transaction_id
+       WHERE h.store_id IS NOT NULL AND li.product_id IS NOT NULL
+       GROUP BY h.store_id, li.product_id""",
+    "DELETE FROM agg_product_daily_qty",
+    """INSERT INTO agg_product_daily_qty (product_id, transaction_day, total_qty, line_count)
+       SELECT li.product_id, h.transaction_day, COALESCE(SUM(li.quantity), 0), COUNT(*)
+       FROM store_sales_line_items li
+       JOIN store_sales_header h ON h.transaction_id = li.transaction_id
+       WHERE h.transaction_day IS NOT NULL AND li.product_id IS NOT NULL
+       GROUP BY li.product_id, h.transaction_day""",
+]
+
+# Migration 8's aggregate, kept out of AGGREGATE_BACKFILL so migration 3 replays unchanged
+STORE_PRODUCT_DAILY_BACKFILL = [
+    "DELETE FROM agg_store_product_daily_qty",
+    """INSERT INTO agg_store_product_daily_qty (transaction_day, store_id, product_id, total_qty, line_count)
+       SELECT h.transaction_day, h.store_id, li.product_id, COALESCE(SUM(li.quantity), 0), COUNT(*)
+       FROM store_sales_line_items li
+       JOIN store_sales_header h ON h.transaction_id = li.transaction_id
+       WHERE h.transaction_day IS NOT NULL AND h.store_id IS NOT NULL AND li.product_id IS NOT NULL
+       GROUP BY h.transaction_day, h.store_id, li.product_id""",
+]
+
+# (version, description, statements)
+MIGRATIONS = [
+    (1, "covering indexes for dashboard/analytics hot paths", [
+        # Dashboard: WHERE store_id = ? ORDER BY transaction_date, reading date/amount/customer
+        "CREATE INDEX IF NOT EXISTS idx_header_store_date "
+        "ON store_sales_header (store_id, transaction_date, total_amount, customer_id)",
+        # Per-customer group-bys (loyalty, RFM, promotion sensitivity)
+        "CREATE INDEX IF NOT EXISTS idx_header_customer_date "
+        "ON store_sales_header (customer_id, transaction_date, total_amount)",
+        # line_items ⋈ header on transaction_id, reading product/quantity/promotion
+        "CREATE INDEX IF NOT EXISTS idx_line_items_txn "
+        "ON store_sales_line_items (transaction_id, product_id, quantity, promotion_id)",
+        # Per-product group-bys (stock-out risk, top products)
+        "CREATE INDEX IF NOT EXISTS idx_line_items_product "
+        "ON store_sales_line_items (product_id, quantity)",
+    ]),
+    (2, "integer epoch-day column for transaction date ranges", [
+        # Dates are stored as DATE_FORMAT text; date() drops the time so the day is exact
+        "ALTER TABLE store_sales_header ADD COLUMN transaction_day INTEGER "
+        "GENERATED ALWAYS AS (CAST(julianday(date(transaction_date)) - 2440587.5 AS INTEGER)) VIRTUAL",
+        "CREATE INDEX IF NOT EXISTS idx_header_day "
+        "ON store_sales_header (transaction_day, store_id, total_amount)",
+    ]),
+    (3, "incrementally maintained store/day and store/product aggregates", [
+        """CREATE TABLE IF NOT EXISTS agg_store_daily_sales (
+            store_id        INTEGER NOT NULL,
+            transaction_day INTEGER NOT NULL,
+            txn_count       INTEGER NOT NULL,
+            total_amount    REAL NOT NULL,
+            PRIMARY KEY (store_id, transaction_day)
+        ) WITHOUT ROWID""",
+        """CREATE TABLE IF NOT EXISTS agg_store_product_qty (
+            store_id    INTEGER NOT NULL,
+            product_id  TEXT NOT NULL,
+            total_qty   INTEGER NOT NULL,
+            line_count  INTEGER NOT NULL,
+            PRIMARY KEY (store_id, product_id)
+        ) WITHOUT ROWID""",
+        """CREATE TABLE IF NOT EXISTS agg_product_daily_qty (
+            product_id      TEXT NOT NULL,
+            transaction_day INTEGER NOT NULL,
+            total_qty       INTEGER NOT NULL,
+            line_count      INTEGER NOT NULL,
+            PRIMARY KEY (product_id, transaction_day)
+        ) WITHOUT ROWID""",
+        *AGGREGATE_BACKFILL,
+    ]),
+    (4, "loyalty points ledger", [
+        # One row per scored transaction; the scored fields detect later upserts
+        """CREATE TABLE IF NOT EXISTS loyalty_ledger (
+            transaction_id   INTEGER PRIMARY KEY,
+            customer_id      TEXT,
+            transaction_date TEXT,
+            total_amount     REAL,
+            rule_id          INTEGER,
+            points_earned    REAL,
+            scored_at        DATETIME DEFAULT CURRENT_TIMESTAMP
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_ledger_customer ON loyalty_ledger (customer_id)",
+    ]),
+    (5, "running RFM state and quantile sketches", [
+        # Per-customer recency/frequency/monetary inputs, as RFM_SQL computes them
+        """CREATE TABLE IF NOT EXISTS rfm_state (
+            customer_id           TEXT PRIMARY KEY,
+            last_transaction_date TEXT NOT NULL,
+            last_day              INTEGER NOT NULL,
+            frequency             INTEGER NOT NULL,
+            monetary              REAL NOT NULL
+        ) WITHOUT ROWID""",
+        # Customers per bucket of each rfm_state metric (analytics/sketches.py)
+        """CREATE TABLE IF NOT EXISTS rfm_sketch (
+            metric    TEXT NOT NULL,
+            bucket    INTEGER NOT NULL,
+            customers INTEGER NOT NULL,
+            PRIMARY KEY (metric, bucket)
+        ) WITHOUT ROWID""",
+        # Customers whose transactions changed since rfm_state was last folded
+        "CREATE TABLE IF NOT EXISTS rfm_pending (customer_id TEXT PRIMARY KEY) WITHOUT ROWID",
+        """INSERT OR IGNORE INTO rfm_pending (customer_id)
+           SELECT DISTINCT customer_id FROM store_sales_header WHERE customer_id IS NOT NULL""",
+    ]),
+    (6, "RFM segment history", [
+        # One row per customer and as-of date (analytics.segmentation.segment_history)
+        """CREATE TABLE IF NOT EXISTS segment_history (
+            as_of       TEXT NOT NULL,
+            customer_id TEXT NOT NULL,
+            recency     INTEGER,
+            frequency   INTEGER,
+            monetary    REAL,
+            rfm_score   TEXT,
+            segment     TEXT,
+            PRIMARY KEY (as_of, customer_id)
+        ) WITHOUT ROWID""",
+        "CREATE INDEX IF NOT EXISTS idx_segment_history_customer ON segment_history (customer_id, as_of)",
+    ]),
+    (7, "fact table load generations", [
+        # Bumped by every load into a fact table (etl.manifest.bump_generation);
+        # cached frames (analytics.context) are only reloaded when it moves
+        """CREATE TABLE IF NOT EXISTS load_generations (
+            table_name TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL
+        ) WITHOUT ROWID""",
+    ]),
+    (8, "store/product/day quantities for rolling demand windows", [
+        # Day first: a rolling window is one range of the primary key
+        """CREATE TABLE IF NOT EXISTS agg_store_product_daily_qty (
+            transaction_day INTEGER NOT NULL,
+            store_id        INTEGER NOT NULL,
+            product_id      TEXT NOT NULL,
+            total_qty       INTEGER NOT NULL,
+            line_count      INTEGER NOT NULL,
+            PRIMARY KEY (transaction_day, store_id, product_id)
+        ) WITHOUT ROWID""",
+        *STORE_PRODUCT_DAILY_BACKFILL,
+    ]),
+    (9, "header rows to rescore for loyalty", [
+        # Transactions the ETL upserted since calculate_loyalty() last ran; new
+        # ones above the ledger's last transaction_id are found without it
+        "CREATE TABLE IF NOT EXISTS loyalty_pending (transaction_id INTEGER PRIMARY KEY)",
+        # Rows the ledger is already missing or out of date on, the one time
+        """INSERT OR IGNORE INTO loyalty_pending (transaction_id)
+           SELECT h.transaction_id
+           FROM store_sales_header h
+           LEFT JOIN loyalty_ledger l ON l.transaction_id = h.transaction_id
+           WHERE l.transaction_id IS NULL
+              OR l.customer_id IS DISTINCT FROM h.customer_id
+              OR l.transaction_date IS DISTINCT FROM h.transaction_date
+              OR l.total_amount IS DISTINCT FROM h.total_amount""",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection, target: int = LATEST_VERSION) -> int:
+    """Apply pending migrations up to ``target``; return the resulting version."""
+    version = current_version(conn)
+    for step, description, statements in MIGRATIONS:
+        if step <= version or step > target:
+            continue
+        with conn:
+            conn.execute("BEGIN")
+            for sql in statements:
+                conn.execute(sql)
+            conn.execute(f"PRAGMA user_version = {step}")
+        print(f"[DB] Migration {step}: {description}")
+        version = step
+    return version
+
+
+def query_plan(conn: sqlite3.Connection, sql: str, params=()) -> list:
+    """Return the detail strings of ``EXPLAIN QUERY PLAN sql``."""
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+
+
+def full_scans(conn: sqlite3.Connection, sql: str, params=(), allow_covering: bool = False) -> list:
+    """Return the plan steps of ``sql`` that read a whole table.
+
+    Scanning a covering index also reads every row; it is only accepted with
+    ``allow_covering`` (whole-table aggregates, where it is the best plan).
+    Scans of a subquery's materialized rows are not table reads.
+    """
+    scans, subqueries = [], set()
+    for step in query_plan(conn, sql, params):
+        if step.startswith(("MATERIALIZE ", "CO-ROUTINE ")):
+            subqueries.add(step.split(" ", 1)[1])
+        if not step.startswith("SCAN ") or step == "SCAN CONSTANT ROW":
+            continue
+        if step[len("SCAN "):] in subqueries:
+            continue
+        if allow_covering and "USING COVERING INDEX" in step:
+            continue
+        scans.append(step)
+    return scans
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from database.setup import get_connection
+
+    conn = get_connection()
+    try:
+        print(f"[DB] Schema version {migrate(conn)}.")
+    finally:
+        conn.close()
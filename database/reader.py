@@ -0,0 +1,61 @@
+"""
+database/reader.py
+------------------
+Typed reads for analytics and dashboard code.
+
+The ETL stores every date column as ISO text in DATE_FORMAT, and
+store_sales_header also carries ``transaction_day`` (days since
+1970-01-01, an indexed generated column) for date-range predicates.
+read_frame() returns those columns already typed — datetime64 for dates,
+integers for epoch days — so callers never re-parse free-form strings.
+
+Reads that only need the day select transaction_day and convert it with
+days_to_dates() (the dashboard's daily sales). The analytics keep the full
+timestamp: loyalty rule windows, RFM recency and the segment-history
+cutoffs all compare times of day, so those columns are parsed, with the
+fixed DATE_FORMAT.
+"""
+
+import pandas as pd
+
+# How the ETL writes dates (sortable as text)
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+DATE_COLUMNS = {
+    "transaction_date", "start_date", "end_date", "opening_date",
+    "customer_since", "last_purchase_date",
+}
+
+# Integer epoch-day companions of date columns
+DAY_COLUMNS = {"transaction_day"}
+
+
+def parse_dates(col: pd.Series) -> pd.Series:
+    """Parse a column of DATE_FORMAT strings to datetime64 (bad values → NaT).
+
+    The fixed format skips pandas' per-value format inference, and repeated
+    dates are parsed once through to_datetime's cache.
+    """
+    if pd.api.types.is_datetime64_any_dtype(col):
+        return col
+    return pd.to_datetime(col, format=DATE_FORMAT, errors="coerce", cache=True)
+
+
+def days_to_dates(days: pd.Series) -> pd.Series:
+    """Epoch days (e.g. transaction_day) → datetime64, without any string parsing."""
+    return pd.to_datetime(days, unit="D")
+
+
+def type_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert DATE_COLUMNS to datetime64 and DAY_COLUMNS to Int64 in place."""
+    for col in df.columns:
+        if col in DATE_COLUMNS:
+            df[col] = parse_dates(df[col])
+        elif col in DAY_COLUMNS:
+            df[col] = df[col].astype("Int64")
+    return df
+
+
+def read_frame(sql: str, conn, params=None) -> pd.DataFrame:
+    """``pd.read_sql`` with DATE_COLUMNS as datetime64 and DAY_COLUMNS as Int64."""
+    return type_columns(pd.read_sql(sql, conn, params=params))
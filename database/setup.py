@@ -5,38 +5,22 @@ Creates the SQLite retail database and all required tables.
 """
 
 import sqlite3
-import os
 
-
-DB_PATH = os.path.join(os.path.dirname(__file__), "retail.db")
+from database.connection import DB_PATH, open_connection
+from database.migrations import migrate
 
 
 def get_connection(db_path: str = DB_PATH) -> sqlite3.Connection:
-    """Return a connection to the retail SQLite database."""
-    conn = sqlite3.connect(db_path)
-    conn.execute("PRAGMA foreign_keys = ON;")
-    return conn
+    """Return a new (unpooled) read-write connection to the retail SQLite database.
 
+    Short-lived readers should use database.connection.connection() instead.
+    """
+    return open_connection(db_path)
 
-def setup_database(db_path: str = DB_PATH) -> None:
-    """Create all tables if they do not already exist."""
-    conn = get_connection(db_path)
-    cursor = conn.cursor()
-
-    # Drop tables if they exist
-    tables = [
-        "store_sales_line_items", "store_sales_header", "customer_details",
-        "products", "promotion_details", "loyalty_rules", "stores",
-        "rejected_store_sales_line_items", "rejected_store_sales_header",
-        "rejected_customer_details", "rejected_products", "rejected_promotion_details",
-        "rejected_loyalty_rules", "rejected_stores"
-    ]
-    for table in tables:
-        cursor.execute(f"DROP TABLE IF EXISTS {table}")
 
-    cursor.executescript("""
+SCHEMA_SQL = """
     -- Stores
-    CREATE TABLE stores (
+    CREATE TABLE IF NOT EXISTS stores (
         store_id        INTEGER PRIMARY KEY,
         store_name      TEXT NOT NULL,
         store_city      TEXT,
@@ -45,7 +29,7 @@ def setup_database(db_path: str = DB_PATH) -> None:
     );
 
     -- Products
-    CREATE TABLE products (
+    CREATE TABLE IF NOT EXISTS products (
         product_id          TEXT PRIMARY KEY,
         product_name        TEXT NOT NULL,
         product_category    TEXT,
@@ -55,7 +39,7 @@ def setup_database(db_path: str = DB_PATH) -> None:
     );
 
     -- Customer Details
-    CREATE TABLE customer_details (
+    CREATE TABLE IF NOT EXISTS customer_details (
         customer_id             TEXT PRIMARY KEY,
         first_name              TEXT,
         email                   TEXT,
@@ -69,7 +53,7 @@ def setup_database(db_path: str = DB_PATH) -> None:
     );
 
     -- Promotion Details
-    CREATE TABLE promotion_details (
+    CREATE TABLE IF NOT EXISTS promotion_details (
         promotion_id        INTEGER PRIMARY KEY,
         promotion_name      TEXT,
         start_date          TEXT,
@@ -79,7 +63,7 @@ def setup_database(db_path: str = DB_PATH) -> None:
     );
 
     -- Loyalty Rules
-    CREATE TABLE loyalty_rules (
+    CREATE TABLE IF NOT EXISTS loyalty_rules (
         rule_id             INTEGER PRIMARY KEY,
         rule_name           TEXT,
         points_per_unit_spend REAL,
@@ -90,7 +74,7 @@ def setup_database(db_path: str = DB_PATH) -> None:
     );
 
     -- Store Sales Header
-    CREATE TABLE store_sales_header (
+    CREATE TABLE IF NOT EXISTS store_sales_header (
         transaction_id   INTEGER PRIMARY KEY,
         customer_id      TEXT,
         store_id         INTEGER,
@@ -101,7 +85,7 @@ def setup_database(db_path: str = DB_PATH) -> None:
     );
 
     -- Store Sales Line Items
-    CREATE TABLE store_sales_line_items (
+    CREATE TABLE IF NOT EXISTS store_sales_line_items (
         line_item_id     INTEGER PRIMARY KEY,
         transaction_id   INTEGER,
         product_id       TEXT,
@@ -114,15 +98,83 @@ def setup_database(db_path: str = DB_PATH) -> None:
     );
 
     -- Reject tables (for ETL rejects)
-    CREATE TABLE rejected_stores        (store_id INTEGER, store_name TEXT, store_city TEXT, store_region TEXT, opening_date TEXT, reject_reason TEXT);
-    CREATE TABLE rejected_products      (product_id TEXT, product_name TEXT, product_category TEXT, unit_price REAL, current_stock_level INTEGER, restock_flag INTEGER, reject_reason TEXT);
-    CREATE TABLE rejected_customer_details (customer_id TEXT, first_name TEXT, email TEXT, loyalty_status TEXT, total_loyalty_points REAL, last_purchase_date TEXT, segment_id TEXT, customer_phone TEXT, customer_since TEXT, promotion_sensitivity TEXT, reject_reason TEXT);
-    CREATE TABLE rejected_promotion_details (promotion_id INTEGER, promotion_name TEXT, start_date TEXT, end_date TEXT, discount_percentage REAL, applicable_category TEXT, reject_reason TEXT);
-    CREATE TABLE rejected_loyalty_rules (rule_id INTEGER, rule_name TEXT, points_per_unit_spend REAL, min_spend_threshold REAL, bonus_points REAL, start_date TEXT, end_date TEXT, reject_reason TEXT);
-    CREATE TABLE rejected_store_sales_header (transaction_id INTEGER, customer_id TEXT, store_id INTEGER, transaction_date TEXT, total_amount REAL, reject_reason TEXT);
-    CREATE TABLE rejected_store_sales_line_items (line_item_id INTEGER, transaction_id INTEGER, product_id TEXT, promotion_id INTEGER, quantity INTEGER, line_item_amount REAL, reject_reason TEXT);
-    """)
+    CREATE TABLE IF NOT EXISTS rejected_stores        (store_id INTEGER, store_name TEXT, store_city TEXT, store_region TEXT, opening_date TEXT, reject_reason TEXT);
+    CREATE TABLE IF NOT EXISTS rejected_products      (product_id TEXT, product_name TEXT, product_category TEXT, unit_price REAL, current_stock_level INTEGER, restock_flag INTEGER, reject_reason TEXT);
+    CREATE TABLE IF NOT EXISTS rejected_customer_details (customer_id TEXT, first_name TEXT, email TEXT, loyalty_status TEXT, total_loyalty_points REAL, last_purchase_date TEXT, segment_id TEXT, customer_phone TEXT, customer_since TEXT, promotion_sensitivity TEXT, reject_reason TEXT);
+    CREATE TABLE IF NOT EXISTS rejected_promotion_details (promotion_id INTEGER, promotion_name TEXT, start_date TEXT, end_date TEXT, discount_percentage REAL, applicable_category TEXT, reject_reason TEXT);
+    CREATE TABLE IF NOT EXISTS rejected_loyalty_rules (rule_id INTEGER, rule_name TEXT, points_per_unit_spend REAL, min_spend_threshold REAL, bonus_points REAL, start_date TEXT, end_date TEXT, reject_reason TEXT);
+    CREATE TABLE IF NOT EXISTS rejected_store_sales_header (transaction_id INTEGER, customer_id TEXT, store_id INTEGER, transaction_date TEXT, total_amount REAL, reject_reason TEXT);
+    CREATE TABLE IF NOT EXISTS rejected_store_sales_line_items (line_item_id INTEGER, transaction_id INTEGER, product_id TEXT, promotion_id INTEGER, quantity INTEGER, line_item_amount REAL, reject_reason TEXT);
+
+    -- ETL bookkeeping (incremental loads)
+    CREATE TABLE IF NOT EXISTS etl_manifest (
+        file_name    TEXT PRIMARY KEY,
+        table_name   TEXT NOT NULL,
+        file_hash    TEXT NOT NULL,
+        rows_loaded  INTEGER DEFAULT 0,
+        processed_at TEXT
+    );
+    CREATE TABLE IF NOT EXISTS etl_watermarks (
+        table_name           TEXT PRIMARY KEY,
+        max_transaction_id   INTEGER,
+        max_transaction_date TEXT,
+        updated_at           TEXT
+    );
+"""
+
+TABLES = [
+    "store_sales_line_items", "store_sales_header", "customer_details",
+    "products", "promotion_details", "loyalty_rules", "stores",
+    "rejected_store_sales_line_items", "rejected_store_sales_header",
+    "rejected_customer_details", "rejected_products", "rejected_promotion_details",
+    "rejected_loyalty_rules", "rejected_stores",
+    "etl_manifest", "etl_watermarks",
+    "agg_store_daily_sales", "agg_store_product_qty", "agg_product_daily_qty",
+    "agg_store_product_daily_qty",
+    "loyalty_ledger", "loyalty_pending", "rfm_state", "rfm_sketch", "rfm_pending",
+    "segment_history",
+]
+
+
+def ensure_schema(db_path: str = DB_PATH) -> None:
+    """Create missing tables and apply pending migrations without touching existing data."""
+    conn = get_connection(db_path)
+    conn.executescript(SCHEMA_SQL)
+    conn.commit()
+    migrate(conn)
+    conn.close()
+    print("[DB] Schema verified — existing data kept.")
 
+
+def get_primary_key(conn: sqlite3.Connection, table_name: str) -> list:
+    """Return the primary-key column names of ``table_name`` in key order."""
+    info = conn.execute(f"PRAGMA table_info({table_name})").fetchall()
+    return [row[1] for row in sorted(info, key=lambda r: r[5]) if row[5] > 0]
+
+
+def get_foreign_keys(conn: sqlite3.Connection, table_name: str) -> list:
+    """Return (column, parent_table, parent_column) for each FOREIGN KEY of ``table_name``."""
+    rows = conn.execute(f"PRAGMA foreign_key_list({table_name})").fetchall()
+    return [(row[3], row[2], row[4]) for row in rows]
+
+
+def setup_database(db_path: str = DB_PATH) -> None:
+    """Drop and recreate all tables, then apply database.migrations."""
+    conn = get_connection(db_path)
+    cursor = conn.cursor()
+
+    # Drop tables if they exist
+    for table in TABLES:
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+
+    cursor.executescript(SCHEMA_SQL)
+    # Indexes went with the dropped tables; replay every migration
+    cursor.execute("PRAGMA user_version = 0")
+
+    conn.commit()
+    migrate(conn)
+    # load_generations outlives the drop, so caches of the old rows see a change
+    conn.execute("UPDATE load_generations SET generation = generation + 1")
     conn.commit()
     conn.close()
     print("[DB] Database setup complete — all tables created.")
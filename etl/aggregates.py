@@ -0,0 +1,168 @@
+"""
+etl/aggregates.py
+-----------------
+Keeps the summary tables from database migration 3 in step with the fact
+tables as the ETL loads them.
+
+* agg_store_daily_sales  — transactions and sales per store and day
+* agg_store_product_qty  — quantity sold per store and product
+* agg_product_daily_qty  — quantity sold per product and day
+* agg_store_product_daily_qty — quantity sold per store, product and day
+                          (migration 8; rolling demand windows)
+
+For each loaded batch the rows' contribution to the aggregates is read
+before the load (only needed when upserting over existing keys) and after
+it; the difference is added to the aggregate rows. That covers new rows,
+updated amounts/quantities, and header rows that move to another store or
+day (their line items move with them). rebuild_aggregates() recomputes
+everything from scratch.
+
+Header loads also queue the customers they touch (before and after the
+load) in rfm_pending, for the incremental RFM mode in analytics.segmentation,
+and header upserts queue their transactions in loyalty_pending, for
+analytics.loyalty to rescore.
+"""
+
+import sqlite3
+
+import pandas as pd
+
+from database.migrations import AGGREGATE_BACKFILL, STORE_PRODUCT_DAILY_BACKFILL
+
+# agg table → (key columns, summed columns, row-count column)
+AGGREGATES = {
+    "agg_store_daily_sales": (["store_id", "transaction_day"], ["total_amount"], "txn_count"),
+    "agg_store_product_qty": (["store_id", "product_id"], ["total_qty"], "line_count"),
+    "agg_product_daily_qty": (["product_id", "transaction_day"], ["total_qty"], "line_count"),
+    "agg_store_product_daily_qty": (["transaction_day", "store_id", "product_id"], ["total_qty"], "line_count"),
+}
+
+# Fact table → primary key used to find a batch's rows
+SOURCE_TABLES = {
+    "store_sales_header": "transaction_id",
+    "store_sales_line_items": "line_item_id",
+}
+
+_HEADER_SQL = """
+    SELECT h.store_id, h.transaction_day, h.total_amount
+    FROM store_sales_header h JOIN temp._agg_keys k ON h.transaction_id = k.id
+    WHERE h.store_id IS NOT NULL AND h.transaction_day IS NOT NULL
+"""
+
+# Line items with the store/day of their header; {join} picks which lines
+_LINES_SQL = """
+    SELECT h.store_id, h.transaction_day, li.product_id, li.quantity
+    FROM store_sales_line_items li
+    JOIN temp._agg_keys k ON {join} = k.id
+    JOIN store_sales_header h ON h.transaction_id = li.transaction_id
+    WHERE li.product_id IS NOT NULL
+"""
+
+_CUSTOMERS_SQL = """
+    SELECT DISTINCT h.customer_id
+    FROM store_sales_header h JOIN temp._agg_keys k ON h.transaction_id = k.id
+    WHERE h.customer_id IS NOT NULL
+"""
+
+
+def _stage_keys(conn: sqlite3.Connection, keys) -> None:
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS _agg_keys (id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM temp._agg_keys")
+    conn.executemany(
+        "INSERT OR IGNORE INTO temp._agg_keys (id) VALUES (?)",
+        ((int(k),) for k in pd.to_numeric(keys, errors="coerce").dropna().unique()),
+    )
+
+
+def _contributions(conn: sqlite3.Connection, table_name: str, df: pd.DataFrame) -> dict:
+    """{agg table: frame of the batch's stored rows, one row per fact row}.
+
+    Header batches also return their customers under "rfm_pending".
+    """
+    # Commit the temp-table writes so no transaction is left open for bulk_load
+    with conn:
+        _stage_keys(conn, df[SOURCE_TABLES[table_name]])
+        if table_name == "store_sales_header":
+            header = pd.read_sql(_HEADER_SQL, conn)
+            # A header's line items follow it to its store/day
+            lines = pd.read_sql(_LINES_SQL.format(join="li.transaction_id"), conn)
+            parts = {"agg_store_daily_sales": header,
+                     "rfm_pending": pd.read_sql(_CUSTOMERS_SQL, conn)}
+        else:
+            lines = pd.read_sql(_LINES_SQL.format(join="li.line_item_id"), conn)
+            parts = {}
+        conn.execute("DELETE FROM temp._agg_keys")
+    lines = lines.rename(columns={"quantity": "total_qty"})
+    parts["agg_store_product_qty"] = lines
+    parts["agg_product_daily_qty"] = lines
+    parts["agg_store_product_daily_qty"] = lines
+    return parts
+
+
+def snapshot(conn: sqlite3.Connection, table_name: str, df: pd.DataFrame):
+    """Aggregate contribution of the stored rows ``df`` is about to overwrite.
+
+    Call before an upsert; returns None for tables without aggregates.
+    """
+    if table_name not in SOURCE_TABLES or df.empty:
+        return None
+    return _contributions(conn, table_name, df)
+
+
+def _apply(conn: sqlite3.Connection, agg_table: str, after: pd.DataFrame, before) -> int:
+    keys, sums, count = AGGREGATES[agg_table]
+    after = after.assign(**{count: 1})
+    if before is not None and not before.empty:
+        before = before.assign(**{count: 1})
+        before[sums + [count]] = -before[sums + [count]].fillna(0)
+        after = pd.concat([after, before], ignore_index=True)
+    if after.empty:
+        return 0
+    delta = after.groupby(keys, as_index=False)[sums + [count]].sum()
+    # Re-loading unchanged rows must cancel out, not leave float residue behind
+    delta[sums] = delta[sums].round(6)
+    delta = delta.loc[(delta[sums + [count]] != 0).any(axis=1)]
+    if delta.empty:
+        return 0
+
+    cols = keys + sums + [count]
+    updates = ", ".join(f"{c} = {c} + excluded.{c}" for c in sums + [count])
+    conn.executemany(
+        f"INSERT INTO {agg_table} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))}) "
+        f"ON CONFLICT({', '.join(keys)}) DO UPDATE SET {updates}",
+        delta[cols].to_numpy(dtype=object).tolist(),  # plain Python values for sqlite3
+    )
+    conn.execute(f"DELETE FROM {agg_table} WHERE {count} <= 0")
+    return len(delta)
+
+
+def apply_deltas(conn: sqlite3.Connection, table_name: str, df: pd.DataFrame, before=None) -> None:
+    """Fold a just-loaded batch of ``table_name`` into the aggregate tables.
+
+    ``before`` is snapshot() taken ahead of an upsert, or None after a plain
+    append.
+    """
+    if table_name not in SOURCE_TABLES or df.empty:
+        return
+    after = _contributions(conn, table_name, df)
+    before = before or {}
+    with conn:
+        touched = sum(_apply(conn, agg, rows, before.get(agg))
+                      for agg, rows in after.items() if agg in AGGREGATES)
+        customers = [p["rfm_pending"] for p in (after, before) if "rfm_pending" in p]
+        if customers:
+            conn.executemany("INSERT OR IGNORE INTO rfm_pending (customer_id) VALUES (?)",
+                             ((c,) for c in pd.concat(customers)["customer_id"].unique().tolist()))
+        if table_name == "store_sales_header" and before:
+            conn.executemany("INSERT OR IGNORE INTO loyalty_pending (transaction_id) VALUES (?)",
+                             ((int(t),) for t in pd.to_numeric(df["transaction_id"], errors="coerce")
+                              .dropna().unique()))
+    print(f"[AGG] {table_name}: {touched} aggregate rows updated")
+
+
+def rebuild_aggregates(conn: sqlite3.Connection) -> None:
+    """Recompute every aggregate table from the fact tables."""
+    with conn:
+        for sql in AGGREGATE_BACKFILL + STORE_PRODUCT_DAILY_BACKFILL:
+            conn.execute(sql)
+    print("[AGG] Aggregate tables rebuilt.")
@@ -1,27 +1,217 @@
 
+import contextlib
+import hashlib
+import io
+import json
 import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
 
 RAW_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "raw")
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "cache", "ingest")
+
+# Default number of rows per chunk in streaming mode
+DEFAULT_CHUNKSIZE = 50_000
+
+# Parse cache is trimmed (least recently used first) above this size
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+# Parse cache
+#
+# Each parsed file is stored as one directory holding a ``.npy`` array per
+# column plus ``meta.json``. The directory name is derived from the source
+# path, size, mtime and content hash, so any change to the file is a miss.
+
+
+def file_digest(filepath: str, block_size: int = 1 << 20) -> str:
+    """Return the SHA-256 hex digest of a file's contents."""
+    h = hashlib.sha256()
+    with open(filepath, "rb") as fh:
+        for block in iter(lambda: fh.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _cache_key(filepath: str) -> str:
+    st = os.stat(filepath)
+    ident = f"{os.path.abspath(filepath)}|{st.st_size}|{st.st_mtime_ns}|{file_digest(filepath)}"
+    return hashlib.sha256(ident.encode()).hexdigest()[:32]
+
+
+def _cache_load(entry_dir: str):
+    meta_path = os.path.join(entry_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    try:
+        with open(meta_path) as fh:
+            meta = json.load(fh)
+        data = {}
+        for i, (col, dtype) in enumerate(zip(meta["columns"], meta["dtypes"])):
+            arr = np.load(os.path.join(entry_dir, f"col_{i}.npy"), allow_pickle=True)
+            data[col] = pd.Series(arr, dtype=None if dtype == "object" else dtype, copy=False)
+        df = pd.DataFrame(data, columns=meta["columns"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    os.utime(meta_path)  # mark as recently used for eviction
+    return df
+
+
+def _cache_store(entry_dir: str, df: pd.DataFrame, cache_dir: str) -> None:
+    tmp_dir = f"{entry_dir}.tmp{os.getpid()}"
+    try:
+        os.makedirs(tmp_dir, exist_ok=True)
+        for i, col in enumerate(df.columns):
+            np.save(os.path.join(tmp_dir, f"col_{i}.npy"), df[col].to_numpy(), allow_pickle=True)
+        meta = {
+            "columns": [str(c) for c in df.columns],
+            "dtypes": [str(t) for t in df.dtypes],
+            "rows": len(df),
+            "created": time.time(),
+        }
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as fh:
+            json.dump(meta, fh)
+        os.replace(tmp_dir, entry_dir)
+    except OSError as e:
+        print(f"[INGEST] Could not write parse cache entry: {e}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return
+    _cache_evict(cache_dir)
+
+
+def _dir_size(path: str) -> int:
+    return sum(e.stat().st_size for e in os.scandir(path) if e.is_file())
+
+
+def _cache_evict(cache_dir: str, max_bytes: int = None) -> None:
+    """Delete least-recently-used entries until the cache fits in ``max_bytes``."""
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entries = []
+    for e in os.scandir(cache_dir):
+        meta_path = os.path.join(e.path, "meta.json")
+        if e.is_dir() and os.path.exists(meta_path):
+            entries.append((os.path.getmtime(meta_path), _dir_size(e.path), e.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def clear_cache(cache_dir: str = CACHE_DIR) -> None:
+    """Remove every parse cache entry."""
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def _records_frame(records: list, columns: list) -> pd.DataFrame:
+    """Rows read by openpyxl as a frame, typed like read_excel (empty columns are float64 NaN)."""
+    df = pd.DataFrame.from_records(records, columns=columns)
+    empty = [c for c in df.columns if df[c].isna().all() and df[c].dtype == object]
+    return df.astype({c: "float64" for c in empty}) if empty else df
+
+
+def _iter_xlsx_chunks(filepath: str, chunksize: int):
+    """Yield DataFrames of at most ``chunksize`` rows from the first sheet of an XLSX file.
+
+    Uses openpyxl's read-only mode, which streams rows from the workbook XML
+    instead of materialising the whole sheet, so memory stays bounded by the
+    chunk size rather than the file size.
+    """
+    from openpyxl import load_workbook
+
+    wb = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(c) if c is not None else f"Unnamed: {i}" for i, c in enumerate(header)]
+
+        buffer = []
+        blank = 0  # blank rows held back until a later row shows they are not trailing
+        for row in rows:
+            # read_excel drops fully blank rows only at the end of the sheet
+            if all(v is None for v in row):
+                blank += 1
+                continue
+            buffer.extend([(None,) * len(columns)] * blank)
+            blank = 0
+            buffer.append(row[:len(columns)])
+            while len(buffer) >= chunksize:
+                yield _records_frame(buffer[:chunksize], columns)
+                buffer = buffer[chunksize:]
+        if buffer:
+            yield _records_frame(buffer, columns)
+    finally:
+        wb.close()
 
 
-def ingest_file(filename: str, raw_dir: str = RAW_DIR) -> pd.DataFrame:
+def _iter_chunks(filepath: str, ext: str, chunksize: int):
+    if ext == ".xlsx":
+        yield from _iter_xlsx_chunks(filepath, chunksize)
+    elif ext == ".csv":
+        yield from pd.read_csv(filepath, chunksize=chunksize)
+    else:
+        # No row-streaming reader for legacy .xls — read once and slice
+        df = pd.read_excel(filepath)
+        for start in range(0, len(df), chunksize):
+            yield df.iloc[start:start + chunksize]
+
+
+def _ingest_chunks(filename: str, filepath: str, ext: str, chunksize: int):
+    total = 0
+    n_chunks = 0
+    for chunk in _iter_chunks(filepath, ext, chunksize):
+        total += len(chunk)
+        n_chunks += 1
+        yield chunk
+    print(f"[INGEST] Streamed {filename}: {total} rows in {n_chunks} chunk(s)")
+
 
+def ingest_file(filename: str, raw_dir: str = RAW_DIR, chunksize: int = None,
+                cache_dir: str = CACHE_DIR):
+    """Read one raw file.
+
+    Returns a DataFrame, or — when ``chunksize`` is given — an iterator of
+    DataFrames with at most ``chunksize`` rows each (streaming mode).
+    Whole-file reads go through the parse cache in ``cache_dir``; pass
+    ``cache_dir=None`` to always re-parse.
+    """
     filepath = os.path.join(raw_dir, filename)
     if not os.path.exists(filepath):
         print(f"[INGEST] WARNING: File not found — {filepath}")
-        return pd.DataFrame()
+        return iter(()) if chunksize else pd.DataFrame()
 
     ext = os.path.splitext(filename)[1].lower()
+    if ext not in SUPPORTED_EXTENSIONS:
+        print(f"[INGEST] Unsupported format: {ext} — skipping {filename}")
+        return iter(()) if chunksize else pd.DataFrame()
+
+    if chunksize:
+        return _ingest_chunks(filename, filepath, ext, chunksize)
+
+    if cache_dir:
+        entry_dir = os.path.join(cache_dir, _cache_key(filepath))
+        df = _cache_load(entry_dir)
+        if df is not None:
+            print(f"[INGEST] Loaded {filename} (cached): {len(df)} rows, {len(df.columns)} columns")
+            return df
+
     if ext==".xlsx":
         df=pd.read_excel(filepath, engine="openpyxl")
     elif ext==".xls":
         df=pd.read_excel(filepath)
-    elif ext==".csv":
-        df=pd.read_csv(filepath)
     else:
-        print(f"[INGEST] Unsupported format: {ext} — skipping {filename}")
-        return pd.DataFrame()
+        df=pd.read_csv(filepath)
+
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        _cache_store(entry_dir, df, cache_dir)
 
     print(f"[INGEST] Loaded {filename}: {len(df)} rows, {len(df.columns)} columns")
     return df
@@ -30,17 +220,57 @@ def ingest_file(filename: str, raw_dir: str = RAW_DIR) -> pd.DataFrame:
 SUPPORTED_EXTENSIONS = {".xlsx", ".xls", ".csv"}
 
 
-def ingest_all(raw_dir: str = RAW_DIR) -> dict:
+def list_raw_files(raw_dir: str = RAW_DIR) -> dict:
+    """Map table name → file name for every supported file in ``raw_dir``."""
+    files = {}
+    if not os.path.isdir(raw_dir):
+        return files
+    for f in sorted(os.listdir(raw_dir)):
+        ext=os.path.splitext(f)[1].lower()
+        if ext in SUPPORTED_EXTENSIONS:
+            files[os.path.splitext(f)[0]] = f
+    return files
+
+
+def _ingest_worker(args):
+    """Process-pool entry point: parse one file and capture its log lines.
+
+    Logs are returned instead of printed so the parent can emit them in file
+    order, keeping parallel runs' output identical to sequential ones.
+    """
+    filename, raw_dir, cache_dir = args
+    buf = io.StringIO()
+    with contextlib.redirect_stdout(buf):
+        df = ingest_file(filename, raw_dir, cache_dir=cache_dir)
+    return df, buf.getvalue()
+
+
+def ingest_all(raw_dir: str = RAW_DIR, workers: int = 1, cache_dir: str = CACHE_DIR,
+               tables=None) -> dict:
+    """Ingest every supported file in ``raw_dir`` → {table_name: DataFrame}.
+
+    ``workers > 1`` parses the files in a process pool (openpyxl is CPU-bound
+    and holds the GIL); results and log lines are still in sorted file order.
+    ``tables`` restricts ingestion to those table names.
+    """
     data = {}
     if not os.path.isdir(raw_dir):
         print(f"[INGEST] Raw directory does not exist: {raw_dir}")
         return data
 
-    for f in sorted(os.listdir(raw_dir)):
-        ext=os.path.splitext(f)[1].lower()
-        if ext in SUPPORTED_EXTENSIONS:
-            table_name = os.path.splitext(f)[0]
-            data[table_name] = ingest_file(f, raw_dir)
+    files = list_raw_files(raw_dir)
+    if tables is not None:
+        files = {t: f for t, f in files.items() if t in tables}
+    if workers and workers > 1 and len(files) > 1:
+        jobs = [(f, raw_dir, cache_dir) for f in files.values()]
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+            # map() yields in submission order regardless of completion order
+            for table_name, (df, log) in zip(files, pool.map(_ingest_worker, jobs)):
+                print(log, end="")
+                data[table_name] = df
+    else:
+        for table_name, f in files.items():
+            data[table_name] = ingest_file(f, raw_dir, cache_dir=cache_dir)
 
     print(f"[INGEST] Total files ingested: {len(data)}")
     return data
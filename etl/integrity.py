@@ -0,0 +1,214 @@
+"""
+etl/integrity.py
+----------------
+Referential-integrity checks run before rows are loaded.
+
+The FOREIGN KEY clauses declared in database/setup.py decide what is
+checked. Parent keys are read once per run into hash indexes and extended
+as parent tables load, so each child chunk is checked with one vectorized
+lookup per foreign key. Child rows whose key is missing from the parent go
+to the rejects with reason ``orphan_<column>``.
+
+Rows sharing a primary key are resolved per frame by deduplicate_keys();
+when a file is streamed in chunks, LoadedKeys carries the keys loaded from
+earlier chunks so the duplicate policy holds across the whole file.
+"""
+
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from database.setup import get_foreign_keys
+
+
+def _normalize(values) -> pd.Index:
+    """Numeric keys are compared as float so 7 and 7.0 (NaN-upcast ids) match."""
+    idx = pd.Index(values)
+    if pd.api.types.is_numeric_dtype(idx) and not pd.api.types.is_bool_dtype(idx):
+        return idx.astype("float64")
+    return idx.astype(object)
+
+
+class ReferenceIndex:
+    """Parent-key indexes for one ETL run."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+        self._fks = {}
+        self._keys = {}
+
+    def foreign_keys(self, table_name: str) -> list:
+        if table_name not in self._fks:
+            self._fks[table_name] = get_foreign_keys(self._conn, table_name)
+        return self._fks[table_name]
+
+    def _parent_index(self, parent: str, column: str) -> pd.Index:
+        key = (parent, column)
+        if key not in self._keys:
+            values = [r[0] for r in self._conn.execute(
+                f"SELECT DISTINCT {column} FROM {parent} WHERE {column} IS NOT NULL"
+            )]
+            self._keys[key] = _normalize(values).unique()
+        return self._keys[key]
+
+    def add(self, table_name: str, df: pd.DataFrame) -> None:
+        """Register rows just loaded into ``table_name`` as valid parent keys."""
+        for (parent, column), idx in list(self._keys.items()):
+            if parent == table_name and column in df.columns:
+                new = _normalize(df[column].dropna().to_numpy())
+                self._keys[(parent, column)] = idx.append(new).unique()
+
+    def discard(self, table_name: str, df: pd.DataFrame) -> None:
+        """Forget parent keys whose rows were taken out of ``table_name`` again."""
+        for (parent, column), idx in list(self._keys.items()):
+            if parent == table_name and column in df.columns:
+                gone = _normalize(df[column].dropna().to_numpy())
+                self._keys[(parent, column)] = idx[~idx.isin(gone)]
+
+    def check(self, df: pd.DataFrame, table_name: str) -> tuple:
+        """Split ``df`` into (rows with valid references, orphan rows with reject_reason)."""
+        fks = [fk for fk in self.foreign_keys(table_name) if fk[0] in df.columns]
+        if df.empty or not fks:
+            return df, pd.DataFrame()
+
+        reasons = np.full(len(df), "", dtype=object)
+        for column, parent, parent_column in fks:
+            values = df[column]
+            lookup = _normalize(values.to_numpy())
+            missing = (self._parent_index(parent, parent_column).get_indexer(lookup) < 0)
+            missing &= values.notna().to_numpy()
+            if missing.any():
+                tag = f"orphan_{column}"
+                reasons[missing] = np.where(reasons[missing] == "", tag, reasons[missing] + ";" + tag)
+
+        orphan_mask = reasons != ""
+        if not orphan_mask.any():
+            return df, pd.DataFrame()
+
+        orphans = df.loc[orphan_mask].copy()
+        orphans["reject_reason"] = reasons[orphan_mask]
+        print(f"[INTEGRITY] {table_name}: {int(orphan_mask.sum())} orphan rows rejected")
+        return df.loc[~orphan_mask], orphans
+
+
+# What to do with rows sharing a primary key: keep the first / last occurrence,
+# or reject every copy
+DUPLICATE_POLICIES = ("first", "last", "reject")
+
+
+def deduplicate_keys(df: pd.DataFrame, pk: list, table_name: str = "",
+                     policy: str = "first") -> tuple:
+    """Resolve rows that share a primary key; return (kept rows, rejected rows).
+
+    ``pk`` comes from the schema (database.setup.get_primary_key). Rows the
+    keep-first / keep-last policies drop are discarded like exact duplicates;
+    the reject policy sends every copy to the rejects as ``duplicate_<pk>``.
+    Only ``df`` itself is considered; LoadedKeys.resolve() applies the same
+    policy against the keys of earlier chunks of a streamed file.
+    """
+    if policy not in DUPLICATE_POLICIES:
+        raise ValueError(f"Unknown duplicate policy {policy!r}; expected one of {DUPLICATE_POLICIES}")
+    if df.empty or not pk or not set(pk) <= set(df.columns):
+        return df, pd.DataFrame()
+
+    keep = False if policy == "reject" else policy
+    dup_mask = df.duplicated(subset=pk, keep=keep).to_numpy()
+    if not dup_mask.any():
+        return df, pd.DataFrame()
+
+    print(f"[INTEGRITY] {table_name}: {int(dup_mask.sum())} duplicate-key rows "
+          f"({'rejected' if policy == 'reject' else f'kept {policy}'})")
+    if policy != "reject":
+        return df.loc[~dup_mask], pd.DataFrame()
+
+    rejected = df.loc[dup_mask].copy()
+    rejected["reject_reason"] = f"duplicate_{'_'.join(pk)}"
+    return df.loc[~dup_mask], rejected
+
+
+def _key_index(df: pd.DataFrame, pk: list) -> pd.Index:
+    if len(pk) == 1:
+        return _normalize(df[pk[0]].to_numpy())
+    return pd.MultiIndex.from_arrays([_normalize(df[c].to_numpy()) for c in pk])
+
+
+def _row_hashes(df: pd.DataFrame) -> np.ndarray:
+    """Per-row value hashes; numbers hashed as float so 7 and 7.0 chunks agree."""
+    numeric = [c for c in df.columns
+               if pd.api.types.is_numeric_dtype(df[c]) and not pd.api.types.is_bool_dtype(df[c])]
+    return pd.util.hash_pandas_object(df.astype({c: "float64" for c in numeric}), index=False).to_numpy()
+
+
+class LoadedKeys:
+    """Primary keys kept from earlier chunks of one ETL run, per table.
+
+    resolve() is deduplicate_keys() for one chunk of a streamed file, with
+    the chunks before it taken into account, so the duplicate policy and
+    validate()'s exact-duplicate removal hold across the whole file.
+    """
+
+    def __init__(self):
+        self._kept = {}      # table → Series: key → hash of the row kept for it
+        self._hashes = {}    # table → hashes of every row seen, for exact copies
+        self._rejected = {}  # table → keys rejected under the "reject" policy
+
+    def _forget(self, table_name: str, keys: pd.Index) -> None:
+        kept = self._kept.get(table_name)
+        if kept is not None:
+            self._kept[table_name] = kept[~kept.index.isin(keys)]
+
+    def resolve(self, df: pd.DataFrame, table_name: str, pk: list, policy: str = "first") -> tuple:
+        """Split a chunk into (kept rows, rejected rows, superseded keys).
+
+        Rows repeating an earlier row exactly are dropped. Otherwise a key
+        seen in an earlier chunk is dropped ("first"), replaces the earlier
+        row ("last") or is rejected along with it ("reject"); superseded
+        keys holds the key columns of the earlier rows the caller must take
+        out of the table again for the last two.
+        """
+        if policy not in DUPLICATE_POLICIES:
+            raise ValueError(f"Unknown duplicate policy {policy!r}; expected one of {DUPLICATE_POLICIES}")
+        empty = pd.DataFrame()
+        if df.empty or not pk or not set(pk) <= set(df.columns):
+            return df, empty, empty
+
+        keys, hashes = _key_index(df, pk), _row_hashes(df)
+        kept = self._kept.get(table_name, pd.Series(dtype="uint64"))
+        seen_hashes = self._hashes.get(table_name, pd.Index([], dtype="uint64"))
+        rejected_keys = self._rejected.get(table_name, keys[:0])
+
+        exact = np.asarray(pd.Index(hashes).isin(seen_hashes))
+        clash = (kept.index.get_indexer(keys) >= 0) & ~exact
+        reject = np.zeros(len(df), dtype=bool)
+        superseded = empty
+        if policy == "first":
+            drop = exact | clash
+        elif policy == "last":
+            drop = exact
+            superseded = df.loc[clash, pk].drop_duplicates()
+        else:
+            drop = exact
+            reject = (clash | np.asarray(keys.isin(rejected_keys))) & ~exact
+            superseded = df.loc[clash, pk].drop_duplicates()
+        if (drop | reject).any():
+            action = {"first": "kept first", "last": "kept last", "reject": "rejected"}[policy]
+            print(f"[INTEGRITY] {table_name}: {int((drop | reject | clash).sum())} rows repeat earlier "
+                  f"chunks ({int(exact.sum())} exact copies dropped, other keys {action})")
+        self._hashes[table_name] = seen_hashes.append(pd.Index(hashes)).unique()
+
+        rejected = df.loc[reject].copy()
+        if not rejected.empty:
+            rejected["reject_reason"] = f"duplicate_{'_'.join(pk)}"
+        df, dup_df = deduplicate_keys(df.loc[~(drop | reject)], pk, table_name, policy)
+
+        gone = keys[reject].append(_key_index(dup_df, pk)) if not dup_df.empty else keys[reject]
+        if len(gone):
+            self._rejected[table_name] = rejected_keys.append(gone).unique()
+            self._forget(table_name, gone)
+        new = pd.Series(_row_hashes(df), index=_key_index(df, pk))
+        self._forget(table_name, new.index)
+        self._kept[table_name] = pd.concat([self._kept.get(table_name, new[:0]), new])
+
+        rejected = pd.concat([r for r in (rejected, dup_df) if not r.empty] or [rejected], ignore_index=True)
+        return df, rejected, superseded
@@ -1,66 +1,233 @@
+import itertools
 import os
+import shutil
+
+import numpy as np
 import pandas as pd
-from database.setup import get_connection
+from database.reader import DATE_FORMAT, read_frame
+from database.setup import get_connection, get_primary_key
 
 CLEANED_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "cleaned")
 REJECTED_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "rejected")
 
+# Rows per executemany() call
+LOAD_BATCH_SIZE = 50_000
+
+# Pragmas for throwaway/rebuildable loads: WAL journal, no fsync, 256 MB page cache.
+# A crash mid-load can lose the load, never corrupt earlier committed data in WAL mode.
+FAST_LOAD_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "OFF",
+    "cache_size": -256_000,
+    "temp_store": "MEMORY",
+}
+
+# Columns the analytics maintain after loading; an upsert of the raw record
+# must not reset them (the loyalty ledger adds points to the stored total)
+PRESERVED_ON_UPSERT = {
+    "customer_details": {"total_loyalty_points", "loyalty_status"},
+}
+
+
+def apply_pragmas(conn, pragmas: dict) -> None:
+    """Apply ``{name: value}`` pragmas to a connection."""
+    for name, value in (pragmas or {}).items():
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+def _column_values(col: pd.Series) -> list:
+    """One column as a list of Python values SQLite can bind (NaN/NaT → None)."""
+    if pd.api.types.is_datetime64_any_dtype(col):
+        col = col.dt.strftime(DATE_FORMAT)
+    arr = col.to_numpy()
+    if arr.dtype.kind in "iub":
+        return arr.tolist()
+    if arr.dtype.kind == "f":
+        nulls = np.isnan(arr)
+        values = arr.tolist()
+        for i in np.flatnonzero(nulls).tolist():
+            values[i] = None
+        return values
+    values = col.to_numpy(dtype=object, copy=True)
+    values[pd.isna(values)] = None
+    return values.tolist()
 
-def load_table(df: pd.DataFrame, table_name: str) -> None:
-    """Load cleaned DataFrame into the SQLite table."""
-    if df.empty:
-        print(f"[LOAD] Skipping empty table: {table_name}")
-        return
 
-    conn = get_connection()
+def _iter_rows(df: pd.DataFrame):
+    """Yield the frame's rows as tuples built column-wise from NumPy arrays."""
+    return zip(*(_column_values(df[c]) for c in df.columns))
+
+
+def _insert_sql(conn, table_name: str, cols: list, mode: str) -> str:
+    sql = (
+        f"INSERT INTO {table_name} ({', '.join(cols)}) "
+        f"VALUES ({', '.join('?' * len(cols))})"
+    )
+    if mode == "upsert":
+        pk = get_primary_key(conn, table_name)
+        if not pk or not set(pk) <= set(cols):
+            raise ValueError(f"primary key {pk} not present in frame columns")
+        preserved = PRESERVED_ON_UPSERT.get(table_name, set())
+        updates = [c for c in cols if c not in pk and c not in preserved]
+        sql += f" ON CONFLICT({', '.join(pk)}) DO " + (
+            f"UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in updates)}" if updates else "NOTHING"
+        )
+    return sql
+
+
+def bulk_load(df: pd.DataFrame, table_name: str, conn=None, mode: str = "append",
+              pragmas: dict = None, rebuild_indexes: bool = False,
+              batch_size: int = LOAD_BATCH_SIZE) -> int:
+    """Write ``df`` into an existing table in a single transaction; return rows written.
+
+    Rows go through ``executemany`` in batches of ``batch_size`` as tuples built
+    from the columns' NumPy arrays. ``mode="upsert"`` updates rows whose
+    primary key already exists (leaving their PRESERVED_ON_UPSERT columns
+    alone). ``pragmas`` are applied to the connection first (see
+    FAST_LOAD_PRAGMAS), and ``rebuild_indexes`` drops the table's
+    secondary indexes for the load and recreates them afterwards. Raises on
+    failure, after rolling the transaction back.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
     try:
-        # Temporarily disable foreign keys for loading
+        apply_pragmas(conn, pragmas)
+        # Orphans are handled by etl.integrity before we get here
         conn.execute("PRAGMA foreign_keys = OFF;")
-        df.to_sql(table_name, conn, if_exists="append", index=False)
+        sql = _insert_sql(conn, table_name, list(df.columns), mode)
+        indexes = []
+        if rebuild_indexes:
+            indexes = conn.execute(
+                "SELECT name, sql FROM sqlite_master "
+                "WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+                (table_name,),
+            ).fetchall()
+        rows = _iter_rows(df)
+        with conn:
+            conn.execute("BEGIN")  # index DDL must roll back with the rows
+            for name, _ in indexes:
+                conn.execute(f"DROP INDEX {name}")
+            while True:
+                batch = list(itertools.islice(rows, batch_size))
+                if not batch:
+                    break
+                conn.executemany(sql, batch)
+            for _, index_sql in indexes:
+                conn.execute(index_sql)
+        return len(df)
+    finally:
         conn.execute("PRAGMA foreign_keys = ON;")
-        print(f"[LOAD] Loaded {len(df)} rows into {table_name}")
+        if own_conn:
+            conn.close()
+
+
+def load_table(df: pd.DataFrame, table_name: str, conn=None, mode: str = "append",
+               pragmas: dict = None, rebuild_indexes: bool = False) -> int:
+    """Load cleaned DataFrame into the SQLite table; return the number of rows loaded."""
+    if df.empty:
+        print(f"[LOAD] Skipping empty table: {table_name}")
+        return 0
+
+    try:
+        n = bulk_load(df, table_name, conn, mode, pragmas, rebuild_indexes)
+        print(f"[LOAD] {'Upserted' if mode == 'upsert' else 'Loaded'} {n} rows into {table_name}")
+        return n
     except Exception as e:
         print(f"[LOAD] Error loading {table_name}: {e}")
-    finally:
-        conn.close()
+        return 0
+
+
+def remove_rows(conn, table_name: str, keys: pd.DataFrame, batch_size: int = 500) -> pd.DataFrame:
+    """Delete the rows whose primary key is in ``keys`` (its key columns); return them, dates typed."""
+    if keys.empty:
+        return pd.DataFrame()
+    cols = list(keys.columns)
+    match = cols[0] if len(cols) == 1 else f"({', '.join(cols)})"
+    values = list(_iter_rows(keys))
+    removed = []
+    with conn:
+        for start in range(0, len(values), batch_size):
+            batch = values[start:start + batch_size]
+            where = f"WHERE {match} IN (VALUES {', '.join(['(' + ', '.join('?' * len(cols)) + ')'] * len(batch))})"
+            params = [v for row in batch for v in row]
+            removed.append(read_frame(f"SELECT * FROM {table_name} {where}", conn, params=params))
+            conn.execute(f"DELETE FROM {table_name} {where}", params)
+    return pd.concat(removed, ignore_index=True)
+
+
+def upsert_table(df: pd.DataFrame, table_name: str, conn=None, pragmas: dict = None) -> int:
+    """Insert rows, updating existing ones on primary-key conflict; return rows written.
+
+    Uses ``INSERT ... ON CONFLICT(pk) DO UPDATE`` in large batches inside one
+    transaction, so re-running a load or loading overlapping exports is safe.
+    """
+    return load_table(df, table_name, conn, mode="upsert", pragmas=pragmas)
 
 
-def load_rejects(df: pd.DataFrame, table_name: str) -> None:
+def load_rejects(df: pd.DataFrame, table_name: str, conn=None, pragmas: dict = None) -> None:
     """Load rejected DataFrame into the rejected table."""
     if df.empty:
         print(f"[LOAD] Skipping empty rejects: rejected_{table_name}")
         return
 
     reject_table = f"rejected_{table_name}"
-    conn = get_connection()
     try:
-        df.to_sql(reject_table, conn, if_exists="append", index=False)
+        bulk_load(df, reject_table, conn, pragmas=pragmas)
         print(f"[LOAD] Loaded {len(df)} rejects into {reject_table}")
     except Exception as e:
         print(f"[LOAD] Error loading rejects {reject_table}: {e}")
-    finally:
-        conn.close()
 
 
-def save_cleaned_csv(df: pd.DataFrame, table_name: str) -> None:
-    """Save cleaned DataFrame to CSV in data/cleaned/."""
+# File formats for cleaned/rejected output. Parquet output is a directory of
+# part files (so chunked runs can append) and needs pyarrow installed.
+OUTPUT_FORMATS = ("csv", "csv.gz", "parquet")
+
+
+def _save_output(df: pd.DataFrame, out_dir: str, name: str, fmt: str, append: bool) -> tuple:
+    """Write ``df`` to ``out_dir/name.<fmt>``; return (path, appended?)."""
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format {fmt!r}; expected one of {OUTPUT_FORMATS}")
+    os.makedirs(out_dir, exist_ok=True)
+    filepath = os.path.join(out_dir, f"{name}.{fmt}")
+
+    if fmt == "parquet":
+        appending = append and os.path.isdir(filepath)
+        if not appending:
+            shutil.rmtree(filepath, ignore_errors=True)
+            os.makedirs(filepath)
+        part = len([f for f in os.listdir(filepath) if f.endswith(".parquet")])
+        df.to_parquet(os.path.join(filepath, f"part-{part:05d}.parquet"), index=False)
+        return filepath, appending
+
+    mode = "a" if append and os.path.exists(filepath) else "w"
+    df.to_csv(filepath, mode=mode, header=(mode == "w"), index=False)
+    return filepath, mode == "a"
+
+
+def save_cleaned_csv(df: pd.DataFrame, table_name: str, append: bool = False,
+                     fmt: str = "csv") -> None:
+    """Save cleaned DataFrame to data/cleaned/ (``append`` adds to an existing file).
+
+    ``fmt`` is one of OUTPUT_FORMATS; the default keeps the plain CSV output.
+    """
     if df.empty:
         print(f"[SAVE] Skipping empty cleaned CSV: {table_name}")
         return
 
-    os.makedirs(CLEANED_DIR, exist_ok=True)
-    filepath = os.path.join(CLEANED_DIR, f"{table_name}_cleaned.csv")
-    df.to_csv(filepath, index=False)
-    print(f"[SAVE] Saved {len(df)} rows to {filepath}")
+    filepath, appended = _save_output(df, CLEANED_DIR, f"{table_name}_cleaned", fmt, append)
+    print(f"[SAVE] {'Appended' if appended else 'Saved'} {len(df)} rows to {filepath}")
+
 
+def save_rejected_csv(df: pd.DataFrame, table_name: str, append: bool = False,
+                      fmt: str = "csv") -> None:
+    """Save rejected DataFrame to data/rejected/ (``append`` adds to an existing file).
 
-def save_rejected_csv(df: pd.DataFrame, table_name: str) -> None:
-    """Save rejected DataFrame to CSV in data/rejected/."""
+    ``fmt`` is one of OUTPUT_FORMATS; the default keeps the plain CSV output.
+    """
     if df.empty:
         print(f"[SAVE] Skipping empty rejected CSV: {table_name}")
         return
 
-    os.makedirs(REJECTED_DIR, exist_ok=True)
-    filepath = os.path.join(REJECTED_DIR, f"{table_name}_rejected.csv")
-    df.to_csv(filepath, index=False)
-    print(f"[SAVE] Saved {len(df)} rejects to {filepath}")
\ No newline at end of file
+    filepath, appended = _save_output(df, REJECTED_DIR, f"{table_name}_rejected", fmt, append)
+    print(f"[SAVE] {'Appended' if appended else 'Saved'} {len(df)} rejects to {filepath}")
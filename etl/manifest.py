@@ -0,0 +1,193 @@
+"""
+etl/manifest.py
+---------------
+Bookkeeping for incremental ETL runs.
+
+* etl_manifest    — one row per raw file with the content hash last loaded
+* etl_watermarks  — highest transaction_id / transaction_date loaded per fact table
+* load_generations — bumped on every load into a fact table, so cached
+                    copies (analytics.context) know when to reload
+
+An incremental run skips files whose hash is unchanged, drops fact rows at
+or below the table's watermark, and — unless loading by upsert — drops
+dimension rows whose primary key is already present.
+
+Rejected rows do not move the watermark. A fact row at or below it whose
+key is in rejected_<table> but was never loaded is read again, so a
+corrected copy in a later export still loads; rejects already recorded
+with the same values and reason are not recorded again (drop_recorded_rejects).
+"""
+
+import sqlite3
+from datetime import datetime
+
+import pandas as pd
+
+from database.reader import DATE_FORMAT, read_frame
+from database.setup import get_primary_key
+
+# Fact tables that are filtered by transaction_id watermark
+WATERMARK_TABLES = {"store_sales_header", "store_sales_line_items"}
+
+# Keys rejected before and still missing from the table ({pk}, {table})
+_RETRY_KEYS_SQL = """
+    SELECT DISTINCT r.{pk} FROM rejected_{table} r
+    WHERE r.{pk} IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM {table} t WHERE t.{pk} = r.{pk})
+"""
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def file_already_loaded(conn: sqlite3.Connection, file_name: str, file_hash: str) -> bool:
+    """True if ``file_name`` was loaded before with exactly this content hash."""
+    row = conn.execute(
+        "SELECT file_hash FROM etl_manifest WHERE file_name = ?", (file_name,)
+    ).fetchone()
+    return row is not None and row[0] == file_hash
+
+
+def record_file(conn: sqlite3.Connection, file_name: str, table_name: str,
+                file_hash: str, rows_loaded: int) -> None:
+    conn.execute(
+        """
+        INSERT INTO etl_manifest (file_name, table_name, file_hash, rows_loaded, processed_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(file_name) DO UPDATE SET
+            table_name = excluded.table_name,
+            file_hash = excluded.file_hash,
+            rows_loaded = excluded.rows_loaded,
+            processed_at = excluded.processed_at
+        """,
+        (file_name, table_name, file_hash, int(rows_loaded), _now()),
+    )
+    conn.commit()
+
+
+def get_watermark(conn: sqlite3.Connection, table_name: str):
+    """Return (max_transaction_id, max_transaction_date) loaded so far, or (None, None)."""
+    row = conn.execute(
+        "SELECT max_transaction_id, max_transaction_date FROM etl_watermarks WHERE table_name = ?",
+        (table_name,),
+    ).fetchone()
+    return row if row is not None else (None, None)
+
+
+def update_watermark(conn: sqlite3.Connection, table_name: str, df: pd.DataFrame) -> None:
+    """Advance the table's watermark to cover the rows in ``df`` (never moves backwards)."""
+    if table_name not in WATERMARK_TABLES or df.empty or "transaction_id" not in df.columns:
+        return
+
+    max_id = pd.to_numeric(df["transaction_id"], errors="coerce").max()
+    if pd.isna(max_id):
+        return
+    max_date = None
+    if "transaction_date" in df.columns:
+        dates = pd.to_datetime(df["transaction_date"], errors="coerce").max()
+        max_date = None if pd.isna(dates) else str(dates)
+
+    conn.execute(
+        """
+        INSERT INTO etl_watermarks (table_name, max_transaction_id, max_transaction_date, updated_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(table_name) DO UPDATE SET
+            max_transaction_id = MAX(COALESCE(max_transaction_id, excluded.max_transaction_id),
+                                     excluded.max_transaction_id),
+            max_transaction_date = COALESCE(MAX(max_transaction_date, excluded.max_transaction_date),
+                                            max_transaction_date, excluded.max_transaction_date),
+            updated_at = excluded.updated_at
+        """,
+        (table_name, int(max_id), max_date, _now()),
+    )
+    conn.commit()
+
+
+def bump_generation(conn: sqlite3.Connection, table_name: str) -> None:
+    """Mark ``table_name`` as changed for anything caching its rows."""
+    if table_name not in WATERMARK_TABLES:
+        return
+    conn.execute(
+        """
+        INSERT INTO load_generations (table_name, generation) VALUES (?, 1)
+        ON CONFLICT(table_name) DO UPDATE SET generation = generation + 1
+        """,
+        (table_name,),
+    )
+    conn.commit()
+
+
+def filter_new_rows(conn: sqlite3.Connection, df: pd.DataFrame, table_name: str,
+                    skip_existing_keys: bool = True) -> pd.DataFrame:
+    """Keep only the raw rows that have not been loaded yet.
+
+    Fact tables are cut at their watermark; rows without a usable
+    transaction_id pass through to be rejected by validation. Dimension rows whose primary key
+    already exists are dropped only with ``skip_existing_keys`` — when
+    loading by upsert they are kept so changed attributes get updated.
+    """
+    if df.empty:
+        return df
+    if table_name not in WATERMARK_TABLES and not skip_existing_keys:
+        return df
+
+    if table_name in WATERMARK_TABLES:
+        max_id, _ = get_watermark(conn, table_name)
+        if max_id is None or "transaction_id" not in df.columns:
+            return df
+        ids = pd.to_numeric(df["transaction_id"], errors="coerce")
+        # Missing/non-numeric ids are kept so validate() rejects them
+        keep = ids.isna() | (ids > max_id)
+        pk = get_primary_key(conn, table_name)
+        if len(pk) == 1 and pk[0] in df.columns:
+            retry = pd.read_sql(_RETRY_KEYS_SQL.format(pk=pk[0], table=table_name), conn)[pk[0]]
+            keep |= pd.to_numeric(df[pk[0]], errors="coerce").isin(retry)
+        new_df = df.loc[keep]
+    else:
+        pk = get_primary_key(conn, table_name)
+        if len(pk) != 1 or pk[0] not in df.columns:
+            return df
+        existing = pd.read_sql(f"SELECT {pk[0]} FROM {table_name}", conn)[pk[0]]
+        keys = df[pk[0]]
+        if pd.api.types.is_numeric_dtype(existing):
+            keys = pd.to_numeric(keys, errors="coerce")
+        new_df = df.loc[~keys.isin(existing)]
+
+    skipped = len(df) - len(new_df)
+    if skipped:
+        print(f"[ETL] {table_name}: skipped {skipped} already-loaded rows")
+    return new_df
+
+
+def _row_texts(df: pd.DataFrame, columns: list) -> pd.Series:
+    """One string per row of ``columns``, equal for equal values however they were typed."""
+    parts = []
+    for col in columns:
+        values = df[col] if col in df.columns else pd.Series(None, index=df.index, dtype=object)
+        if pd.api.types.is_datetime64_any_dtype(values):
+            text = values.dt.strftime(DATE_FORMAT)
+        elif pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            text = values.astype("float64").astype(str)
+        else:
+            text = values.astype(object).where(values.notna()).map(str, na_action="ignore")
+        parts.append(text.fillna("\x00").astype(str).reset_index(drop=True))
+    return parts[0].str.cat(parts[1:], sep="\x1f") if parts else pd.Series(dtype=str)
+
+
+def recorded_rejects(conn: sqlite3.Connection, table_name: str) -> tuple:
+    """(columns, row texts) of the rows already in rejected_<table_name>."""
+    recorded = read_frame(f"SELECT * FROM rejected_{table_name}", conn)
+    columns = list(recorded.columns)
+    return columns, pd.Index(_row_texts(recorded, columns).unique())
+
+
+def drop_recorded_rejects(rejected_df: pd.DataFrame, recorded: tuple, table_name: str) -> pd.DataFrame:
+    """Drop rejected rows identical (values and reason) to ones recorded by an earlier run."""
+    columns, texts = recorded
+    if rejected_df.empty or texts.empty:
+        return rejected_df
+    repeat = _row_texts(rejected_df, columns).isin(texts).to_numpy()
+    if repeat.any():
+        print(f"[ETL] {table_name}: {int(repeat.sum())} rejected rows were already recorded")
+    return rejected_df.loc[~repeat]
@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
-import re
+
+from database.reader import DATE_COLUMNS
 
 
 AMOUNT_COLUMNS = {
@@ -27,66 +28,242 @@ NULLABLE_COLUMNS = {
 }
 
 
-def _clean_amount(value):
-    #strip dollar sign from total_amount
-    if pd.isna(value):
-        return np.nan
-    s = str(value).strip()
-    s = re.sub(r"[^\d.\-]", "", s)  # keep digits, dot, minus
-    try:
-        return float(s) if s else np.nan
-    except ValueError:
-        return np.nan
+# Table-specific rules layered over the global column sets above.
+# Per column, any of:
+#   type      "amount" | "numeric" | "date"   how the raw value is parsed
+#                                    (unparseable dates → invalid_date_<col>)
+#   nullable  bool                   False → row rejected as has_null
+#   min / max number (inclusive)     negative_<col> (min 0) / below_min_<col> / above_max_<col>
+#   regex     full-match pattern     invalid_format_<col>
+#   allowed   set of values          invalid_value_<col>
+#   on_invalid "reject" | "null"     "null" → a value failing regex/allowed is
+#                                    nulled (and counted) instead of rejecting
+#                                    the row; for contact details, where a
+#                                    reject would orphan the row's child facts
+TABLE_RULES = {
+    "stores": {
+        "store_id": {"min": 1},
+    },
+    "products": {
+        "product_id": {"regex": r"P\d+"},
+    },
+    "customer_details": {
+        "customer_id": {"regex": r"C\d+"},
+        "email": {"regex": r"[^@\s]+@[^@\s]+\.[^@\s]+", "on_invalid": "null"},
+        "loyalty_status": {"allowed": {"Bronze", "Silver", "Gold"}},
+        "customer_phone": {"regex": r"\d{10}", "on_invalid": "null"},
+    },
+    "promotion_details": {
+        "discount_percentage": {"max": 100},
+    },
+    "store_sales_header": {
+        "customer_id": {"regex": r"C\d+"},
+    },
+    "store_sales_line_items": {
+        "product_id": {"regex": r"P\d+"},
+    },
+}
+
+# Reject-cause bits; per-column rule causes take the bits after these
+REJECT_ALL_NULL = 1 << 0
+REJECT_HAS_NULL = 1 << 1
+_FIXED_REASONS = ["all_null", "has_null"]
+
+# Compiled plans, keyed by (table_name, column tuple)
+_PLAN_CACHE = {}
+
+
+def _clean_amount_series(col: pd.Series) -> pd.Series:
+    """Strip currency symbols / separators and parse a whole column as float.
+
+    Keeps digits, dot and minus from each value, like the old per-cell regex,
+    but as one vectorized string pass over the distinct values; columns that
+    are already numeric pass through.
+    """
+    if pd.api.types.is_numeric_dtype(col) and not pd.api.types.is_bool_dtype(col):
+        return col.astype("float64")
+    # Amounts repeat heavily (price × qty), so clean each distinct string once
+    codes, uniques = pd.factorize(col)
+    cleaned = pd.Series(uniques.astype(str)).str.strip().str.replace(r"[^\d.\-]", "", regex=True)
+    values = pd.to_numeric(cleaned.where(cleaned != ""), errors="coerce").to_numpy("float64")
+    out = np.full(len(col), np.nan)
+    present = codes >= 0
+    out[present] = values[codes[present]]
+    return pd.Series(out, index=col.index, name=col.name)
+
+
+def _parse_date_series(col: pd.Series) -> pd.Series:
+    """Parse a raw date column (datetimes or free-form strings) to datetime64.
+
+    Each distinct value is parsed once; numbers and unparseable strings
+    become NaT. The loader writes the result as ISO text.
+    """
+    if pd.api.types.is_datetime64_any_dtype(col):
+        return col
+    codes, uniques = pd.factorize(col)
+    uniques = pd.Series(uniques, dtype=object)
+    uniques = uniques.where(~uniques.map(lambda v: isinstance(v, (int, float, np.number))))
+    parsed = pd.to_datetime(uniques, errors="coerce", format="mixed").to_numpy()
+    out = np.full(len(col), np.datetime64("NaT"), dtype=parsed.dtype if len(parsed) else "datetime64[s]")
+    present = codes >= 0
+    out[present] = parsed[codes[present]]
+    return pd.Series(out, index=col.index, name=col.name)
+
+
+def _decode_reasons(codes: np.ndarray, reasons: list) -> np.ndarray:
+    """Turn reject bitmasks into ``;``-joined reason strings (one decode per distinct mask)."""
+    uniq, inverse = np.unique(codes, return_inverse=True)
+    decoded = np.array(
+        [";".join(r for bit, r in enumerate(reasons) if int(u) >> bit & 1) for u in uniq],
+        dtype=object,
+    )
+    return decoded[inverse.ravel()]
+
+
+def column_rules(table_name: str, col: str) -> dict:
+    """Effective rules for one column: global defaults overlaid with TABLE_RULES."""
+    kind = ("amount" if col in AMOUNT_COLUMNS else "numeric" if col in NUMERIC_COLUMNS
+            else "date" if col in DATE_COLUMNS else None)
+    rules = {"type": kind, "nullable": col in NULLABLE_COLUMNS}
+    if kind in ("amount", "numeric"):
+        rules["min"] = 0
+    rules.update(TABLE_RULES.get(table_name, {}).get(col, {}))
+    return rules
+
+
+def compile_plan(table_name: str, columns) -> dict:
+    """Compile the rules for ``columns`` of ``table_name`` into one evaluation plan.
+
+    The plan lists, per column, how to parse it and which bit each check sets,
+    so validate() evaluates every rule for a column in the same pass over it.
+    Plans are cached per (table, columns).
+    """
+    key = (table_name, tuple(columns))
+    if key in _PLAN_CACHE:
+        return _PLAN_CACHE[key]
+
+    reasons = list(_FIXED_REASONS)
+    plan = {"parse": [], "dates": [], "required": [], "range": [], "values": [], "nulled": [],
+            "reasons": reasons}
+
+    def _bit(reason):
+        reasons.append(reason)
+        return 1 << (len(reasons) - 1)
+
+    for idx, col in enumerate(columns):
+        rules = column_rules(table_name, col)
+        if rules["type"] == "date":
+            plan["dates"].append((idx, col, _bit(f"invalid_date_{col}")))
+        elif rules["type"]:
+            plan["parse"].append((col, rules["type"]))
+        if not rules["nullable"]:
+            plan["required"].append(idx)
+
+        checks = []
+        if rules.get("min") is not None:
+            low = "negative" if rules["min"] == 0 else "below_min"
+            checks.append((np.less, rules["min"], _bit(f"{low}_{col}")))
+        if rules.get("max") is not None:
+            checks.append((np.greater, rules["max"], _bit(f"above_max_{col}")))
+        if checks:
+            plan["range"].append((col, checks))
+
+        # Nulled values need no reject reason: any bit will do
+        soft = rules.get("on_invalid") == "null"
+        bit = (lambda reason: 1) if soft else _bit
+        checks = []
+        if rules.get("regex"):
+            checks.append(("regex", rules["regex"], bit(f"invalid_format_{col}")))
+        if rules.get("allowed"):
+            checks.append(("allowed", rules["allowed"], bit(f"invalid_value_{col}")))
+        if checks:
+            plan["nulled" if soft else "values"].append((col, checks))
+
+    if len(reasons) > 63:
+        raise ValueError(f"{table_name}: too many validation rules ({len(reasons)}) for a 64-bit mask")
+
+    _PLAN_CACHE[key] = plan
+    return plan
+
+
+def _value_check_bits(col: pd.Series, checks: list) -> np.ndarray:
+    """Evaluate regex / allowed-value checks once per distinct value of ``col``."""
+    codes, uniques = pd.factorize(col)
+    # Integer-valued floats (ints upcast by NaNs) are matched as "123", not "123.0"
+    as_str = pd.Series(uniques).map(
+        lambda v: str(int(v)) if isinstance(v, float) and v.is_integer() else str(v)
+    )
+    uniq_bits = np.zeros(len(uniques) + 1, dtype=np.int64)  # last slot: nulls
+    for kind, arg, bit in checks:
+        if kind == "regex":
+            ok = as_str.str.fullmatch(arg).to_numpy(dtype=bool)
+        else:
+            ok = np.asarray(pd.Series(uniques).isin(arg))
+        uniq_bits[:-1][~ok] |= bit
+    return uniq_bits[codes]
 
 
 def validate(df: pd.DataFrame, table_name: str = "") -> tuple:
-    
+    """Split ``df`` into (cleaned, rejected) frames using the table's compiled plan.
+
+    Every check sets a bit in a per-row integer mask; the human-readable
+    ``reject_reason`` is only built for rows that end up rejected.
+    """
     if df.empty:
         return df.copy(), pd.DataFrame()
 
     original_len = len(df)
     working = df.copy()
+    plan = compile_plan(table_name, list(working.columns))
+    mask = np.zeros(original_len, dtype=np.int64)
+
+    # --- 1. Parse amount / numeric / date columns ---
+    for col, kind in plan["parse"]:
+        if kind == "amount":
+            working[col] = _clean_amount_series(working[col])
+        else:
+            working[col] = pd.to_numeric(working[col], errors="coerce")
+
+    # Dates: a value that does not parse is invalid_date_<col>, not a null
+    invalid_dates = []
+    for idx, col, bit in plan["dates"]:
+        parsed = _parse_date_series(working[col])
+        invalid = (working[col].notna() & parsed.isna()).to_numpy()
+        mask[invalid] |= bit
+        invalid_dates.append((idx, invalid))
+        working[col] = parsed
+
+    # --- 2. Rows with ALL null values / any null required field ---
+    nulls = working.isna().to_numpy()
+    for idx, invalid in invalid_dates:
+        nulls[invalid, idx] = False
+    all_null = nulls.all(axis=1)
+    mask[all_null] |= REJECT_ALL_NULL
+    if plan["required"]:
+        null_any = nulls[:, plan["required"]].any(axis=1) & ~all_null
+        mask[null_any] |= REJECT_HAS_NULL
+
+    # --- 3. Range checks (one pass over each numeric column) ---
+    for col, checks in plan["range"]:
+        values = working[col].to_numpy(dtype="float64", na_value=np.nan)
+        for op, bound, bit in checks:
+            mask[op(values, bound)] |= bit
+
+    # --- 4. Format / allowed-value checks (one pass over each column's distinct values) ---
+    for col, checks in plan["values"]:
+        mask |= _value_check_bits(working[col], checks)
+    for col, checks in plan["nulled"]:
+        invalid = _value_check_bits(working[col], checks) != 0
+        if invalid.any():
+            working.loc[invalid, col] = None
+            print(f"[VALIDATE] {table_name}: {int(invalid.sum())} invalid {col} values nulled")
 
-    # --- 1. Track reject reasons ---
-    working["_reject_reason"] = ""
-
-    # --- 2. Clean amount / numeric columns ---
-    cols_present_amount = [c for c in working.columns if c in AMOUNT_COLUMNS]
-    for col in cols_present_amount:
-        working[col] = working[col].apply(_clean_amount)
-
-    cols_present_numeric = [c for c in working.columns if c in NUMERIC_COLUMNS]
-    for col in cols_present_numeric:
-        working[col] = pd.to_numeric(working[col], errors="coerce")
-
-    # --- 3. Flag rows with ALL null values (across original columns, not _reject) ---
-    orig_cols = [c for c in working.columns if c != "_reject_reason"]
-    all_null_mask = working[orig_cols].isna().all(axis=1)
-    working.loc[all_null_mask, "_reject_reason"] = "all_null"
-
-    # --- 4. Flag rows with any null primary (non-nullable) fields ---
-    required_cols = [c for c in orig_cols if c not in NULLABLE_COLUMNS]
-    if required_cols:
-        null_any_mask = working[required_cols].isna().any(axis=1) & ~all_null_mask
-    else:
-        null_any_mask = pd.Series(False, index=working.index)
-    working.loc[null_any_mask, "_reject_reason"] = working.loc[
-        null_any_mask, "_reject_reason"
-    ].apply(lambda r: r + ";has_null" if r else "has_null")
-
-    # --- 5. Flag negative numeric values ---
-    for col in cols_present_numeric:
-        neg_mask = working[col] < 0
-        working.loc[neg_mask, "_reject_reason"] = working.loc[
-            neg_mask, "_reject_reason"
-        ].apply(lambda r: r + f";negative_{col}" if r else f"negative_{col}")
-
-    # --- 6. Split into clean vs rejected ---
-    rejected_mask = working["_reject_reason"].astype(bool)
+    # --- 5. Split into clean vs rejected ---
+    rejected_mask = mask != 0
     rejected_df = working.loc[rejected_mask].copy()
-    rejected_df.rename(columns={"_reject_reason": "reject_reason"}, inplace=True)
+    rejected_df["reject_reason"] = _decode_reasons(mask[rejected_mask], plan["reasons"])
 
-    cleaned_df = working.loc[~rejected_mask].drop(columns=["_reject_reason"])
+    cleaned_df = working.loc[~rejected_mask]
 
     # Remove duplicate primary-key rows (keep first)
     cleaned_df = cleaned_df.drop_duplicates()
@@ -95,4 +272,4 @@ def validate(df: pd.DataFrame, table_name: str = "") -> tuple:
         f"[VALIDATE] {table_name}: {original_len} raw → "
         f"{len(cleaned_df)} clean, {len(rejected_df)} rejected"
     )
-    return cleaned_df, rejected_df
\ No newline at end of file
+    return cleaned_df, rejected_df
@@ -0,0 +1,62 @@
+"""
+etl/writer.py
+-------------
+Background file output for the ETL.
+
+Cleaned/rejected file writes are handed to a worker thread through a
+bounded queue so they overlap with the SQLite load of the same frame.
+The bound caps how many frames can wait in memory: when the writer falls
+behind, submit() blocks instead of letting the queue grow.
+"""
+
+import queue
+import threading
+
+# Frames allowed to wait for the writer before submit() blocks
+DEFAULT_MAX_PENDING = 4
+
+_STOP = object()
+
+
+class BackgroundWriter:
+    """Run write jobs in submission order on a single worker thread."""
+
+    def __init__(self, max_pending: int = DEFAULT_MAX_PENDING):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._errors = []
+        self._thread = threading.Thread(target=self._run, name="etl-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is _STOP:
+                    return
+                fn, args, kwargs = job
+                fn(*args, **kwargs)
+            except Exception as e:  # reported from close()
+                self._errors.append(e)
+            finally:
+                self._queue.task_done()
+
+    def submit(self, fn, *args, **kwargs) -> None:
+        """Queue ``fn(*args, **kwargs)``; blocks while the queue is full."""
+        if not self._thread.is_alive():
+            raise RuntimeError("BackgroundWriter is closed")
+        self._queue.put((fn, args, kwargs))
+
+    def close(self) -> None:
+        """Wait for every queued job, stop the worker and re-raise the first failure."""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        if self._errors:
+            raise self._errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
@@ -1,95 +1,303 @@
+import argparse
+import io
 import os
 import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from graphlib import TopologicalSorter
+
+import pandas as pd
 
 
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
 if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
-from database.setup import setup_database, DB_PATH
-from etl.ingest import ingest_all
+from database.backends import BACKENDS, set_default_backend
+from database.setup import ensure_schema, get_connection, get_primary_key, setup_database, DB_PATH
+from etl.ingest import (
+    CACHE_DIR, DEFAULT_CHUNKSIZE, RAW_DIR, file_digest, ingest_all, ingest_file, list_raw_files,
+)
+from etl.manifest import (
+    bump_generation, drop_recorded_rejects, file_already_loaded, filter_new_rows, recorded_rejects,
+    record_file, update_watermark,
+)
 from etl.validate import validate
-from etl.load import load_table, load_rejects, save_cleaned_csv, save_rejected_csv
-from analytics.loyalty import calculate_loyalty
-from analytics.segmentation import perform_segmentation
-from analytics.predictive import run_predictive
+from etl.integrity import DUPLICATE_POLICIES, LoadedKeys, ReferenceIndex, deduplicate_keys
+from etl.aggregates import apply_deltas, snapshot
+from etl.load import (
+    FAST_LOAD_PRAGMAS, OUTPUT_FORMATS, apply_pragmas, load_table, load_rejects, remove_rows,
+    save_cleaned_csv, save_rejected_csv,
+)
+from etl.writer import BackgroundWriter
+from analytics.context import AnalyticsContext
+from analytics.loyalty import calculate_loyalty, ledger_empty
+from analytics.segmentation import RFM_MODES, perform_segmentation
+from analytics.predictive import predict_future_spend, promotion_sensitivity, stock_out_risk
 from dashboard.dashboard import launch_dashboard, generate_dashboard, list_stores
 
 
-def step_setup_database():
-    """Step 1: Create database and tables."""
+def step_setup_database(incremental: bool = False):
+    """Step 1: Create database and tables (incremental runs keep existing data)."""
     print("\n" + "=" * 60)
     print("STEP 1: DATABASE SETUP")
     print("=" * 60)
-    setup_database()
+    if incremental:
+        ensure_schema()
+    else:
+        setup_database()
+
+
+# Load tables in dependency order
+LOAD_ORDER = [
+    "stores", "products", "customer_details", "promotion_details", "loyalty_rules",
+    "store_sales_header", "store_sales_line_items"
+]
+
 
+def step_run_etl(chunksize: int = None, workers: int = 1, use_cache: bool = True,
+                 incremental: bool = False, check_fks: bool = True,
+                 duplicates: str = "first", load_mode: str = None,
+                 load_pragmas: dict = None, rebuild_indexes: bool = False,
+                 output_format: str = "csv", background_writes: bool = True):
+    """Step 2: Ingest raw files → Validate → Load into SQLite.
 
-def step_run_etl():
-    """Step 2: Ingest raw files → Validate → Load into SQLite."""
+    With ``chunksize`` set, each file is streamed through validate/load/save
+    in chunks of that many rows so peak memory does not grow with file size.
+    ``workers`` parses the raw workbooks in that many processes, and
+    ``use_cache`` reuses previously parsed workbooks that have not changed.
+    ``incremental`` skips files already in the manifest and rows below the
+    table watermarks, appending to what is already loaded. ``check_fks``
+    rejects rows whose foreign keys point at rows that were never loaded.
+    ``duplicates`` resolves rows sharing a primary key (first/last/reject),
+    across chunks too when streaming (etl.integrity.LoadedKeys), and
+    ``load_mode`` is "append" or "upsert" (default: upsert when
+    incremental, append otherwise). All tables load over one connection;
+    ``load_pragmas`` are applied to it first and ``rebuild_indexes`` drops
+    and recreates each table's indexes around its load (whole-file mode only).
+    Cleaned/rejected files are written in ``output_format``, on a background
+    thread overlapping the load unless ``background_writes`` is False.
+    """
     print("\n" + "=" * 60)
     print("STEP 2: ETL PIPELINE")
     print("=" * 60)
 
-    raw_data = ingest_all()
-
-    if not raw_data:
+    raw_files = list_raw_files()
+    if not raw_files:
         print("[ETL] No supported files found in data/raw/ — skipping ETL.")
         return
 
-    # Load tables in dependency order
-    load_order = [
-        "stores", "products", "customer_details", "promotion_details", "loyalty_rules",
-        "store_sales_header", "store_sales_line_items"
-    ]
-
-    for table_name in load_order:
-        if table_name in raw_data:
-            raw_df = raw_data[table_name]
-            cleaned_df, rejected_df = validate(raw_df, table_name)
-            load_table(cleaned_df, table_name)
-            load_rejects(rejected_df, table_name)
-            save_cleaned_csv(cleaned_df, table_name)
-            save_rejected_csv(rejected_df, table_name)
+    if load_mode is None:
+        load_mode = "upsert" if incremental else "append"
+
+    conn = get_connection()
+    writer = BackgroundWriter() if background_writes else None
+    options = {
+        "incremental": incremental,
+        "refs": ReferenceIndex(conn) if check_fks else None,
+        # Streamed files are deduplicated against the keys of earlier chunks too
+        "seen": LoadedKeys() if chunksize else None,
+        "duplicates": duplicates,
+        "load": {"mode": load_mode, "rebuild_indexes": rebuild_indexes and not chunksize},
+        "output_format": output_format,
+        "writer": writer,
+    }
+    try:
+        apply_pragmas(conn, load_pragmas)
+        hashes = {t: file_digest(os.path.join(RAW_DIR, f)) for t, f in raw_files.items()}
+        if incremental:
+            unchanged = [t for t, f in raw_files.items() if file_already_loaded(conn, f, hashes[t])]
+            for t in unchanged:
+                print(f"[ETL] {raw_files[t]} unchanged since last load — skipping.")
+            raw_files = {t: f for t, f in raw_files.items() if t not in unchanged}
+
+        if not chunksize:
+            raw_data = ingest_all(
+                workers=workers, cache_dir=CACHE_DIR if use_cache else None, tables=raw_files,
+            )
+
+        for table_name in LOAD_ORDER:
+            if table_name not in raw_files:
+                continue
+            if chunksize:
+                frames = ingest_file(raw_files[table_name], chunksize=chunksize)
+            else:
+                frames = [raw_data[table_name]]
+            rows, complete = _etl_table(conn, table_name, frames, options)
+            if not complete:
+                # Tables loaded after this one would reject its missing rows' children as orphans
+                raise RuntimeError(f"[ETL] Loading {raw_files[table_name]} failed; stopping before the "
+                                   f"tables that depend on it. It is not recorded in the manifest, "
+                                   f"so the next run loads it again.")
+            record_file(conn, raw_files[table_name], table_name, hashes[table_name], rows)
+    finally:
+        conn.close()
+        if writer is not None:
+            writer.close()
 
     print("[ETL] Pipeline complete.")
 
 
-def step_calculate_loyalty():
+def _etl_table(conn, table_name: str, frames, options: dict) -> tuple:
+    """Validate/load/save each raw frame of one table; return (rows loaded, complete).
+
+    ``complete`` is False if a frame failed to load (load_table reports the
+    error and returns 0); the remaining frames are skipped so the watermark
+    does not move past the rows that were lost.
+
+    Only one frame is held at a time (plus the few queued for the background
+    writer), so streamed chunks stay bounded. ``options`` is built by
+    step_run_etl.
+    """
+    incremental, refs, seen = options["incremental"], options["refs"], options["seen"]
+    load_options = options["load"]
+    pk = get_primary_key(conn, table_name)
+    # Writes go to the background writer when there is one, else run inline
+    write = options["writer"].submit if options["writer"] else lambda fn, *a, **kw: fn(*a, **kw)
+    rows = 0
+    # Rejects earlier runs recorded; a changed file re-reads its unchanged bad rows
+    recorded = recorded_rejects(conn, table_name) if incremental else None
+    # The first non-empty frame overwrites last run's file, later ones append
+    wrote_cleaned = wrote_rejected = incremental
+    for raw_df in frames:
+        if incremental:
+            raw_df = filter_new_rows(conn, raw_df, table_name,
+                                     skip_existing_keys=(load_options["mode"] == "append"))
+        cleaned_df, rejected_df = validate(raw_df, table_name)
+        if seen is None:
+            cleaned_df, dup_df = deduplicate_keys(cleaned_df, pk, table_name, options["duplicates"])
+            extra_rejects = [dup_df]
+        else:
+            cleaned_df, dup_df, superseded = seen.resolve(cleaned_df, table_name, pk, options["duplicates"])
+            extra_rejects = [dup_df, _remove_superseded(conn, table_name, superseded, cleaned_df.columns, options)]
+        if refs is not None:
+            cleaned_df, orphan_df = refs.check(cleaned_df, table_name)
+            extra_rejects.append(orphan_df)
+        extra_rejects = [r for r in extra_rejects if not r.empty]
+        if extra_rejects:
+            rejected_df = pd.concat([rejected_df] + extra_rejects, ignore_index=True)
+        if recorded is not None:
+            rejected_df = drop_recorded_rejects(rejected_df, recorded, table_name)
+
+        # Queue the file output first so it overlaps the database load
+        write(save_cleaned_csv, cleaned_df, table_name, append=wrote_cleaned,
+              fmt=options["output_format"])
+        write(save_rejected_csv, rejected_df, table_name, append=wrote_rejected,
+              fmt=options["output_format"])
+        wrote_cleaned = wrote_cleaned or not cleaned_df.empty
+        wrote_rejected = wrote_rejected or not rejected_df.empty
+
+        # Upserts can overwrite rows already counted in the aggregate tables
+        before = snapshot(conn, table_name, cleaned_df) if load_options["mode"] == "upsert" else None
+        loaded = load_table(cleaned_df, table_name, conn, **load_options)
+        if not loaded and not cleaned_df.empty:
+            return rows, False
+        load_rejects(rejected_df, table_name, conn)
+        if loaded:
+            apply_deltas(conn, table_name, cleaned_df, before)
+            update_watermark(conn, table_name, cleaned_df)
+            bump_generation(conn, table_name)
+            if refs is not None:
+                refs.add(table_name, cleaned_df)
+            rows += loaded
+    return rows, True
+
+
+def _remove_superseded(conn, table_name: str, keys: pd.DataFrame, columns, options: dict) -> pd.DataFrame:
+    """Take rows an earlier chunk loaded back out when a later copy of their key wins
+    ("last") or rejects them all ("reject"); return the latter as rejects (``columns`` only).
+
+    Only appends are undone: an upsert already replaces the earlier copy, and
+    deleting it could drop a row that existed before the run, so with
+    "reject" the earlier copy stays loaded.
+    """
+    if keys.empty:
+        return pd.DataFrame()
+    if options["load"]["mode"] != "append":
+        if options["duplicates"] == "reject":
+            print(f"[INTEGRITY] {table_name}: {len(keys)} rows loaded from earlier chunks kept "
+                  f"(upsert mode; only later copies rejected)")
+        return pd.DataFrame()
+    before = snapshot(conn, table_name, keys)
+    removed = remove_rows(conn, table_name, keys)
+    apply_deltas(conn, table_name, keys, before)
+    if options["duplicates"] != "reject" or removed.empty:
+        return pd.DataFrame()
+    if options["refs"] is not None:
+        options["refs"].discard(table_name, removed)
+    removed = removed[[c for c in columns if c in removed.columns]]
+    return removed.assign(reject_reason=f"duplicate_{'_'.join(keys.columns)}")
+
+
+def step_load_context(context: AnalyticsContext):
+    """Read the shared header before the analytics steps, when one of them needs every row.
+
+    Only loyalty does, while the ledger is empty; otherwise RFM segmentation
+    and the spend forecast aggregate in SQL, which is cheaper than the read.
+    Deciding here, ahead of them, keeps the choice independent of which
+    step runs first.
+    """
+    if ledger_empty(context.db_path):
+        context.header
+    else:
+        print("[CONTEXT] Loyalty ledger in use — the analytics aggregate in SQL.")
+
+
+def step_calculate_loyalty(context: AnalyticsContext = None):
     """Step 3: Loyalty points calculation."""
     print("\n" + "=" * 60)
     print("STEP 3: LOYALTY CALCULATION")
     print("=" * 60)
-    points_df = calculate_loyalty()
+    points_df = calculate_loyalty(context=context)
     if not points_df.empty:
         print(points_df.head(10).to_string(index=False))
 
 
-def step_perform_segmentation():
-    """Step 4: RFM segmentation."""
+def step_perform_segmentation(mode: str = "exact", context: AnalyticsContext = None):
+    """Step 4: RFM segmentation (``mode`` is one of RFM_MODES)."""
     print("\n" + "=" * 60)
     print("STEP 4: RFM SEGMENTATION")
     print("=" * 60)
-    rfm = perform_segmentation()
+    rfm = perform_segmentation(mode=mode, context=context)
     if not rfm.empty:
         print(rfm.head(10).to_string(index=False))
 
 
-def step_run_predictive():
-    """Step 5: Predictive analytics."""
+def _print_top(key: str, df: pd.DataFrame) -> None:
+    if not df.empty:
+        print(f"\n--- {key} (top 5) ---")
+        print(df.head(5).to_string(index=False))
+
+
+def step_predict_spend(context: AnalyticsContext = None):
+    """Step 5: Next-month spend forecast."""
+    print("\n" + "=" * 60)
+    print("STEP 5: SPEND FORECAST")
+    print("=" * 60)
+    _print_top("future_spend", predict_future_spend(context=context))
+
+
+def step_stock_out_risk():
+    """Step 6: Stock-out risk (sets products.restock_flag)."""
     print("\n" + "=" * 60)
-    print("STEP 5: PREDICTIVE ANALYTICS")
+    print("STEP 6: STOCK-OUT RISK")
     print("=" * 60)
-    results = run_predictive()
-    for key, df in results.items():
-        if not df.empty:
-            print(f"\n--- {key} (top 5) ---")
-            print(df.head(5).to_string(index=False))
+    _print_top("stock_out_risk", stock_out_risk())
+
+
+def step_promotion_sensitivity():
+    """Step 7: Promotion sensitivity per customer."""
+    print("\n" + "=" * 60)
+    print("STEP 7: PROMOTION SENSITIVITY")
+    print("=" * 60)
+    _print_top("promo_sensitivity", promotion_sensitivity())
 
 
 def step_launch_dashboard():
-    """Step 6: Generate dashboards for all stores (non-interactive)."""
+    """Step 8: Generate dashboards for all stores (non-interactive)."""
     print("\n" + "=" * 60)
-    print("STEP 6: DASHBOARD GENERATION")
+    print("STEP 8: DASHBOARD GENERATION")
     print("=" * 60)
     stores = list_stores()
     if stores.empty:
@@ -103,19 +311,208 @@ def step_launch_dashboard():
 
 
 
-def main():
+def pipeline_graph(args, context: AnalyticsContext) -> dict:
+    """The pipeline as node → (dependencies, step), in the order nodes start.
+
+    The analytics nodes only need the loaded data: they read it (loyalty,
+    segmentation and the spend forecast share ``context``, loaded by its own
+    node first) and write different customer_details / products columns, so
+    they can run at once.
+    """
+    analytics = ("loyalty", "segmentation", "spend_forecast", "stock_risk", "promo_sensitivity")
+    return {
+        "setup": ((), lambda: step_setup_database(incremental=args.incremental)),
+        "etl": (("setup",), lambda: step_run_etl(
+            chunksize=args.chunksize, workers=args.workers, use_cache=not args.no_cache,
+            incremental=args.incremental, check_fks=not args.skip_fk_check,
+            duplicates=args.duplicates, load_mode=args.load_mode,
+            load_pragmas=FAST_LOAD_PRAGMAS if args.fast_load else None,
+            rebuild_indexes=args.rebuild_indexes,
+            output_format=args.output_format, background_writes=not args.sync_writes,
+        )),
+        "context": (("etl",), lambda: step_load_context(context)),
+        "loyalty": (("context",), lambda: step_calculate_loyalty(context)),
+        "segmentation": (("context",), lambda: step_perform_segmentation(mode=args.rfm_mode, context=context)),
+        "spend_forecast": (("context",), lambda: step_predict_spend(context)),
+        "stock_risk": (("etl",), step_stock_out_risk),
+        "promo_sensitivity": (("etl",), step_promotion_sensitivity),
+        "dashboards": (analytics, step_launch_dashboard),
+    }
+
+
+class _StepOutput:
+    """sys.stdout stand-in that keeps each pipeline thread's prints in its own buffer.
+
+    Threads without a buffer (the main one) write straight through, so the
+    buffers can be printed whole as their steps finish.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+
+    def capture(self, buffer) -> None:
+        self._local.buffer = buffer
+
+    def _target(self):
+        buffer = getattr(self._local, "buffer", None)
+        return self.stream if buffer is None else buffer
+
+    def write(self, text: str) -> int:
+        return self._target().write(text)
+
+    def flush(self) -> None:
+        self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def _timed(step, output: _StepOutput = None, buffer=None) -> float:
+    if output is not None:
+        output.capture(buffer)
+    start = time.perf_counter()
+    try:
+        step()
+    finally:
+        if output is not None:
+            output.capture(None)
+    return time.perf_counter() - start
+
+
+def run_pipeline(graph: dict, jobs: int = 1) -> dict:
+    """Run every node of ``graph`` after its dependencies; return seconds per node.
+
+    Up to ``jobs`` nodes run at once on a thread pool; ready nodes start in
+    graph order, so ``jobs=1`` runs the pipeline sequentially. With more
+    than one job each node's output is buffered and printed in one piece when
+    it finishes, so concurrent steps do not interleave. After a failure no
+    further nodes start, and the error is re-raised once the running ones
+    have finished.
+    """
+    unknown = {dep for deps, _ in graph.values() for dep in deps} - graph.keys()
+    if unknown:
+        raise ValueError(f"Unknown pipeline dependencies: {sorted(unknown)}")
+    sorter = TopologicalSorter({name: deps for name, (deps, _) in graph.items()})
+    sorter.prepare()  # raises graphlib.CycleError
+
+    output = _StepOutput(sys.stdout) if jobs > 1 else None
+    timings, running, buffers, failure = {}, {}, {}, None
+    if output is not None:
+        sys.stdout = output
+    try:
+        with ThreadPoolExecutor(max_workers=max(jobs, 1), thread_name_prefix="pipeline") as pool:
+            while sorter.is_active():
+                if failure is None:
+                    for name in sorter.get_ready():
+                        buffers[name] = io.StringIO()
+                        running[pool.submit(_timed, graph[name][1], output, buffers[name])] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    if output is not None:
+                        output.stream.write(buffers.pop(name).getvalue())
+                    try:
+                        timings[name] = future.result()
+                    except Exception as e:
+                        print(f"[PIPELINE] {name} failed: {e}")
+                        failure = failure or e
+                        continue
+                    print(f"[PIPELINE] {name} finished in {timings[name]:.2f}s")
+                    sorter.done(name)
+    finally:
+        if output is not None:
+            sys.stdout = output.stream
+    if failure is not None:
+        raise failure
+    return timings
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Retail Analytics & Customer Intelligence pipeline")
+    parser.add_argument(
+        "--chunksize", type=int, nargs="?", const=DEFAULT_CHUNKSIZE, default=None,
+        help=f"stream raw files through the ETL in chunks of this many rows (default {DEFAULT_CHUNKSIZE})",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="number of processes used to parse raw workbooks (default: 1)",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help="always re-parse raw workbooks instead of using the parse cache",
+    )
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help="keep existing data and load only new files/rows (see etl_manifest)",
+    )
+    parser.add_argument(
+        "--duplicates", choices=DUPLICATE_POLICIES, default="first",
+        help="rows sharing a primary key: keep first, keep last, or reject all (default: first)",
+    )
+    parser.add_argument(
+        "--load-mode", choices=("append", "upsert"), default=None,
+        help="append rows, or upsert on primary key (default: upsert with --incremental)",
+    )
+    parser.add_argument(
+        "--fast-load", action="store_true",
+        help="load with WAL journal, synchronous=OFF and a large page cache",
+    )
+    parser.add_argument(
+        "--rebuild-indexes", action="store_true",
+        help="drop each table's indexes during its load and recreate them afterwards",
+    )
+    parser.add_argument(
+        "--output-format", choices=OUTPUT_FORMATS, default="csv",
+        help="format of data/cleaned and data/rejected output (parquet needs pyarrow)",
+    )
+    parser.add_argument(
+        "--sync-writes", action="store_true",
+        help="write cleaned/rejected files inline instead of on a background thread",
+    )
+    parser.add_argument(
+        "--query-backend", choices=BACKENDS, default=None,
+        help="engine for analytics/dashboard reads (default: sqlite; duckdb needs the duckdb package)",
+    )
+    parser.add_argument(
+        "--rfm-mode", choices=RFM_MODES, default="exact",
+        help="exact qcut over all customers, or incremental state + quantile sketches (default: exact)",
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=1,
+        help="pipeline nodes run at once; the analytics steps after the ETL are independent (default: 1)",
+    )
+    parser.add_argument(
+        "--skip-fk-check", action="store_true",
+        help="load rows even if their foreign keys reference unknown parents",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
     """Execute the full pipeline end-to-end."""
+    args = parse_args(argv)
+    if args.query_backend:
+        set_default_backend(args.query_backend)
+
     print("╔══════════════════════════════════════════════════════════╗")
     print("║   Retail Analytics & Customer Intelligence System       ║")
     print("╚══════════════════════════════════════════════════════════╝")
 
-    step_setup_database()
-    step_run_etl()
-    step_calculate_loyalty()
-    step_perform_segmentation()
-    step_run_predictive()
-    step_launch_dashboard()
+    # The analytics nodes share one read of each fact table
+    context = AnalyticsContext()
+    start = time.perf_counter()
+    try:
+        timings = run_pipeline(pipeline_graph(args, context), jobs=args.jobs)
+    finally:
+        context.close()
 
+    print(f"\n[PIPELINE] {len(timings)} nodes in {time.perf_counter() - start:.2f}s "
+          f"with {args.jobs} job(s):")
+    for name, seconds in timings.items():
+        print(f"    {name:<20}{seconds:>8.2f}s")
     print("\n  Pipeline finished successfully.")
 
 